@@ -0,0 +1,57 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from IIdle.cache import invalidate_user_data
+from IIdle.consts import USER_FIELDS_THAT_MIGHT_CHANGE
+from IIdle.engine import UNBOUNDED_FIELDS
+from IIdle.models import UserData, ActionEvent, BASELINE, stat_values
+
+# Stats are rounded to cents when they are read, the log keeps the exact changes
+TOLERANCE = 0.01
+POSITION_FIELDS = ('day', 'hour', 'failed_a_semester')
+
+
+def replay(user_id: int) -> dict:
+    """User data as the action log has it, starting from the values of a new user."""
+    state = {key: float(UserData._meta.get_field(key).default) for key in USER_FIELDS_THAT_MIGHT_CHANGE}
+    state.update({key: UserData._meta.get_field(key).default for key in POSITION_FIELDS})
+    events = (ActionEvent.objects.filter(user_id=user_id).order_by('id')
+              .values_list(*USER_FIELDS_THAT_MIGHT_CHANGE, *POSITION_FIELDS))
+    for event in events.iterator():
+        for key, change in zip(USER_FIELDS_THAT_MIGHT_CHANGE, event):
+            value = state[key] + change
+            state[key] = value if key in UNBOUNDED_FIELDS else min(max(value, 0), 100)
+        state.update(zip(POSITION_FIELDS, event[len(USER_FIELDS_THAT_MIGHT_CHANGE):]))
+    return state
+
+
+def differences(user_id: int) -> dict:
+    """Fields whose stored value doesn't match the action log, mapped to (stored, replayed)."""
+    user_data = UserData.objects.get(user_id=user_id)
+    stored = {**stat_values(user_data), **{key: getattr(user_data, key) for key in POSITION_FIELDS}}
+    replayed = replay(user_id)
+    return {
+        key: (value, replayed[key]) for key, value in stored.items()
+        if (abs(value - replayed[key]) >= TOLERANCE if key in USER_FIELDS_THAT_MIGHT_CHANGE else value != replayed[key])
+    }
+
+
+@transaction.atomic
+def rebuild(user_id: int):
+    """Overwrites the user data with the state replayed from the action log."""
+    # A catch-up committing in between would have its events replayed but its changes overwritten
+    UserData.objects.select_for_update().get(user_id=user_id)
+    replayed = replay(user_id)
+    for key in USER_FIELDS_THAT_MIGHT_CHANGE:
+        replayed[key] = Decimal(replayed[key])
+    UserData.objects.filter(user_id=user_id).update(**replayed, version=F('version') + 1)
+    invalidate_user_data(user_id)
+
+
+@transaction.atomic
+def add_baseline(user_id: int):
+    """Accepts the stored user data, by logging its difference to the replayed state."""
+    user_data = UserData.objects.select_for_update().get(user_id=user_id)
+    ActionEvent.from_change(user_id, BASELINE, replay(user_id), user_data).save()
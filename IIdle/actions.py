@@ -1,15 +1,21 @@
 from abc import ABC, abstractmethod
-from random import uniform, random
 from typing import Optional
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.db.models import F
 from django.db.models.functions import Greatest, Least
 
-from IIdle.consts import ECTS_TO_PASS_SEMESTER, LAST_SEMESTER, SCORE_TO_PASS
-from IIdle.models import UserData, ClassesTaken, CompletedCourses, Abilities, Message
+from IIdle.cache import invalidate_user_data
+from IIdle.consts import (ECTS_TO_PASS_SEMESTER, LAST_SEMESTER, SCORE_TO_PASS, USER_FIELDS_THAT_MIGHT_CHANGE,
+                          HOURS_IN_DAY, DAYS_IN_FORTNIGHT, MEMORY_ENGINE, EXAM_LUCK, ATTENDANCE_TO_TAKE_EXAM)
+from IIdle.engine import UserState
+from IIdle.messages import (Event, TOO_TIRED, ACTION_DONE, DAY_ENDED, DAY_ENDED_WITHOUT_FUNDS, SEMESTER_PASSED,
+                            SEMESTER_FAILED, EXAM_PASSED, EXAM_FLUNKED, NEW_ABILITY, stat_changes, to_cents)
+from IIdle.models import UserData, ClassesTaken, CompletedCourses, Abilities, Message, bump_state_version
+from IIdle.rng import uniform, random
 
-USER_FIELDS_THAT_MIGHT_CHANGE = ['cash', 'energy', 'mood', 'math', 'programming', 'algorithms', 'work_experience']
+TOO_TIRED_MESSAGE = Event(TOO_TIRED)
 
 
 def get_mood_factor(mood):
@@ -28,37 +34,75 @@ def get_mood_factor(mood):
     return 1.25
 
 
+def clamp(value: float, lowest: float = 0, highest: float = 100) -> float:
+    return min(max(value, lowest), highest)
+
+
+def uses_memory_engine() -> bool:
+    return settings.IIDLE_ENGINE == MEMORY_ENGINE
+
+
 def get_state_before_action(user_data: UserData) -> dict:
     return {key: getattr(user_data, key) for key in USER_FIELDS_THAT_MIGHT_CHANGE}
 
 
-def get_message(user_data: UserData, previous_values: dict, action_name: str) -> str:
+def ects_to_pass(semester: int) -> int:
+    return ECTS_TO_PASS_SEMESTER * semester - (10 if semester != LAST_SEMESTER else 0)
+
+
+def format_message(current_values: dict, previous_values: dict, action_name: str) -> Event:
+    return Event(ACTION_DONE, action_name, stat_changes(current_values, previous_values))
+
+
+def get_message(user_data: UserData, previous_values: dict, action_name: str) -> Event:
     user_data.refresh_from_db()
-    acc = []
-    for key in USER_FIELDS_THAT_MIGHT_CHANGE:
-        stat_change = getattr(user_data, key) - previous_values[key]
-        if stat_change != 0:
-            acc.append(f'{key.title()}: {stat_change}')
-    stat_change_test = f'Stats changed - {" ".join(acc)}.' if acc else 'None of your stats changed!'
-    return f'You have {action_name}. {stat_change_test}'
+    return format_message(get_state_before_action(user_data), previous_values, action_name)
 
 
 def energy_decorator(action):
     def inner(cls: Action, user: User):
         if user.data.energy < 10:
-            Message.objects.create(user=user, text='You were too tired to do what you had planned!')
+            Message.from_event(user, TOO_TIRED_MESSAGE).save()
         else:
             action(cls, user)
 
     return inner
 
 
+def state_energy_decorator(action):
+    def inner(cls: Action, state: UserState):
+        if state.energy < 10:
+            state.add_message(TOO_TIRED_MESSAGE)
+        else:
+            action(cls, state)
+
+    return inner
+
+
+def learn(state: UserState, skill: str, action_name: str):
+    stats_before_action = state.stats()
+    mood_factor = get_mood_factor(state.mood)
+    state.energy = max(state.energy - uniform(0.5, 2), 0)
+    setattr(state, skill, min(getattr(state, skill) + uniform(0.2, 0.3) * mood_factor, 100))
+    state.mood = clamp(state.mood + uniform(-2, 0.5))
+    state.add_message(format_message(state.stats(), stats_before_action, action_name))
+
+
 class Action(ABC):
     name: str
     time: Optional[tuple]
 
     @classmethod
     def process(cls, user: User):
+        if uses_memory_engine():
+            state = UserState.load(user)
+            cls.simulate(state)
+            state.save()
+        else:
+            cls.process_in_db(user)
+
+    @classmethod
+    def process_in_db(cls, user: User):
         cls.process_action(user)
         day_change, next_hour = divmod(user.data.hour + 1, 24)
         next_day = user.data.day + day_change
@@ -77,8 +121,40 @@ class Action(ABC):
         user.data.save()
 
     @classmethod
-    @abstractmethod
+    def simulate(cls, state: UserState):
+        cls.apply_action(state)
+        day_change, next_hour = divmod(state.hour + 1, HOURS_IN_DAY)
+        next_day = state.day + day_change
+        failed_semester = state.failed_a_semester
+        if day_change:
+            EndDay.apply_action(state)
+            if state.day // DAYS_IN_FORTNIGHT != next_day // DAYS_IN_FORTNIGHT:
+                FinishSemester.apply_action(state)
+        if failed_semester and not state.failed_a_semester:  # Failed again
+            state.day = 0
+        else:
+            state.day = next_day
+        state.hour = next_hour
+
+    @classmethod
     def process_action(cls, user: User):
+        if uses_memory_engine():
+            state = UserState.load(user)
+            cls.apply_action(state)
+            state.save()
+        else:
+            cls.process_action_in_db(user)
+            bump_state_version(user.pk)
+            invalidate_user_data(user.pk)
+
+    @classmethod
+    @abstractmethod
+    def process_action_in_db(cls, user: User):
+        pass
+
+    @classmethod
+    @abstractmethod
+    def apply_action(cls, state: UserState):
         pass
 
 
@@ -87,13 +163,20 @@ class Sleep(Action):
     time = None
 
     @classmethod
-    def process_action(cls, user: User):
+    def process_action_in_db(cls, user: User):
         user_data = UserData.objects.get(user=user)
         stats_before_action = get_state_before_action(user_data)
         user_data.energy = Least(F('energy') + uniform(2, 4), 100)
         user_data.mood = Least(Greatest(F('mood') + uniform(-0.1, 1), 0), 100)
         user_data.save()
-        Message.objects.create(user=user, text=get_message(user_data, stats_before_action, 'Slept'))
+        Message.from_event(user, get_message(user_data, stats_before_action, cls.name)).save()
+
+    @classmethod
+    def apply_action(cls, state: UserState):
+        stats_before_action = state.stats()
+        state.energy = min(state.energy + uniform(2, 4), 100)
+        state.mood = clamp(state.mood + uniform(-0.1, 1))
+        state.add_message(format_message(state.stats(), stats_before_action, cls.name))
 
 
 class Work(Action):
@@ -103,7 +186,7 @@ class Work(Action):
 
     @classmethod
     @energy_decorator
-    def process_action(cls, user: User):
+    def process_action_in_db(cls, user: User):
         user_data = UserData.objects.get(user=user)
         stats_before_action = get_state_before_action(user_data)
         user_data.energy = Greatest(F('energy') - uniform(1.5, 4.5), 0)
@@ -115,7 +198,18 @@ class Work(Action):
         user_data.work_experience = F('work_experience') + uniform(0.25, 0.5) * get_mood_factor(user_data.mood)
         user_data.mood = Least(Greatest(F('mood') + uniform(-2, 0.5), 0), 100)
         user_data.save()
-        Message.objects.create(user=user, text=get_message(user_data, stats_before_action, 'Worked'))
+        Message.from_event(user, get_message(user_data, stats_before_action, cls.name)).save()
+
+    @classmethod
+    @state_energy_decorator
+    def apply_action(cls, state: UserState):
+        stats_before_action = state.stats()
+        mood_factor = get_mood_factor(state.mood)
+        state.energy = max(state.energy - uniform(1.5, 4.5), 0)
+        state.cash += uniform(0.75, 1.25) * cls.wage * (state.work_experience + 50) / 100 * mood_factor
+        state.work_experience = min(state.work_experience + uniform(0.25, 0.5) * mood_factor, 100)
+        state.mood = clamp(state.mood + uniform(-2, 0.5))
+        state.add_message(format_message(state.stats(), stats_before_action, cls.name))
 
 
 class LearnMath(Action):
@@ -124,14 +218,19 @@ class LearnMath(Action):
 
     @classmethod
     @energy_decorator
-    def process_action(cls, user: User):
+    def process_action_in_db(cls, user: User):
         user_data = UserData.objects.get(user=user)
         stats_before_action = get_state_before_action(user_data)
         user_data.energy = Greatest(F('energy') - uniform(0.5, 2), 0)
         user_data.math = Least(F('math') + uniform(0.2, 0.3) * get_mood_factor(user_data.mood), 100)
         user_data.mood = Least(Greatest(F('mood') + uniform(-2, 0.5), 0), 100)
         user_data.save()
-        Message.objects.create(user=user, text=get_message(user_data, stats_before_action, 'Learned Math'))
+        Message.from_event(user, get_message(user_data, stats_before_action, cls.name)).save()
+
+    @classmethod
+    @state_energy_decorator
+    def apply_action(cls, state: UserState):
+        learn(state, 'math', cls.name)
 
 
 class LearnProgramming(Action):
@@ -140,14 +239,19 @@ class LearnProgramming(Action):
 
     @classmethod
     @energy_decorator
-    def process_action(cls, user: User):
+    def process_action_in_db(cls, user: User):
         user_data = UserData.objects.get(user=user)
         stats_before_action = get_state_before_action(user_data)
         user_data.energy = Greatest(F('energy') - uniform(0.5, 2), 0)
         user_data.programming = Least(F('programming') + uniform(0.2, 0.3) * get_mood_factor(user_data.mood), 100)
         user_data.mood = Least(Greatest(F('mood') + uniform(-2, 0.5), 0), 100)
         user_data.save()
-        Message.objects.create(user=user, text=get_message(user_data, stats_before_action, 'Learned Programming'))
+        Message.from_event(user, get_message(user_data, stats_before_action, cls.name)).save()
+
+    @classmethod
+    @state_energy_decorator
+    def apply_action(cls, state: UserState):
+        learn(state, 'programming', cls.name)
 
 
 class LearnAlgorithms(Action):
@@ -156,14 +260,19 @@ class LearnAlgorithms(Action):
 
     @classmethod
     @energy_decorator
-    def process_action(cls, user: User):
+    def process_action_in_db(cls, user: User):
         user_data = UserData.objects.get(user=user)
         stats_before_action = get_state_before_action(user_data)
         user_data.energy = Greatest(F('energy') - uniform(0.5, 2), 0)
         user_data.algorithms = Least(F('algorithms') + uniform(0.2, 0.3) * get_mood_factor(user_data.mood), 100)
         user_data.mood = Least(Greatest(F('mood') + uniform(-2, 0.5), 0), 100)
         user_data.save()
-        Message.objects.create(user=user, text=get_message(user_data, stats_before_action, 'Learned Algorithms'))
+        Message.from_event(user, get_message(user_data, stats_before_action, cls.name)).save()
+
+    @classmethod
+    @state_energy_decorator
+    def apply_action(cls, state: UserState):
+        learn(state, 'algorithms', cls.name)
 
 
 class Relax(Action):
@@ -171,12 +280,18 @@ class Relax(Action):
     time = None
 
     @classmethod
-    def process_action(cls, user: User):
+    def process_action_in_db(cls, user: User):
         user_data = UserData.objects.get(user=user)
         stats_before_action = get_state_before_action(user_data)
         user_data.mood = Least(F('mood') + uniform(1, 2), 100)
         user_data.save()
-        Message.objects.create(user=user, text=get_message(user_data, stats_before_action, 'Relaxed'))
+        Message.from_event(user, get_message(user_data, stats_before_action, cls.name)).save()
+
+    @classmethod
+    def apply_action(cls, state: UserState):
+        stats_before_action = state.stats()
+        state.mood = min(state.mood + uniform(1, 2), 100)
+        state.add_message(format_message(state.stats(), stats_before_action, cls.name))
 
 
 class Party(Action):
@@ -185,13 +300,21 @@ class Party(Action):
 
     @classmethod
     @energy_decorator
-    def process_action(cls, user: User):
+    def process_action_in_db(cls, user: User):
         user_data = UserData.objects.get(user=user)
         stats_before_action = get_state_before_action(user_data)
         user_data.energy = Least(Greatest(F('energy') + uniform(-2, 1), 0), 100)
         user_data.mood = Least(Greatest(F('mood') + uniform(-1, 7), 0), 100)
         user_data.save()
-        Message.objects.create(user=user, text=get_message(user_data, stats_before_action, 'Partied'))
+        Message.from_event(user, get_message(user_data, stats_before_action, cls.name)).save()
+
+    @classmethod
+    @state_energy_decorator
+    def apply_action(cls, state: UserState):
+        stats_before_action = state.stats()
+        state.energy = clamp(state.energy + uniform(-2, 1))
+        state.mood = clamp(state.mood + uniform(-1, 7))
+        state.add_message(format_message(state.stats(), stats_before_action, cls.name))
 
 
 class EndDay(Action):
@@ -199,7 +322,7 @@ class EndDay(Action):
     time = tuple()
 
     @classmethod
-    def process_action(cls, user: User):
+    def process_action_in_db(cls, user: User):
         user_data = UserData.objects.get(user=user)
         cash = user_data.cash
         mood = user_data.mood
@@ -212,17 +335,27 @@ class EndDay(Action):
         user_data.save()
         user_data.refresh_from_db()
         if user_data.cash == cash:
-            Message.objects.create(
-                user=user,
-                text=f"A day has ended but you didn't have enough funds to support yourself. "
-                     f'Your energy changed by: {user_data.energy - energy} '
-                     f'and your mood changed by: {user_data.mood - mood}.'
-            )
+            event = Event(DAY_ENDED_WITHOUT_FUNDS, payload=(to_cents(user_data.energy - energy),
+                                                            to_cents(user_data.mood - mood)))
         else:
-            Message.objects.create(
-                user=user,
-                text=f'A day has ended. You have spent: {-(user_data.cash - cash)}'
-            )
+            event = Event(DAY_ENDED, payload=(to_cents(-(user_data.cash - cash)),))
+        Message.from_event(user, event).save()
+
+    @classmethod
+    def apply_action(cls, state: UserState):
+        stats_before_action = state.stats()
+        if state.cash >= 100:
+            state.cash -= 100
+            spent = stats_before_action['cash'] - state.stats()['cash']
+            state.add_message(Event(DAY_ENDED, payload=(to_cents(spent),)))
+            return
+        state.mood = max(state.mood - 10, 0)
+        state.energy = max(state.energy - 10, 0)
+        stats = state.stats()
+        state.add_message(Event(DAY_ENDED_WITHOUT_FUNDS, payload=(
+            to_cents(stats['energy'] - stats_before_action['energy']),
+            to_cents(stats['mood'] - stats_before_action['mood']),
+        )))
 
 
 class FinishSemester(Action):
@@ -230,29 +363,58 @@ class FinishSemester(Action):
     time = tuple()
 
     @classmethod
-    def process_action(cls, user: User):
-        classes_with_good_attendance = ClassesTaken.objects.filter(user=user, times_present__gte=10)
-        for class_ in classes_with_good_attendance:
-            if CompletedCourses.objects.filter(course=class_.course).exists():
+    def process_action_in_db(cls, user: User):
+        user_data = UserData.objects.get(user=user)
+        completed_courses = set(CompletedCourses.objects.filter(user=user).values_list('course', flat=True))
+        abilities = set(Abilities.objects.filter(user=user).values_list('ability', flat=True))
+        classes_with_good_attendance = (ClassesTaken.objects
+                                        .filter(user=user, times_present__gte=ATTENDANCE_TO_TAKE_EXAM)
+                                        .order_by('id').values_list('course', flat=True))
+        passed_courses = []
+        messages = []
+        for course in classes_with_good_attendance:
+            if course in completed_courses:
                 continue
-            ACTION_TO_CLASS[class_.course].process_exam(user)
+            class_ = ACTION_TO_CLASS[course]
+            passed = class_.passes_exam(user_data, abilities)
+            if passed:
+                passed_courses.append(course)
+            messages.append(class_.exam_message(passed))
+        CompletedCourses.objects.bulk_create(CompletedCourses(user=user, course=course) for course in passed_courses)
+        completed_courses.update(passed_courses)
         ClassesTaken.objects.filter(user=user).delete()
 
-        user_data = UserData.objects.get(user=user)
         semester = user_data.semester()
+        if semester != LAST_SEMESTER:
+            total_ects = sum(ACTION_TO_CLASS[course].ects for course in completed_courses)
+            failed = total_ects < ects_to_pass(semester)
+            if failed:
+                if user_data.failed_a_semester:
+                    CompletedCourses.objects.filter(user=user).delete()
+                UserData.objects.filter(user=user).update(failed_a_semester=not user_data.failed_a_semester)
+            messages.append(Event(SEMESTER_FAILED if failed else SEMESTER_PASSED))
+        Message.objects.bulk_create(Message.from_event(user, event) for event in messages)
+
+    @classmethod
+    def apply_action(cls, state: UserState):
+        for course, times_present in state.attendance.items():
+            if times_present >= ATTENDANCE_TO_TAKE_EXAM and course not in state.completed_courses:
+                ACTION_TO_CLASS[course].apply_exam(state)
+        state.attendance.clear()
+
+        semester = state.semester()
         if semester == LAST_SEMESTER:
             return
-        total_ects = sum(ACTION_TO_CLASS[class_.course].ects for class_ in CompletedCourses.objects.filter(user=user))
-        failed = total_ects < ECTS_TO_PASS_SEMESTER * semester - (10 if semester != LAST_SEMESTER else 0)
+        total_ects = sum(ACTION_TO_CLASS[course].ects for course in state.completed_courses)
+        failed = total_ects < ects_to_pass(semester)
         if failed:
-            if user_data.failed_a_semester:
-                CompletedCourses.objects.filter(user=user).delete()
-                user_data.failed_a_semester = False
+            if state.failed_a_semester:
+                state.completed_courses.clear()
+                state.failed_a_semester = False
             else:
-                user_data.failed_a_semester = True
-            user_data.save()
+                state.failed_a_semester = True
 
-        Message.objects.create(user=user, text=f'A semester has ended. You have {"failed" if failed else "passed"}!')
+        state.add_message(Event(SEMESTER_FAILED if failed else SEMESTER_PASSED))
 
 
 class Class(Action, ABC):
@@ -263,26 +425,40 @@ class Class(Action, ABC):
     exam_factor: float
 
     @classmethod
-    def process_exam(cls, user: User):
-        user_data = UserData.objects.get(user=user)
-        ability_bonuses = sum(values['exam_weight']
-                              for ability, values in cls.abilities
-                              if Abilities.objects.filter(user=user, ability=ability).exists())
-        score = (uniform(0.75, 1.25)
-                 * float(sum(getattr(user_data, skill) for skill, _ in cls.skills))
-                 * cls.exam_factor
-                 + ability_bonuses)
-        passed = score >= SCORE_TO_PASS
+    def exam_score_parts(cls, stats, abilities: set) -> (float, float):
+        """The part of the exam score that luck multiplies and the bonus for abilities added to it."""
+        ability_bonuses = sum(values['exam_weight'] for ability, values in cls.abilities if ability in abilities)
+        return float(sum(getattr(stats, skill) for skill, _ in cls.skills)) * cls.exam_factor, ability_bonuses
+
+    @classmethod
+    def passes_exam(cls, stats, abilities: set) -> bool:
+        skills_score, ability_bonuses = cls.exam_score_parts(stats, abilities)
+        return uniform(*EXAM_LUCK) * skills_score + ability_bonuses >= SCORE_TO_PASS
+
+    @classmethod
+    def pass_probability(cls, stats, abilities: set) -> float:
+        # The only roll is the uniform luck, so the chance is the part of its range that is enough to pass
+        skills_score, ability_bonuses = cls.exam_score_parts(stats, abilities)
+        if skills_score <= 0:
+            return float(ability_bonuses >= SCORE_TO_PASS)
+        luck_needed = (SCORE_TO_PASS - ability_bonuses) / skills_score
+        lowest, highest = EXAM_LUCK
+        return min(max((highest - luck_needed) / (highest - lowest), 0.0), 1.0)
+
+    @classmethod
+    def exam_message(cls, passed: bool) -> Event:
+        return Event(EXAM_PASSED if passed else EXAM_FLUNKED, cls.name)
+
+    @classmethod
+    def apply_exam(cls, state: UserState):
+        passed = cls.passes_exam(state, state.abilities)
         if passed:
-            CompletedCourses.objects.create(user=user, course=cls.name)
-        Message.objects.create(
-            user=user,
-            text=f'You have taken a(n) {cls.name} exam. You have {"passed!" if passed else "flunked :("}'
-        )
+            state.completed_courses.add(cls.name)
+        state.add_message(cls.exam_message(passed))
 
     @classmethod
     @energy_decorator
-    def process_action(cls, user: User):
+    def process_action_in_db(cls, user: User):
         class_, _ = ClassesTaken.objects.get_or_create(user=user, course=cls.name)
         class_.times_present = F('times_present') + 1
         class_.save()
@@ -299,14 +475,35 @@ class Class(Action, ABC):
         user_data.energy = Greatest(F('energy') + uniform(-1.0, -0.1), 0)
         user_data.save()
 
-        Message.objects.create(user=user, text=get_message(
-            user_data, stats_before_action, f'attended {cls.name} class'
-        ))
+        Message.from_event(user, get_message(user_data, stats_before_action, cls.name)).save()
         for ability, values in cls.abilities:
             if random() < values['chance']:
                 instance, created = Abilities.objects.get_or_create(user=user, ability=ability)
                 if created:
-                    Message.objects.create(user=user, text=f'You have earned a new ability: {ability}.')
+                    Message.from_event(user, Event(NEW_ABILITY, ability)).save()
+
+    @classmethod
+    @state_energy_decorator
+    def apply_action(cls, state: UserState):
+        state.attendance[cls.name] = state.attendance.get(cls.name, 0) + 1
+
+        stats_before_action = state.stats()
+        mood_factor = get_mood_factor(state.mood)
+        semester_factor = max(state.semester() + 1 - cls.semester, 1)
+        for skill, values in cls.skills:
+            gain = (values['random_factor']()
+                    * mood_factor
+                    / semester_factor
+                    / (2 if getattr(state, skill) > values['threshold'] else 1))
+            setattr(state, skill, min(getattr(state, skill) + gain, 100))
+        state.mood = clamp(state.mood + uniform(-1.5, 0.5))
+        state.energy = max(state.energy + uniform(-1.0, -0.1), 0)
+
+        state.add_message(format_message(state.stats(), stats_before_action, cls.name))
+        for ability, values in cls.abilities:
+            if random() < values['chance'] and ability not in state.abilities:
+                state.add_ability(ability)
+                state.add_message(Event(NEW_ABILITY, ability))
 
 
 # I SEMESTER
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from IIdle.cache import token_key, get_user_data
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Keeps the user id of tokens in the cache for IIDLE_TOKEN_CACHE_SECONDS, deleting a token (e.g. logging out)
+    drops it from the cache. The user comes from the user data cache, which saving the user drops, so whether they
+    are active is checked on every request.
+    """
+
+    def authenticate_credentials(self, key):
+        user_id = cache.get(token_key(key))
+        if user_id is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(token_key(key), user.pk, settings.IIDLE_TOKEN_CACHE_SECONDS)
+            return user, token
+        user_data = get_user_data(user_id)
+        if user_data is None or not user_data.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        token = Token.from_db(None, ['key', 'user_id'], [key, user_id])
+        token.user = user_data.user
+        return user_data.user, token
@@ -0,0 +1,65 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from typing import Optional
+
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from IIdle.models import Message
+
+
+def encode_cursor(message: Message) -> str:
+    return urlsafe_b64encode(str(message.pk).encode()).decode()
+
+
+def decode_cursor(cursor: str, parameter: str = 'since') -> int:
+    try:
+        # Cursors used to be "time|id", the id alone still points at the same message
+        return int(urlsafe_b64decode(cursor.encode()).decode().rpartition('|')[2])
+    except (BinasciiError, UnicodeError, ValueError):
+        raise ValidationError({parameter: 'Invalid cursor.'})
+
+
+def parse_page_size(limit: Optional[str]) -> int:
+    if limit is None:
+        return settings.IIDLE_MESSAGES_PAGE_SIZE
+    try:
+        page_size = int(limit)
+    except ValueError:
+        raise ValidationError({'limit': 'A whole number is required.'})
+    if not 1 <= page_size <= settings.IIDLE_MESSAGES_MAX_PAGE_SIZE:
+        raise ValidationError({'limit': f'Has to be between 1 and {settings.IIDLE_MESSAGES_MAX_PAGE_SIZE}.'})
+    return page_size
+
+
+def paginate_messages(user_id: int, since: Optional[str], page_size: int,
+                      before: Optional[str] = None) -> (list, Optional[str], bool, Optional[str]):
+    """
+    Keyset pagination on id. Without a cursor returns the latest page, with `since` the page that follows it and with
+    `before` the page that comes right before it.
+    Returns the messages in chronological order, the cursor to fetch newer ones with, whether there are newer ones and
+    the cursor to fetch older ones with, None when the page starts the history.
+    The time of a message is set before its transaction commits, so a message that commits later can have an earlier
+    time than one a client has already seen. Ids are handed out as writers commit (SQLite has one writer at a time),
+    so messages are never inserted behind a cursor.
+    """
+    if since is not None and before is not None:
+        raise ValidationError({'before': 'Can only be used without since.'})
+    messages = Message.objects.filter(user_id=user_id)
+    if since is None:
+        if before is not None:
+            messages = messages.filter(id__lt=decode_cursor(before, 'before'))
+        page = list(messages.order_by('-id')[:page_size + 1])[::-1]
+        has_older = len(page) > page_size
+        page = page[-page_size:]
+        # The message of the `before` cursor comes after the page
+        has_more = before is not None and bool(page)
+    else:
+        newer = messages.filter(id__gt=decode_cursor(since))
+        page = list(newer.order_by('id')[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        # The message of the cursor itself is older
+        has_older = bool(page)
+    cursor = encode_cursor(page[-1]) if page else since
+    return page, cursor, has_more, encode_cursor(page[0]) if has_older else None
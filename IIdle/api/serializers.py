@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework import serializers
 
 from IIdle.actions import ACTION_TO_CLASS
+from IIdle.api.pagination import paginate_messages
 from IIdle.models import UserData, Timetable, CompletedCourses, ClassesTaken, Abilities, Message
 
 
@@ -17,7 +19,8 @@ class UserDataSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = UserData
-        fields = '__all__'
+        # Bookkeeping of the server, the version reaches clients as the ETag
+        exclude = ('next_due', 'version')
 
     def get_semester(self, obj):
         return obj.semester()
@@ -31,6 +34,9 @@ class TimetableSerializer(serializers.ModelSerializer):
         exclude = ('id', 'user')
 
     def get_hour(self, obj):
+        # Every entry shows the user's current hour, views look it up once and pass it in the context
+        if 'hour' in self.context:
+            return self.context['hour']
         return obj.user.data.hour
 
 
@@ -58,6 +64,30 @@ class AbilitiesSerializer(serializers.ModelSerializer):
 
 
 class MessageSerializer(serializers.ModelSerializer):
+    text = serializers.SerializerMethodField()
+
     class Meta:
         model = Message
-        exclude = ('id', 'user', 'time')
+        fields = ['text']
+
+    def get_text(self, obj):
+        return obj.render()
+
+
+class GameStateSerializer(serializers.ModelSerializer):
+    userdata = UserDataSerializer(source='data')
+    timetable = TimetableSerializer(source='timetable_set', many=True)
+    courses = CompletedCoursesSerializer(source='completedcourses_set', many=True)
+    classes = ClassesTakenSerializer(source='classestaken_set', many=True)
+    abilities = AbilitiesSerializer(source='abilities_set', many=True)
+    messages = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ['userdata', 'timetable', 'courses', 'classes', 'abilities', 'messages']
+
+    def get_messages(self, obj):
+        # The latest page like /messages/<pk>/ without a cursor, older ones aren't part of the state
+        messages, cursor, has_more, before = paginate_messages(obj.pk, None, settings.IIDLE_MESSAGES_PAGE_SIZE)
+        return {'results': MessageSerializer(messages, many=True).data, 'cursor': cursor, 'has_more': has_more,
+                'before': before}
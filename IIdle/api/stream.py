@@ -0,0 +1,297 @@
+"""
+Server-sent events of /stream/<pk>/, served by backend/asgi.py.
+
+Connected clients only wait on a queue. A single scheduler per process wakes up when the earliest next_due of the
+connected users comes, catches up on their timetables in the read pool and pushes what changed to their clients.
+Writes of other processes are picked up by a rescan of all connected users every IIDLE_STREAM_RESCAN_SECONDS, in a
+single query.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import re
+from time import time
+from typing import Optional
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.encoders import JSONEncoder
+
+from IIdle.api.authentication import CachedTokenAuthentication
+from IIdle.api.pagination import paginate_messages
+from IIdle.api.serializers import UserDataSerializer, MessageSerializer
+from IIdle.api.views import run_in_read_pool, process_timetable_wrapper
+from IIdle.cache import get_user_data
+from IIdle.models import UserData
+from IIdle.signals import state_changed
+
+STREAM_PATH = re.compile(r'^/stream/(?P<pk>\d+)/$')
+# Entries can come due before the worker (`process_timetables`) has processed them, they are looked at again then
+RETRY_SECONDS = 1
+RESCAN_BATCH_SIZE = 500
+DISCONNECTED = None
+
+logger = logging.getLogger(__name__)
+
+
+def authenticate(headers: dict, query_string: bytes, pk: int) -> (int, Optional[str]):
+    """Status and error of the request, EventSource can't send headers so the token can be passed as ?token= too."""
+    keyword, _, key = headers.get(b'authorization', b'').decode().partition(' ')
+    if keyword != 'Token':
+        key = parse_qs(query_string.decode()).get('token', [''])[0]
+    if not key:
+        return 401, 'Authentication credentials were not provided.'
+    try:
+        user, _ = CachedTokenAuthentication().authenticate_credentials(key)
+    except AuthenticationFailed as error:
+        return 401, str(error.detail)
+    if user.pk != pk:
+        return 403, 'You do not have permission to perform this action.'
+    return 200, None
+
+
+def poll(user_id: int, version: Optional[int], cursor: Optional[str], initial: bool = False) -> Optional[dict]:
+    """Catches up on the timetable and returns the user data and new messages, if the version has changed."""
+    # Polls follow writes the cache of this process may not have heard of (other processes, the worker), so they
+    # read the row itself, without dropping the snapshot the other readers share
+    user_data = process_timetable_wrapper(user_id, fresh=True) or get_user_data(user_id, fresh=True)
+    if user_data is None:
+        return None
+    changes = {'version': user_data.version, 'next_due': user_data.next_due}
+    if user_data.version == version:
+        return changes
+    messages = []
+    if initial:
+        # Clients get the messages they already have from /messages/<pk>/
+        _, cursor, _, _ = paginate_messages(user_id, None, 1)
+    else:
+        has_more = True
+        while has_more:
+            page, cursor, has_more, _ = paginate_messages(user_id, cursor, settings.IIDLE_MESSAGES_MAX_PAGE_SIZE)
+            messages += page
+    changes.update(user_data=UserDataSerializer(user_data).data, cursor=cursor,
+                   messages=MessageSerializer(messages, many=True).data)
+    return changes
+
+
+def versions(user_ids: list) -> list:
+    return [
+        row for start in range(0, len(user_ids), RESCAN_BATCH_SIZE)
+        for row in UserData.objects.filter(user_id__in=user_ids[start:start + RESCAN_BATCH_SIZE])
+        .values_list('user_id', 'version', 'next_due')
+    ]
+
+
+def event(name: str, data: dict) -> bytes:
+    return f'event: {name}\ndata: {json.dumps(data, cls=JSONEncoder)}\n\n'.encode()
+
+
+class UserStream:
+    def __init__(self, snapshot: dict):
+        self.clients = set()
+        self.version = snapshot['version']
+        self.user_data = snapshot['user_data']
+        self.cursor = snapshot['cursor']
+        self.due = None
+
+    def state(self) -> bytes:
+        return event('state', {'userdata': self.user_data, 'cursor': self.cursor})
+
+    def update(self, changes: dict):
+        if changes['version'] == self.version:
+            return
+        user_data = changes['user_data']
+        update = event('update', {
+            'userdata': {key: value for key, value in user_data.items() if self.user_data.get(key) != value},
+            'messages': changes['messages'],
+            'cursor': changes['cursor'],
+        })
+        self.version, self.user_data, self.cursor = changes['version'], user_data, changes['cursor']
+        for queue in self.clients:
+            queue.put_nowait(update)
+
+
+class StreamHub:
+    def __init__(self):
+        self.loop = None
+        self.streams = {}
+        self.due = []
+        self.refreshing = set()
+        self.stale = set()
+        self.wake_up = None
+        self.scheduler = None
+
+    def start(self):
+        # One scheduler per event loop, streams of a loop that is gone are dropped with it
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop, self.streams, self.due = loop, {}, []
+        self.refreshing, self.stale = set(), set()
+        self.wake_up = asyncio.Event()
+        self.scheduler = loop.create_task(self.run())
+
+    async def run(self):
+        next_rescan = time() + settings.IIDLE_STREAM_RESCAN_SECONDS
+        while True:
+            now = time()
+            while self.due and self.due[0][0] <= now:
+                due, user_id = heapq.heappop(self.due)
+                stream = self.streams.get(user_id)
+                # Entries of users that were rescheduled or have left are dropped here
+                if stream is not None and stream.due == due:
+                    stream.due = None
+                    self.refresh(user_id)
+            if now >= next_rescan:
+                next_rescan = now + settings.IIDLE_STREAM_RESCAN_SECONDS
+                if self.streams:
+                    self.loop.create_task(self.rescan())
+            wake_at = min(self.due[0][0], next_rescan) if self.due else next_rescan
+            self.wake_up.clear()
+            try:
+                await asyncio.wait_for(self.wake_up.wait(), wake_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+    def schedule(self, user_id: int, next_due):
+        stream = self.streams.get(user_id)
+        if stream is None:
+            return
+        due = None if next_due is None else next_due.timestamp()
+        if due is not None and due <= time():
+            due = time() + RETRY_SECONDS
+        if stream.due == due:
+            return
+        stream.due = due
+        if due is not None:
+            heapq.heappush(self.due, (due, user_id))
+            if self.due[0] == (due, user_id):
+                self.wake_up.set()
+
+    def refresh(self, user_id: int):
+        if user_id in self.refreshing:
+            self.stale.add(user_id)
+            return
+        self.refreshing.add(user_id)
+        self.loop.create_task(self._refresh(user_id))
+
+    async def _refresh(self, user_id: int):
+        try:
+            while user_id in self.streams:
+                self.stale.discard(user_id)
+                try:
+                    changes = await run_in_read_pool(poll, user_id, self.streams[user_id].version,
+                                                     self.streams[user_id].cursor)
+                except Exception:
+                    logger.exception('Streaming the state of user %s failed', user_id)
+                    changes = None
+                stream = self.streams.get(user_id)
+                if stream is None:
+                    return
+                if changes is None:
+                    stream.due = time() + RETRY_SECONDS
+                    heapq.heappush(self.due, (stream.due, user_id))
+                    return
+                stream.update(changes)
+                self.schedule(user_id, changes['next_due'])
+                if user_id not in self.stale:
+                    return
+        finally:
+            self.refreshing.discard(user_id)
+
+    async def rescan(self):
+        try:
+            rows = await run_in_read_pool(versions, list(self.streams))
+        except Exception:
+            logger.exception('Rescanning streamed users failed')
+            return
+        for user_id, version, next_due in rows:
+            stream = self.streams.get(user_id)
+            if stream is None:
+                continue
+            if version != stream.version:
+                self.refresh(user_id)
+            else:
+                self.schedule(user_id, next_due)
+
+    def notify(self, user_id: int):
+        # Sent from the threads of sync views
+        if self.loop is not None and not self.loop.is_closed() and user_id in self.streams:
+            self.loop.call_soon_threadsafe(self.refresh, user_id)
+
+    async def subscribe(self, user_id: int) -> Optional[tuple]:
+        """The stream of the user and the queue of a new client, None when the user has no data (anymore)."""
+        self.start()
+        if user_id not in self.streams:
+            snapshot = await run_in_read_pool(poll, user_id, None, None, initial=True)
+            if snapshot is None:
+                return None
+            if user_id not in self.streams:
+                self.streams[user_id] = UserStream(snapshot)
+                self.schedule(user_id, snapshot['next_due'])
+        stream = self.streams[user_id]
+        queue = asyncio.Queue()
+        stream.clients.add(queue)
+        return stream, queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        stream = self.streams.get(user_id)
+        if stream is None:
+            return
+        stream.clients.discard(queue)
+        if not stream.clients:
+            del self.streams[user_id]
+
+
+hub = StreamHub()
+state_changed.connect(lambda sender, user_id, **kwargs: hub.notify(user_id), weak=False,
+                      dispatch_uid='State stream handler')
+
+
+async def wait_for_disconnect(receive, queue: asyncio.Queue):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    queue.put_nowait(DISCONNECTED)
+
+
+async def send_error(send, status: int, error: str, headers: list):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), *headers]})
+    await send({'type': 'http.response.body', 'body': json.dumps({'detail': error}).encode()})
+
+
+async def stream_state(scope, receive, send):
+    pk = int(STREAM_PATH.match(scope['path']).group('pk'))
+    status, error = await run_in_read_pool(authenticate, dict(scope['headers']), scope['query_string'], pk)
+    headers = [(b'access-control-allow-origin', b'*')] if settings.CORS_ORIGIN_ALLOW_ALL else []
+    if error is not None:
+        await send_error(send, status, error, headers)
+        return
+
+    subscription = await hub.subscribe(pk)
+    if subscription is None:
+        # The user data was deleted after the token was checked
+        await send_error(send, 404, 'Not found.', headers)
+        return
+    stream, queue = subscription
+    disconnect = asyncio.get_running_loop().create_task(wait_for_disconnect(receive, queue))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no'),
+            *headers,
+        ]})
+        await send({'type': 'http.response.body', 'body': stream.state(), 'more_body': True})
+        while True:
+            try:
+                body = await asyncio.wait_for(queue.get(), settings.IIDLE_STREAM_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the idle connection
+                body = b': keep-alive\n\n'
+            if body is DISCONNECTED:
+                return
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        disconnect.cancel()
+        hub.unsubscribe(pk, queue)
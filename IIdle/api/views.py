@@ -1,4 +1,15 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import wraps, partial, lru_cache
+from typing import Optional
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import close_old_connections
+from django.db.models import prefetch_related_objects
+from django.utils.http import parse_etags
+from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.permissions import BasePermission, IsAuthenticated
@@ -6,50 +17,75 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from IIdle.api.serializers import (UserDataSerializer, TimetableSerializer, AbilitiesSerializer,
-                                   CompletedCoursesSerializer, ClassesTakenSerializer, MessageSerializer)
-from IIdle.models import UserData, Timetable, Abilities, CompletedCourses, ClassesTaken, Message
+                                   CompletedCoursesSerializer, ClassesTakenSerializer, MessageSerializer,
+                                   GameStateSerializer)
+from IIdle.api.pagination import paginate_messages, parse_page_size
+from IIdle.forecast import semester_forecast
+from IIdle.cache import (recently_processed, processing_lock, mark_processed, get_user_data,
+                         invalidate_user_data)
+from IIdle.models import UserData, Timetable, Abilities, CompletedCourses, ClassesTaken, Message, bump_state_version
+from IIdle.signals import state_changed
 
 from IIdle.timetable_processor import validate_and_process_timetable_change, list_valid_actions, process_timetable
 
 
+def state_etag(get):
+    # Catches up on the timetable first, so the version covers everything the response is built from
+    @wraps(get)
+    def inner(self, request, pk):
+        user_data = process_timetable_wrapper(pk) or get_user_data(pk)
+        if user_data is None:
+            return get(self, request, pk)
+        etag = f'"{pk}-{user_data.version}"'
+        if_none_match = {tag[2:] if tag.startswith('W/') else tag
+                         for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+        if etag in if_none_match or '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = get(self, request, pk)
+        response['ETag'] = etag
+        return response
+
+    return inner
+
+
 class UserDataDetails(APIView):
+    @state_etag
     def get(self, request, pk):
-        process_timetable_wrapper(pk)
-        try:
-            user_data = UserData.objects.get(user_id=pk)
-        except UserData.DoesNotExist:
+        user_data = get_user_data(pk)
+        if user_data is None:
             return Response({})
         serializer = UserDataSerializer(user_data)
         return Response(serializer.data)
 
 
 class TimetableForUser(APIView):
+    @state_etag
     def get(self, request, pk):
-        process_timetable_wrapper(pk)
         timetables = Timetable.objects.filter(user_id=pk)
-        serializer = TimetableSerializer(timetables, many=True)
+        user_data = get_user_data(pk)
+        serializer = TimetableSerializer(timetables, many=True, context={'hour': user_data and user_data.hour})
         return Response(serializer.data)
 
 
 class CompletedCoursesForUser(APIView):
+    @state_etag
     def get(self, request, pk):
-        process_timetable_wrapper(pk)
         completed_courses = CompletedCourses.objects.filter(user_id=pk)
         serializer = CompletedCoursesSerializer(completed_courses, many=True)
         return Response(serializer.data)
 
 
 class ClassesTakenForUser(APIView):
+    @state_etag
     def get(self, request, pk):
-        process_timetable_wrapper(pk)
         classes_taken = ClassesTaken.objects.filter(user_id=pk)
         serializer = ClassesTakenSerializer(classes_taken, many=True)
         return Response(serializer.data)
 
 
 class AbilitiesForUser(APIView):
+    @state_etag
     def get(self, request, pk):
-        process_timetable_wrapper(pk)
         abilities = Abilities.objects.filter(user_id=pk)
         serializer = AbilitiesSerializer(abilities, many=True)
         return Response(serializer.data)
@@ -57,7 +93,21 @@ class AbilitiesForUser(APIView):
 
 class IsOwner(BasePermission):
     def has_permission(self, request, view):
-        return request.user == User.objects.get(pk=view.kwargs['pk'])
+        return request.user.pk == view.kwargs['pk']
+
+
+def owner_with_data(request) -> User:
+    # Read views behind IsOwner work on the authenticated user, its data comes from the cache
+    user = request.user
+    user.data = get_user_data(user.pk)
+    return user
+
+
+def owner_with_fresh_data(request) -> User:
+    # Writes are validated against the row they change rather than a cached snapshot
+    user = request.user
+    user.data = UserData.objects.get(user_id=user.pk)
+    return user
 
 
 class SetTimetable(APIView):
@@ -65,16 +115,18 @@ class SetTimetable(APIView):
 
     def post(self, request, pk):
         process_timetable_wrapper(pk)
-        success, message = validate_and_process_timetable_change(User.objects.get(pk=pk), request.data)
+        success, message = validate_and_process_timetable_change(owner_with_fresh_data(request), request.data)
+        if success:
+            state_changed.send(sender=self.__class__, user_id=pk)
         return Response({'success': success, 'message': message})
 
 
 class GetValidActions(APIView):
     permission_classes = [IsAuthenticated & IsOwner]
 
+    @state_etag
     def get(self, request, pk):
-        process_timetable_wrapper(pk)
-        valid_actions = list_valid_actions(User.objects.get(pk=pk))
+        valid_actions = list_valid_actions(owner_with_data(request))
         return Response(valid_actions)
 
 
@@ -84,19 +136,48 @@ class ClearMessages(APIView):
     def post(self, request, pk):
         # process_timetable_wrapper should not be called
         Message.objects.filter(user_id=pk).delete()
+        bump_state_version(pk)
+        invalidate_user_data(pk)
+        state_changed.send(sender=self.__class__, user_id=pk)
         return Response({'success': True})
 
 
 class MessagesForUser(APIView):
     permission_classes = [IsAuthenticated & IsOwner]
 
+    @state_etag
     def get(self, request, pk):
-        process_timetable_wrapper(pk)
-        messages = Message.objects.filter(user_id=pk)
+        messages, cursor, has_more, before = paginate_messages(
+            pk, request.query_params.get('since'), parse_page_size(request.query_params.get('limit')),
+            request.query_params.get('before')
+        )
         serializer = MessageSerializer(messages, many=True)
+        return Response({'results': serializer.data, 'cursor': cursor, 'has_more': has_more, 'before': before})
+
+
+class GameState(APIView):
+    permission_classes = [IsAuthenticated & IsOwner]
+
+    @state_etag
+    def get(self, request, pk):
+        user = owner_with_data(request)
+        prefetch_related_objects([user], 'timetable_set', 'completedcourses_set', 'classestaken_set', 'abilities_set')
+        serializer = GameStateSerializer(user, context={'hour': user.data.hour})
         return Response(serializer.data)
 
 
+class Forecast(APIView):
+    permission_classes = [IsAuthenticated & IsOwner]
+
+    @state_etag
+    def get(self, request, pk):
+        user = owner_with_data(request)
+        attendance = dict(ClassesTaken.objects.filter(user_id=pk).values_list('course', 'times_present'))
+        abilities = set(Abilities.objects.filter(user_id=pk).values_list('ability', flat=True))
+        completed_courses = set(CompletedCourses.objects.filter(user_id=pk).values_list('course', flat=True))
+        return Response(semester_forecast(user.data, attendance, abilities, completed_courses))
+
+
 class CustomAuthToken(ObtainAuthToken):
     # Based on an example from docs
     def post(self, request, *args, **kwargs):
@@ -111,9 +192,61 @@ class CustomAuthToken(ObtainAuthToken):
         })
 
 
-def process_timetable_wrapper(pk: int):
+# Neither the ORM nor DRF are async yet, so the async views of the ASGI entry point (backend/asgi_urls.py) run the
+# regular ones in this pool. Catching up on a timetable only ties up one of its threads, waiting clients are kept by
+# the event loop. It's created by the first of them, so WSGI and management commands never start it.
+@lru_cache(maxsize=None)
+def read_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(settings.IIDLE_ASYNC_READ_THREADS, thread_name_prefix='read')
+
+
+def with_fresh_connections(function, *args, **kwargs):
+    # Pool threads outlive requests, they drop their connections the way the request signals would
+    close_old_connections()
     try:
-        user = User.objects.get(pk=pk)
-    except User.DoesNotExist:
-        return
-    process_timetable(user)
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_read_pool(function, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(
+        read_pool(), partial(with_fresh_connections, function, *args, **kwargs)
+    )
+
+
+def render_view(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    response.render()
+    return response
+
+
+def async_view(view_class):
+    view = view_class.as_view()
+
+    async def inner(request, *args, **kwargs):
+        return await run_in_read_pool(render_view, view, request, *args, **kwargs)
+
+    # Like csrf_exempt, which would hide the coroutine behind a sync wrapper. DRF checks CSRF itself.
+    inner.csrf_exempt = True
+    return inner
+
+
+def process_timetable_wrapper(pk: int, fresh: bool = False) -> Optional[UserData]:
+    # Returns the user data when it was looked up along the way and nothing had to be processed
+    if not settings.IIDLE_INLINE_PROCESSING:
+        return None
+    guarded = settings.IIDLE_PROCESSING_GUARD
+    if guarded and recently_processed(pk):
+        return None
+    user_data = get_user_data(pk, fresh)
+    if user_data is None or user_data.next_due is None or user_data.next_due > datetime.now(tz=timezone.utc):
+        return user_data
+    if not guarded:
+        process_timetable(user_data.user)
+        return None
+    with processing_lock(pk) as acquired:
+        if acquired:
+            process_timetable(user_data.user)
+            mark_processed(pk)
+    return None
@@ -5,4 +5,5 @@ class IidleConfig(AppConfig):
     name = 'IIdle'
 
     def ready(self):
+        import IIdle.checks  # noqa
         import IIdle.signals  # noqa
@@ -0,0 +1,105 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from time import monotonic, sleep, time
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+
+from IIdle.models import UserData
+
+LOCK_POLL_SECONDS = 0.01
+USER_DATA_FIELDS = [field.attname for field in UserData._meta.concrete_fields]
+
+# Hits and misses of the user data cache in this process
+user_data_cache_stats = Counter()
+
+
+def processing_lock_key(user_id: int) -> str:
+    return f'iidle:processing-lock:{user_id}'
+
+
+def processed_at_key(user_id: int) -> str:
+    return f'iidle:processed-at:{user_id}'
+
+
+def recently_processed(user_id: int) -> bool:
+    return cache.get(processed_at_key(user_id)) is not None
+
+
+def mark_processed(user_id: int):
+    cache.set(processed_at_key(user_id), time(), settings.IIDLE_PROCESSING_MEMO_SECONDS)
+
+
+@contextmanager
+def processing_lock(user_id: int):
+    key = processing_lock_key(user_id)
+    if cache.add(key, True, settings.IIDLE_PROCESSING_LOCK_SECONDS):
+        try:
+            yield True
+        finally:
+            cache.delete(key)
+        return
+    # Somebody else is catching up for this user, give them a moment to finish instead of doing it twice
+    deadline = monotonic() + settings.IIDLE_PROCESSING_WAIT_SECONDS
+    while cache.get(key) is not None and monotonic() < deadline:
+        sleep(LOCK_POLL_SECONDS)
+    yield False
+
+
+def user_data_key(user_id: int) -> str:
+    return f'iidle:user-data:{user_id}'
+
+
+def get_user_data(user_id: int, fresh: bool = False) -> Optional[UserData]:
+    """
+    Snapshot of the user's data, with the user's username and whether they are active. Everything that writes user
+    data through the game, and saving the user, invalidates it, so it's only stale after bulk updates that bypass them
+    or after writes of processes that don't share the cache backend, at most for IIDLE_USER_DATA_CACHE_SECONDS.
+    `fresh` reads the row for this caller only, the cached snapshot other readers get is left alone.
+    """
+    if not fresh:
+        values = cache.get(user_data_key(user_id))
+        if values is not None:
+            user_data_cache_stats['hits'] += 1
+            return user_data_snapshot(values)
+        user_data_cache_stats['misses'] += 1
+    values = (UserData.objects.filter(user_id=user_id)
+              .values_list(*USER_DATA_FIELDS, 'user__username', 'user__is_active').first())
+    if values is None:
+        return None
+    if not fresh:
+        cache.set(user_data_key(user_id), values, settings.IIDLE_USER_DATA_CACHE_SECONDS)
+    return user_data_snapshot(values)
+
+
+def user_data_snapshot(values: tuple) -> UserData:
+    # Only the fields the read endpoints and authentication need are cached, the rest of the user (e.g. the password)
+    # is deferred
+    *fields, username, is_active = values
+    user_data = UserData.from_db(None, USER_DATA_FIELDS, fields)
+    user_data.user = User.from_db(None, ['id', 'username', 'is_active'], [user_data.user_id, username, is_active])
+    return user_data
+
+
+def invalidate_user_data(user_id: int):
+    key = user_data_key(user_id)
+    cache.delete(key)
+    # A read before the write commits could put the old data back, so it's dropped again once the write is visible
+    transaction.on_commit(partial(cache.delete, key))
+
+
+def user_data_hit_rate() -> float:
+    lookups = user_data_cache_stats['hits'] + user_data_cache_stats['misses']
+    return user_data_cache_stats['hits'] / lookups if lookups else 0.0
+
+
+def token_key(key: str) -> str:
+    return f'iidle:token:{key}'
+
+
+def invalidate_token(key: str):
+    cache.delete(token_key(key))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+
+
+@register()
+def shared_cache_for_worker(app_configs, **kwargs):
+    # The server would keep answering from its own copy of the user data while the worker writes it
+    if settings.IIDLE_INLINE_PROCESSING or not isinstance(caches['default'], LocMemCache):
+        return []
+    return [Error(
+        'IIDLE_INLINE_PROCESSING is off but the default cache is local to the process.',
+        hint='Use a cache backend that the server shares with `process_timetables`, e.g. memcached or redis.',
+        id='IIdle.E001',
+    )]
@@ -2,4 +2,10 @@ ECTS_TO_PASS_SEMESTER = 30
 DAYS_IN_FORTNIGHT = 14
 LAST_SEMESTER = 6
 SCORE_TO_PASS = 100
+# Exam scores are multiplied by a roll from this range
+EXAM_LUCK = (0.75, 1.25)
+ATTENDANCE_TO_TAKE_EXAM = 10
 HOURS_IN_DAY = 24
+USER_FIELDS_THAT_MIGHT_CHANGE = ['cash', 'energy', 'mood', 'math', 'programming', 'algorithms', 'work_experience']
+MEMORY_ENGINE = 'memory'
+ORM_ENGINE = 'orm'
@@ -0,0 +1,173 @@
+from decimal import Decimal
+from typing import Optional
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest, Least
+
+from IIdle.cache import invalidate_user_data
+from IIdle.consts import USER_FIELDS_THAT_MIGHT_CHANGE
+from IIdle.messages import Event
+from IIdle.models import (UserData, ClassesTaken, CompletedCourses, Abilities, Message, ActionEvent, ACTION_CODES,
+                          get_semester, stat_values)
+
+UNBOUNDED_FIELDS = ('cash',)
+
+
+def to_decimal(value: float) -> Decimal:
+    # Rounds like quantizing Decimal(value) to cents, in half the time
+    return Decimal(f'{value:.2f}')
+
+
+class UserState:
+    def __init__(self, user: User, user_data: UserData):
+        self.user = user
+        self.user_data = user_data
+        self.messages = []
+        self.events = []
+        self._stats = {key: float(getattr(user_data, key)) for key in USER_FIELDS_THAT_MIGHT_CHANGE}
+        for key, value in self._stats.items():
+            setattr(self, key, value)
+        self.day = user_data.day
+        self.hour = user_data.hour
+        self.failed_a_semester = user_data.failed_a_semester
+        self.next_due = user_data.next_due
+        self._classes_taken: Optional[dict] = None
+        self._attendance: Optional[dict] = None
+        self._abilities: Optional[set] = None
+        self._new_abilities = set()
+        self._saved_completed_courses: Optional[set] = None
+        self._completed_courses: Optional[set] = None
+
+    @classmethod
+    def load(cls, user: User) -> 'UserState':
+        return cls(user, UserData.objects.get(user=user))
+
+    @classmethod
+    def detached(cls, user_data: UserData) -> 'UserState':
+        """A new student that only lives in memory, for playing out the rules offline. It can't be saved."""
+        state = cls(None, user_data)
+        state._attendance = {}
+        state._abilities = set()
+        state._completed_courses = set()
+        return state
+
+    def semester(self) -> int:
+        return get_semester(self.day, self.failed_a_semester)
+
+    def stats(self) -> dict:
+        return {key: to_decimal(getattr(self, key)) for key in USER_FIELDS_THAT_MIGHT_CHANGE}
+
+    def add_message(self, event: Event):
+        self.messages.append(event)
+
+    @property
+    def attendance(self) -> dict:
+        if self._attendance is None:
+            self._classes_taken = {
+                class_.course: class_ for class_ in ClassesTaken.objects.filter(user=self.user).order_by('id')
+            }
+            self._attendance = {course: class_.times_present for course, class_ in self._classes_taken.items()}
+        return self._attendance
+
+    @property
+    def abilities(self) -> set:
+        if self._abilities is None:
+            self._abilities = set(Abilities.objects.filter(user=self.user).values_list('ability', flat=True))
+        return self._abilities
+
+    def simulate_logged(self, action):
+        """Plays out an hour of the timetable and adds it to the action log."""
+        before = stat_values(self)
+        action.simulate(self)
+        self.events.append(ActionEvent.from_change(self.user.pk, ACTION_CODES[action.name], before, self))
+
+    def add_ability(self, ability: str):
+        self.abilities.add(ability)
+        self._new_abilities.add(ability)
+
+    @property
+    def completed_courses(self) -> set:
+        if self._completed_courses is None:
+            self._saved_completed_courses = set(
+                CompletedCourses.objects.filter(user=self.user).values_list('course', flat=True)
+            )
+            self._completed_courses = set(self._saved_completed_courses)
+        return self._completed_courses
+
+    def save(self):
+        with transaction.atomic():
+            self._save_user_data()
+            if self._attendance is not None:
+                self._save_attendance()
+            if self._new_abilities:
+                Abilities.objects.bulk_create(
+                    Abilities(user=self.user, ability=ability) for ability in sorted(self._new_abilities)
+                )
+                self._new_abilities.clear()
+            if self._completed_courses is not None:
+                self._save_completed_courses()
+            if self.messages:
+                Message.objects.bulk_create(Message.from_event(self.user, event) for event in self.messages)
+                self.messages = []
+            if self.events:
+                ActionEvent.objects.bulk_create(self.events)
+                self.events = []
+
+    def _save_user_data(self):
+        # Stats are written back as deltas, so the sub-cent precision SQLite keeps in the columns isn't lost
+        changes = {
+            'day': self.day, 'hour': self.hour, 'failed_a_semester': self.failed_a_semester, 'next_due': self.next_due,
+            'version': F('version') + 1,
+        }
+        for key, saved_value in self._stats.items():
+            value = getattr(self, key)
+            if value == saved_value:
+                continue
+            change = F(key) + (value - saved_value)
+            changes[key] = change if key in UNBOUNDED_FIELDS else Least(Greatest(change, 0), 100)
+            self._stats[key] = value
+        UserData.objects.filter(user=self.user).update(**changes)
+        invalidate_user_data(self.user.pk)
+        for key, value in self.stats().items():
+            setattr(self.user_data, key, value)
+        self.user_data.day = self.day
+        self.user_data.hour = self.hour
+        self.user_data.failed_a_semester = self.failed_a_semester
+        self.user_data.next_due = self.next_due
+        self.user_data.version += 1
+        self.user.data = self.user_data
+
+    def _save_attendance(self):
+        removed = self._classes_taken.keys() - self._attendance.keys()
+        if removed:
+            ClassesTaken.objects.filter(user=self.user, course__in=removed).delete()
+        changed = []
+        for course, times_present in self._attendance.items():
+            class_ = self._classes_taken.get(course)
+            if class_ is None:
+                continue
+            if class_.times_present != times_present:
+                class_.times_present = times_present
+                changed.append(class_)
+        if changed:
+            ClassesTaken.objects.bulk_update(changed, ['times_present'])
+        ClassesTaken.objects.bulk_create(
+            ClassesTaken(user=self.user, course=course, times_present=times_present)
+            for course, times_present in self._attendance.items() if course not in self._classes_taken
+        )
+        # Rows created in bulk have no primary keys on SQLite, so they are fetched again if needed
+        self._classes_taken = None
+        self._attendance = None
+
+    def _save_completed_courses(self):
+        removed = self._saved_completed_courses - self._completed_courses
+        if removed:
+            CompletedCourses.objects.filter(user=self.user, course__in=removed).delete()
+        added = self._completed_courses - self._saved_completed_courses
+        if added:
+            CompletedCourses.objects.bulk_create(
+                CompletedCourses(user=self.user, course=course) for course in sorted(added)
+            )
+        self._saved_completed_courses = set(self._completed_courses)
@@ -0,0 +1,56 @@
+from collections import defaultdict
+
+from IIdle.actions import ACTION_TO_CLASS, Class, ects_to_pass
+from IIdle.consts import ATTENDANCE_TO_TAKE_EXAM, LAST_SEMESTER
+from IIdle.models import UserData
+
+CLASSES = [class_ for class_ in ACTION_TO_CLASS.values() if issubclass(class_, Class)]
+
+
+def ects_distribution(courses: list) -> dict:
+    """Chances of every ECTS total from independent exams, given as (ects, pass probability)."""
+    distribution = {0: 1.0}
+    for ects, probability in courses:
+        next_distribution = defaultdict(float)
+        for total, chance in distribution.items():
+            next_distribution[total + ects] += chance * probability
+            next_distribution[total] += chance * (1 - probability)
+        distribution = next_distribution
+    return distribution
+
+
+def semester_forecast(user_data: UserData, attendance: dict, abilities: set, completed_courses: set) -> dict:
+    """Chances of passing the exams of the current semester and the semester itself if it ended now."""
+    semester = user_data.semester()
+    courses = sorted(({class_.name for class_ in CLASSES if class_.semester == semester} | attendance.keys())
+                     - completed_courses)
+    forecasts = []
+    for course in courses:
+        class_ = ACTION_TO_CLASS[course]
+        times_present = attendance.get(course, 0)
+        exam_pass_probability = class_.pass_probability(user_data, abilities)
+        takes_exam = times_present >= ATTENDANCE_TO_TAKE_EXAM
+        forecasts.append({
+            'course': course,
+            'ects': class_.ects,
+            'attendance': times_present,
+            'attendance_needed': max(ATTENDANCE_TO_TAKE_EXAM - times_present, 0),
+            'exam_pass_probability': round(exam_pass_probability, 4),
+            'pass_probability': round(exam_pass_probability if takes_exam else 0.0, 4),
+        })
+
+    completed_ects = sum(ACTION_TO_CLASS[course].ects for course in completed_courses)
+    distribution = ects_distribution([(course['ects'], course['pass_probability']) for course in forecasts])
+    # The last semester can't be failed
+    required_ects = ects_to_pass(semester) if semester != LAST_SEMESTER else None
+    semester_pass_probability = 1.0 if required_ects is None else sum(
+        chance for total, chance in distribution.items() if completed_ects + total >= required_ects
+    )
+    return {
+        'semester': semester,
+        'courses': forecasts,
+        'completed_ects': completed_ects,
+        'expected_ects': round(completed_ects + sum(total * chance for total, chance in distribution.items()), 2),
+        'required_ects': required_ects,
+        'semester_pass_probability': round(semester_pass_probability, 4),
+    }
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from IIdle.action_log import differences, rebuild, add_baseline
+from IIdle.models import UserData
+
+
+class Command(BaseCommand):
+    help = ('Verifies user data against the action log, "rebuild" overwrites it with the replayed log and "baseline" '
+            'accepts it as it is')
+
+    def add_arguments(self, parser):
+        parser.add_argument('operation', choices=['verify', 'rebuild', 'baseline'])
+        parser.add_argument('--user', type=int, action='append', dest='users', help='Only this user, can be repeated')
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or UserData.objects.order_by('user_id').values_list('user_id', flat=True)
+        mismatched = 0
+        for user_id in user_ids:
+            changed = differences(user_id)
+            if not changed:
+                continue
+            mismatched += 1
+            self.stdout.write(f'User {user_id}: ' + ', '.join(
+                f'{key} is {stored}, the log has {replayed}' for key, (stored, replayed) in changed.items()
+            ))
+            if options['operation'] == 'rebuild':
+                rebuild(user_id)
+            elif options['operation'] == 'baseline':
+                add_baseline(user_id)
+        self.stdout.write(f'{mismatched} user(s) did not match the action log')
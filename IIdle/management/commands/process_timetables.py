@@ -0,0 +1,29 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from IIdle.timetable_processor import process_due_timetables, seconds_until_next_due
+
+
+class Command(BaseCommand):
+    help = 'Processes due timetable entries of all users, so views can skip it (set IIDLE_INLINE_PROCESSING = False)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Users processed per batch')
+        parser.add_argument('--max-sleep', type=float, default=5.0,
+                            help='Upper bound on the idle wait, so freshly saved timetables get picked up')
+        parser.add_argument('--once', action='store_true', help='Process everything that is due and exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            processed = process_due_timetables(batch_size)
+            if processed:
+                self.stdout.write(f'Processed timetables of {processed} user(s)')
+            # Users whose catch-up failed are due again only later, so this is 0 while others are still waiting
+            seconds = seconds_until_next_due(options['max_sleep'])
+            if not seconds:
+                continue
+            if options['once']:
+                return
+            sleep(seconds)
@@ -0,0 +1,43 @@
+import json
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from IIdle.simulator import STRATEGIES, run
+
+
+class Command(BaseCommand):
+    help = ('Plays out the studies of synthetic students with the game rules, without the database, and reports pass '
+            'rates of every course and semester, the graduation rate and the mean stats, for balancing the game')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=10000)
+        parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='day_loop',
+                            help='How the students plan their days')
+        parser.add_argument('--processes', type=int, help='Size of the process pool, the number of CPUs by default')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Students simulated per task')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        report = run(options['strategy'], options['students'], options['processes'], options['chunk_size']).as_dict()
+        seconds = perf_counter() - start
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        def rate(outcome: dict) -> str:
+            return '-' if outcome['pass_rate'] is None else f'{outcome["pass_rate"]:.1%}'
+
+        self.stdout.write(f'{report["students"]} students following {options["strategy"]} in {seconds:.1f}s')
+        self.stdout.write(f'Graduated: {report["graduation_rate"]:.1%}')
+        self.stdout.write('Semesters passed:')
+        for semester, outcome in report['semesters'].items():
+            self.stdout.write(f'  {semester}: {rate(outcome)} of {outcome["attempts"]}')
+        self.stdout.write('Exams passed:')
+        width = max(map(len, report['courses']), default=0)
+        for course, outcome in report['courses'].items():
+            self.stdout.write(f'  {course:<{width}}  {rate(outcome):>6} of {outcome["attempts"]}')
+        self.stdout.write('Mean stats at the end:')
+        for key, value in report['mean_stats'].items():
+            self.stdout.write(f'  {key}: {value:.2f}')
@@ -0,0 +1,119 @@
+from decimal import Decimal
+from functools import lru_cache
+from typing import NamedTuple
+
+from IIdle.consts import USER_FIELDS_THAT_MIGHT_CHANGE
+
+# Messages are stored as an event code, the action, course or ability they are about and a few numbers.
+# Amounts are kept in cents, so they render exactly as they were when the message was created.
+TEXT = 0
+TOO_TIRED = 1
+ACTION_DONE = 2
+DAY_ENDED = 3
+DAY_ENDED_WITHOUT_FUNDS = 4
+SEMESTER_PASSED = 5
+SEMESTER_FAILED = 6
+EXAM_PASSED = 7
+EXAM_FLUNKED = 8
+NEW_ABILITY = 9
+DAY_DIGEST = 10
+
+EVENT_CHOICES = [
+    (TEXT, 'Text'),
+    (TOO_TIRED, 'Too tired'),
+    (ACTION_DONE, 'Action done'),
+    (DAY_ENDED, 'Day ended'),
+    (DAY_ENDED_WITHOUT_FUNDS, 'Day ended without funds'),
+    (SEMESTER_PASSED, 'Semester passed'),
+    (SEMESTER_FAILED, 'Semester failed'),
+    (EXAM_PASSED, 'Exam passed'),
+    (EXAM_FLUNKED, 'Exam flunked'),
+    (NEW_ABILITY, 'New ability'),
+    (DAY_DIGEST, 'Day digest'),
+]
+
+TEMPLATES = {
+    TOO_TIRED: 'You were too tired to do what you had planned!',
+    ACTION_DONE: 'You have {subject}. {changes}',
+    DAY_ENDED: 'A day has ended. You have spent: {0}',
+    DAY_ENDED_WITHOUT_FUNDS: "A day has ended but you didn't have enough funds to support yourself. "
+                             'Your energy changed by: {0} and your mood changed by: {1}.',
+    SEMESTER_PASSED: 'A semester has ended. You have passed!',
+    SEMESTER_FAILED: 'A semester has ended. You have failed!',
+    EXAM_PASSED: 'You have taken a(n) {subject} exam. You have passed!',
+    EXAM_FLUNKED: 'You have taken a(n) {subject} exam. You have flunked :(',
+    NEW_ABILITY: 'You have earned a new ability: {subject}.',
+    DAY_DIGEST: 'Day {day} went by while you were away. You have done {done} of {hours} planned actions. {changes}',
+}
+
+# Sums of these go into the digest of a fast-forwarded day, the rest are kept as they are
+DIGESTED_EVENTS = {TOO_TIRED, ACTION_DONE, DAY_ENDED, DAY_ENDED_WITHOUT_FUNDS}
+
+# Everything that isn't listed is a class
+ACTION_PHRASES = {
+    'Sleep': 'Slept',
+    'Work': 'Worked',
+    'Learn Math': 'Learned Math',
+    'Learn Programming': 'Learned Programming',
+    'Learn Algorithms': 'Learned Algorithms',
+    'Relax': 'Relaxed',
+    'Party': 'Partied',
+}
+
+STAT_LABELS = [f'{key.title()}: ' for key in USER_FIELDS_THAT_MIGHT_CHANGE]
+
+
+class Event(NamedTuple):
+    event: int
+    subject: str = ''
+    payload: tuple = ()
+
+
+def to_cents(amount: Decimal) -> int:
+    return int(amount.scaleb(2).to_integral_value())
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+def stat_changes(current_values: dict, previous_values: dict) -> tuple:
+    """Changed stats as pairs of their index in USER_FIELDS_THAT_MIGHT_CHANGE and the change in cents, flattened."""
+    changes = []
+    for index, key in enumerate(USER_FIELDS_THAT_MIGHT_CHANGE):
+        stat_change = to_cents(current_values[key] - previous_values[key])
+        if stat_change != 0:
+            changes += [index, stat_change]
+    return tuple(changes)
+
+
+def day_digest(day: int, events: list, current_values: dict, previous_values: dict) -> list:
+    """Events of a day with the ones in DIGESTED_EVENTS replaced by a digest at the end."""
+    hours = sum(event.event in (TOO_TIRED, ACTION_DONE) for event in events)
+    done = sum(event.event == ACTION_DONE for event in events)
+    kept = [event for event in events if event.event not in DIGESTED_EVENTS]
+    return [*kept, Event(DAY_DIGEST, payload=(day, hours, done, *stat_changes(current_values, previous_values)))]
+
+
+@lru_cache(maxsize=None)
+def template(event: int, subject: str) -> str:
+    if event == ACTION_DONE:
+        subject = ACTION_PHRASES.get(subject, f'attended {subject} class')
+    # Braces in a subject would be taken for a placeholder by the second format
+    return TEMPLATES[event].replace('{subject}', subject.replace('{', '{{').replace('}', '}}'))
+
+
+def render_changes(payload: list) -> str:
+    changes = ' '.join(f'{STAT_LABELS[index]}{from_cents(cents)}' for index, cents in zip(payload[::2], payload[1::2]))
+    return f'Stats changed - {changes}.' if changes else 'None of your stats changed!'
+
+
+def render_message(event: int, subject: str, payload: list, text: str = '') -> str:
+    if event == TEXT:
+        return text
+    if event == ACTION_DONE:
+        return template(event, subject).format(changes=render_changes(payload))
+    if event == DAY_DIGEST:
+        day, hours, done, *changes = payload
+        return template(event, subject).format(day=day, hours=hours, done=done, changes=render_changes(changes))
+    return template(event, subject).format(*map(from_cents, payload))
@@ -0,0 +1,28 @@
+# Generated by Django 3.1 on 2026-10-18 14:10
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_next_due(apps, schema_editor):
+    UserData = apps.get_model('IIdle', 'UserData')
+    Timetable = apps.get_model('IIdle', 'Timetable')
+    UserData.objects.update(next_due=Subquery(
+        Timetable.objects.filter(user_id=OuterRef('user_id')).order_by('time').values('time')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('IIdle', '0002_auto_20200825_1921'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userdata',
+            name='next_due',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_next_due, migrations.RunPython.noop),
+    ]
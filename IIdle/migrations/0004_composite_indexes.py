@@ -0,0 +1,25 @@
+# Generated by Django 3.1 on 2026-10-18 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('IIdle', '0003_userdata_next_due'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['user', 'time'], name='message_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timetable',
+            index=models.Index(fields=['user', 'time'], name='timetable_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userdata',
+            index=models.Index(fields=['next_due'], name='userdata_next_due_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('IIdle', '0004_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userdata',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,161 @@
+# Generated by Django 3.1 on 2026-10-18 14:25
+
+import re
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# Frozen copies of IIdle.consts and IIdle.messages as they were when the messages were converted, the migration has to
+# keep parsing and rendering them the same way whatever those modules become
+USER_FIELDS_THAT_MIGHT_CHANGE = ('cash', 'energy', 'mood', 'math', 'programming', 'algorithms', 'work_experience')
+TEXT = 0
+TOO_TIRED = 1
+ACTION_DONE = 2
+DAY_ENDED = 3
+DAY_ENDED_WITHOUT_FUNDS = 4
+SEMESTER_PASSED = 5
+SEMESTER_FAILED = 6
+EXAM_PASSED = 7
+EXAM_FLUNKED = 8
+NEW_ABILITY = 9
+TEMPLATES = {
+    TOO_TIRED: 'You were too tired to do what you had planned!',
+    ACTION_DONE: 'You have {subject}. {changes}',
+    DAY_ENDED: 'A day has ended. You have spent: {0}',
+    DAY_ENDED_WITHOUT_FUNDS: "A day has ended but you didn't have enough funds to support yourself. "
+                             'Your energy changed by: {0} and your mood changed by: {1}.',
+    SEMESTER_PASSED: 'A semester has ended. You have passed!',
+    SEMESTER_FAILED: 'A semester has ended. You have failed!',
+    EXAM_PASSED: 'You have taken a(n) {subject} exam. You have passed!',
+    EXAM_FLUNKED: 'You have taken a(n) {subject} exam. You have flunked :(',
+    NEW_ABILITY: 'You have earned a new ability: {subject}.',
+}
+ACTION_PHRASES = {
+    'Sleep': 'Slept',
+    'Work': 'Worked',
+    'Learn Math': 'Learned Math',
+    'Learn Programming': 'Learned Programming',
+    'Learn Algorithms': 'Learned Algorithms',
+    'Relax': 'Relaxed',
+    'Party': 'Partied',
+}
+STAT_LABELS = [f'{key.title()}: ' for key in USER_FIELDS_THAT_MIGHT_CHANGE]
+
+BATCH_SIZE = 1000
+AMOUNT = r'(-?\d+(?:\.\d+)?)'
+PATTERNS = [
+    (TOO_TIRED, re.compile(r'You were too tired to do what you had planned!')),
+    (DAY_ENDED, re.compile(rf'A day has ended\. You have spent: {AMOUNT}')),
+    (DAY_ENDED_WITHOUT_FUNDS, re.compile(
+        rf"A day has ended but you didn't have enough funds to support yourself\. "
+        rf'Your energy changed by: {AMOUNT} and your mood changed by: {AMOUNT}\.'
+    )),
+    (SEMESTER_PASSED, re.compile(r'A semester has ended\. You have passed!')),
+    (SEMESTER_FAILED, re.compile(r'A semester has ended\. You have failed!')),
+    (EXAM_PASSED, re.compile(r'You have taken a\(n\) (?P<subject>.+) exam\. You have passed!')),
+    (EXAM_FLUNKED, re.compile(r'You have taken a\(n\) (?P<subject>.+) exam\. You have flunked :\(')),
+    (NEW_ABILITY, re.compile(r'You have earned a new ability: (?P<subject>.+)\.')),
+    (ACTION_DONE, re.compile(
+        r'You have (?P<subject>.+?)\. (?:Stats changed - (?P<changes>.+)\.|None of your stats changed!)'
+    )),
+]
+STAT_CHANGE = re.compile(rf'(\w+): {AMOUNT}')
+PHRASE_ACTIONS = {phrase: action for action, phrase in ACTION_PHRASES.items()}
+CLASS_PHRASE = re.compile(r'attended (?P<course>.+) class')
+
+
+def to_cents(amount: str) -> int:
+    return int(Decimal(amount).scaleb(2).to_integral_value())
+
+
+def parse(text: str):
+    for event, pattern in PATTERNS:
+        match = pattern.fullmatch(text)
+        if match is None:
+            continue
+        if event != ACTION_DONE:
+            # Messages are either about a subject or carry amounts, never both
+            subject = match.groupdict().get('subject', '')
+            return event, subject, [] if subject else [to_cents(amount) for amount in match.groups()]
+        subject = match['subject']
+        class_phrase = CLASS_PHRASE.fullmatch(subject)
+        subject = class_phrase['course'] if class_phrase else PHRASE_ACTIONS.get(subject)
+        if subject is None:
+            break
+        payload = []
+        for key, amount in STAT_CHANGE.findall(match['changes'] or ''):
+            payload += [USER_FIELDS_THAT_MIGHT_CHANGE.index(key.lower()), to_cents(amount)]
+        return event, subject, payload
+    return TEXT, '', []
+
+
+def convert_texts(apps, schema_editor):
+    Message = apps.get_model('IIdle', 'Message')
+    batch = []
+    for message in Message.objects.exclude(text='').only('id', 'text').iterator(chunk_size=BATCH_SIZE):
+        message.event, message.subject, message.payload = parse(message.text)
+        if message.event == TEXT:
+            continue
+        message.text = ''
+        batch.append(message)
+        if len(batch) == BATCH_SIZE:
+            Message.objects.bulk_update(batch, ['event', 'subject', 'payload', 'text'])
+            batch = []
+    Message.objects.bulk_update(batch, ['event', 'subject', 'payload', 'text'])
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+def render_message(event: int, subject: str, payload: list) -> str:
+    if event == ACTION_DONE:
+        subject = ACTION_PHRASES.get(subject, f'attended {subject} class')
+    template = TEMPLATES[event].replace('{subject}', subject.replace('{', '{{').replace('}', '}}'))
+    if event != ACTION_DONE:
+        return template.format(*map(from_cents, payload))
+    changes = ' '.join(f'{STAT_LABELS[index]}{from_cents(cents)}' for index, cents in zip(payload[::2], payload[1::2]))
+    return template.format(changes=f'Stats changed - {changes}.' if changes else 'None of your stats changed!')
+
+
+def render_texts(apps, schema_editor):
+    Message = apps.get_model('IIdle', 'Message')
+    batch = []
+    for message in Message.objects.exclude(event=TEXT).iterator(chunk_size=BATCH_SIZE):
+        message.text = render_message(message.event, message.subject, message.payload)
+        batch.append(message)
+        if len(batch) == BATCH_SIZE:
+            Message.objects.bulk_update(batch, ['text'])
+            batch = []
+    Message.objects.bulk_update(batch, ['text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('IIdle', '0005_userdata_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='event',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Text'), (1, 'Too tired'), (2, 'Action done'), (3, 'Day ended'), (4, 'Day ended without funds'), (5, 'Semester passed'), (6, 'Semester failed'), (7, 'Exam passed'), (8, 'Exam flunked'), (9, 'New ability')], default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='payload',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='subject',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(convert_texts, render_texts),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-18 14:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('IIdle', '0006_structured_messages'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='event',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Text'), (1, 'Too tired'), (2, 'Action done'), (3, 'Day ended'), (4, 'Day ended without funds'), (5, 'Semester passed'), (6, 'Semester failed'), (7, 'Exam passed'), (8, 'Exam flunked'), (9, 'New ability'), (10, 'Day digest')], default=0),
+        ),
+    ]
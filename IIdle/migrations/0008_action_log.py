@@ -0,0 +1,54 @@
+# Generated by Django 3.1 on 2026-10-18 14:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+# IIdle.consts.USER_FIELDS_THAT_MIGHT_CHANGE when the action log was added, the fields of ActionEvent below
+USER_FIELDS_THAT_MIGHT_CHANGE = ('cash', 'energy', 'mood', 'math', 'programming', 'algorithms', 'work_experience')
+BASELINE = 0
+
+
+def log_baselines(apps, schema_editor):
+    # The state of existing users is their first event, as changes from the values of a new user
+    UserData = apps.get_model('IIdle', 'UserData')
+    ActionEvent = apps.get_model('IIdle', 'ActionEvent')
+    defaults = {key: float(UserData._meta.get_field(key).default) for key in USER_FIELDS_THAT_MIGHT_CHANGE}
+    ActionEvent.objects.bulk_create(
+        (ActionEvent(user_id=user_data.user_id, action=BASELINE, day=user_data.day, hour=user_data.hour,
+                     failed_a_semester=user_data.failed_a_semester,
+                     **{key: float(getattr(user_data, key)) - default for key, default in defaults.items()})
+         for user_data in UserData.objects.order_by('user_id').iterator(chunk_size=BATCH_SIZE)),
+        batch_size=BATCH_SIZE
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('IIdle', '0007_day_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActionEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.PositiveSmallIntegerField(choices=[(0, 'Baseline'), (1, 'Sleep'), (2, 'Work'), (3, 'Learn Math'), (4, 'Learn Programming'), (5, 'Learn Algorithms'), (6, 'Relax'), (7, 'Party'), (8, 'Finish Semester'), (9, 'End Day'), (10, 'Logic'), (11, 'Calculus I'), (12, 'Intro To Programming - Python'), (13, 'Intro To Programming - C'), (14, 'Introduction To Computer Science'), (15, 'Programming'), (16, 'Algebra'), (17, 'C++ Programming'), (18, 'Object Oriented Programming'), (19, 'Computer Systems Architectures'), (20, 'Numerical Analysis'), (21, 'Discrete Math'), (22, 'Probability'), (23, 'Java Programming'), (24, 'Python Programming'), (25, 'Functional Programming'), (26, 'Algorithms And Data Structures'), (27, 'Linux Administration'), (28, 'Scala Programming'), (29, 'Lambda Calculus'), (30, 'Calculus II'), (31, 'Operating Systems'), (32, 'Rust Programming'), (33, 'Software Engineering'), (34, 'Machine Learning'), (35, 'Embedded Systems'), (36, 'Databases'), (37, 'Computer Networks'), (38, 'JFIZO'), (39, 'Artificial Intelligence')])),
+                ('day', models.PositiveIntegerField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('failed_a_semester', models.BooleanField()),
+                ('cash', models.FloatField(default=0)),
+                ('energy', models.FloatField(default=0)),
+                ('mood', models.FloatField(default=0)),
+                ('math', models.FloatField(default=0)),
+                ('programming', models.FloatField(default=0)),
+                ('algorithms', models.FloatField(default=0)),
+                ('work_experience', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(log_baselines, migrations.RunPython.noop),
+    ]
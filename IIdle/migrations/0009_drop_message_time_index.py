@@ -0,0 +1,17 @@
+# Generated by Django 3.1 on 2026-10-18 15:34
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('IIdle', '0008_action_log'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_user_time_idx',
+        ),
+    ]
@@ -1,11 +1,20 @@
 from django.contrib.auth.models import User
 from django.db.models import (
     OneToOneField, DecimalField, IntegerField, ForeignKey, CharField, Model, CASCADE, CheckConstraint, Q, BooleanField,
-    DateTimeField, TextField
+    DateTimeField, TextField, Index, PositiveIntegerField, F, PositiveSmallIntegerField, JSONField, FloatField
 )
 
 from IIdle.abilities import ABILITIES
-from IIdle.consts import LAST_SEMESTER
+from IIdle.consts import LAST_SEMESTER, USER_FIELDS_THAT_MIGHT_CHANGE
+from IIdle.messages import EVENT_CHOICES, TEXT, Event, render_message
+
+
+def get_semester(day: int, failed_a_semester: bool) -> int:
+    return max(min(day // 14 + (1 if not failed_a_semester else 0), LAST_SEMESTER), 1)
+
+
+def bump_state_version(user_id: int):
+    UserData.objects.filter(user_id=user_id).update(version=F('version') + 1)
 
 
 class UserData(Model):
@@ -20,9 +29,12 @@ class UserData(Model):
     work_experience = DecimalField(max_digits=5, decimal_places=2, default=0)
     day = IntegerField(default=0)
     hour = IntegerField(default=0)
+    next_due = DateTimeField(null=True, blank=True)
+    # Bumped by every write to the user's game state, clients get it back as an ETag
+    version = PositiveIntegerField(default=0)
 
     def semester(self):
-        return max(min(self.day // 14 + (1 if not self.failed_a_semester else 0), LAST_SEMESTER), 1)
+        return get_semester(self.day, self.failed_a_semester)
 
     class Meta:
         constraints = [
@@ -35,6 +47,9 @@ class UserData(Model):
             CheckConstraint(check=Q(algorithms__lte=100, algorithms__gte=0), name='algorithms_range'),
             CheckConstraint(check=Q(work_experience__lte=100, work_experience__gte=0), name='work_experience_range'),
         ]
+        indexes = [
+            Index(fields=['next_due'], name='userdata_next_due_idx'),
+        ]
 
 
 CLASSES_CHOICES = {
@@ -84,6 +99,16 @@ ACTIONS_CHOICES = {
 }
 
 
+# Action codes of the action log, new actions have to be appended so the logged codes keep their meaning
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS_CHOICES, start=1)}
+# Brings the log in line with user data that was changed outside of it, e.g. before there was a log
+BASELINE = 0
+
+
+def stat_values(source) -> dict:
+    return {key: float(getattr(source, key)) for key in USER_FIELDS_THAT_MIGHT_CHANGE}
+
+
 class Timetable(Model):
     user = ForeignKey(User, on_delete=CASCADE)
     action = CharField(max_length=50, choices=ACTIONS_CHOICES.items())
@@ -91,6 +116,9 @@ class Timetable(Model):
 
     class Meta:
         ordering = ['time']
+        indexes = [
+            Index(fields=['user', 'time'], name='timetable_user_time_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} {self.action} {self.time.date()}'
@@ -123,8 +151,47 @@ class Abilities(Model):
 
 class Message(Model):
     user = ForeignKey(User, on_delete=CASCADE)
-    text = TextField()
+    event = PositiveSmallIntegerField(choices=EVENT_CHOICES, default=TEXT)
+    subject = CharField(max_length=40, blank=True, default='')
+    payload = JSONField(default=list, blank=True)
+    # Only used by TEXT messages, every other event is rendered from its code, subject and payload
+    text = TextField(blank=True, default='')
     time = DateTimeField(auto_now=True)
 
+    @classmethod
+    def from_event(cls, user: User, event: Event) -> 'Message':
+        return cls(user=user, event=event.event, subject=event.subject, payload=list(event.payload))
+
+    def render(self) -> str:
+        return render_message(self.event, self.subject, self.payload, self.text)
+
+    def __str__(self):
+        return self.render()
+
     class Meta:
         ordering = ['time']
+
+
+class ActionEvent(Model):
+    """What an hour of the timetable changed, the user data is the sum of a user's events."""
+    user = ForeignKey(User, on_delete=CASCADE)
+    action = PositiveSmallIntegerField(choices=[(BASELINE, 'Baseline'),
+                                                *((code, action) for action, code in ACTION_CODES.items())])
+    # Where the game is after the action
+    day = PositiveIntegerField()
+    hour = PositiveSmallIntegerField()
+    failed_a_semester = BooleanField()
+    cash = FloatField(default=0)
+    energy = FloatField(default=0)
+    mood = FloatField(default=0)
+    math = FloatField(default=0)
+    programming = FloatField(default=0)
+    algorithms = FloatField(default=0)
+    work_experience = FloatField(default=0)
+
+    @classmethod
+    def from_change(cls, user_id: int, action: int, before: dict, after) -> 'ActionEvent':
+        """The event of going from stat values to the state of a UserData or a UserState."""
+        return cls(user_id=user_id, action=action, day=after.day, hour=after.hour,
+                   failed_a_semester=after.failed_a_semester,
+                   **{key: value - before[key] for key, value in stat_values(after).items()})
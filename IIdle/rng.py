@@ -0,0 +1,31 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from random import Random
+
+from django.conf import settings
+
+# Rolls of a catch-up come from a source seeded with the user and the version of their state, so the same backlog
+# always plays out the same way, however it is processed. Everything else rolls from a shared, unseeded source.
+_source: ContextVar = ContextVar('random_source', default=Random())
+
+
+def uniform(a: float, b: float) -> float:
+    return _source.get().uniform(a, b)
+
+
+def random() -> float:
+    return _source.get().random()
+
+
+@contextmanager
+def random_source(seed):
+    token = _source.set(Random(seed))
+    try:
+        yield
+    finally:
+        _source.reset(token)
+
+
+def seeded_random(user_id: int, version: int):
+    # The secret key keeps players from working out the rolls of their next catch-up
+    return random_source(f'{settings.SECRET_KEY}:{user_id}:{version}')
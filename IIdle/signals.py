@@ -1,12 +1,46 @@
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal
+from rest_framework.authtoken.models import Token
 
+from IIdle.cache import invalidate_user_data, invalidate_token
 from IIdle.models import UserData
 
+# Sent with the user_id by writes that connected clients of the stream should hear about right away
+state_changed = Signal()
+
 
 def create_user_data(sender, instance: User, created: bool, **kwargs):
     if created:
         UserData.objects.create(user=instance)
 
 
+def drop_cached_user(sender, instance: User, created: bool, **kwargs):
+    # Authentication takes the user from the cached user data, they could have been deactivated
+    if not created:
+        invalidate_user_data(instance.pk)
+
+
+def drop_cached_token(sender, instance: Token, **kwargs):
+    invalidate_token(instance.key)
+
+
+def drop_cached_user_data(sender, instance: UserData, **kwargs):
+    invalidate_user_data(instance.user_id)
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # Straight on the sqlite3 connection, so they aren't counted or logged as queries of a request
+    for pragma, value in settings.IIDLE_SQLITE_PRAGMAS.items():
+        connection.connection.execute(f'PRAGMA {pragma} = {value}')
+
+
 post_save.connect(receiver=create_user_data, sender=User, weak=False, dispatch_uid='User data handler')
+post_save.connect(receiver=drop_cached_user, sender=User, weak=False, dispatch_uid='Cached user handler')
+post_delete.connect(receiver=drop_cached_token, sender=Token, weak=False, dispatch_uid='Deleted token cache handler')
+post_save.connect(receiver=drop_cached_user_data, sender=UserData, weak=False, dispatch_uid='User data cache handler')
+connection_created.connect(receiver=apply_sqlite_pragmas, weak=False, dispatch_uid='SQLite pragmas handler')
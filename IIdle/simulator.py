@@ -0,0 +1,132 @@
+from collections import defaultdict, Counter
+from multiprocessing import Pool
+
+import django
+
+from IIdle.actions import (ACTION_TO_CLASS, Class, Sleep, Work, Relax, Party, LearnMath, LearnProgramming,
+                           LearnAlgorithms)
+from IIdle.consts import HOURS_IN_DAY, DAYS_IN_FORTNIGHT, LAST_SEMESTER, USER_FIELDS_THAT_MIGHT_CHANGE
+from IIdle.engine import UserState
+from IIdle.messages import EXAM_PASSED, EXAM_FLUNKED, SEMESTER_PASSED, SEMESTER_FAILED
+from IIdle.models import UserData
+from IIdle.rng import random_source
+from IIdle.timetable_processor import VALID_ACTIONS
+
+# Failing a semester twice starts the studies over, students that keep failing are given up on eventually
+MAX_SEMESTERS = 2 * LAST_SEMESTER
+
+
+def classes_to_attend(state: UserState, hour: int) -> list:
+    """Classes held at the hour that are still to be passed, the ones of the current semester first."""
+    semester = state.semester()
+    return sorted((action for action in VALID_ACTIONS[hour, semester % 2]
+                   if issubclass(action, Class) and action.semester <= semester
+                   and action.name not in state.completed_courses),
+                  key=lambda action: action.semester != semester)
+
+
+def routine_day(routine: list):
+    """A strategy that attends classes when they are held and goes through the routine in the other hours."""
+    # The plan only changes with the semester and the passed courses, so it's made once for every combination
+    plans = {}
+
+    def plan(state: UserState) -> list:
+        key = state.semester(), frozenset(state.completed_courses)
+        if key not in plans:
+            remaining = iter(routine)
+            plans[key] = [(classes_to_attend(state, hour) or [next(remaining, Sleep)])[0]
+                          for hour in range(HOURS_IN_DAY)]
+        return plans[key]
+
+    return plan
+
+
+STRATEGIES = {
+    # The day of test_semester_scenarios.day_loop
+    'day_loop': routine_day([Sleep] * 6 + [Work] * 3 + [Relax, LearnMath, LearnProgramming, LearnAlgorithms] * 2
+                            + [Party]),
+    'studious': routine_day([Sleep] * 8 + [LearnMath, LearnProgramming, LearnAlgorithms] * 3 + [Work] * 2 + [Relax]),
+    'slacker': routine_day([Sleep] * 8 + [Work] * 4 + [Party, Relax] * 3),
+}
+
+
+class Report:
+    def __init__(self):
+        self.students = 0
+        self.graduated = 0
+        self.exams = defaultdict(Counter)
+        self.semesters = defaultdict(Counter)
+        self.stats = Counter()
+
+    def add_student(self, state: UserState, graduated: bool):
+        self.students += 1
+        self.graduated += graduated
+        for key in USER_FIELDS_THAT_MIGHT_CHANGE:
+            self.stats[key] += getattr(state, key)
+
+    def add_events(self, semester: int, events: list):
+        for event in events:
+            if event.event in (EXAM_PASSED, EXAM_FLUNKED):
+                self.exams[event.subject][event.event == EXAM_PASSED] += 1
+            elif event.event in (SEMESTER_PASSED, SEMESTER_FAILED):
+                self.semesters[semester][event.event == SEMESTER_PASSED] += 1
+
+    def merge(self, other: 'Report'):
+        self.students += other.students
+        self.graduated += other.graduated
+        for course, outcomes in other.exams.items():
+            self.exams[course].update(outcomes)
+        for semester, outcomes in other.semesters.items():
+            self.semesters[semester].update(outcomes)
+        self.stats.update(other.stats)
+
+    def as_dict(self) -> dict:
+        def pass_rate(outcomes: Counter) -> dict:
+            attempts = outcomes[True] + outcomes[False]
+            return {'attempts': attempts, 'pass_rate': outcomes[True] / attempts if attempts else None}
+
+        students = self.students or 1
+        return {
+            'students': self.students,
+            'graduation_rate': self.graduated / students,
+            'semesters': {semester: pass_rate(self.semesters[semester]) for semester in sorted(self.semesters)},
+            'courses': {course: pass_rate(outcomes) for course, outcomes in sorted(
+                self.exams.items(), key=lambda item: (ACTION_TO_CLASS[item[0]].semester, item[0]))},
+            'mean_stats': {key: self.stats[key] / students for key in USER_FIELDS_THAT_MIGHT_CHANGE},
+        }
+
+
+def simulate_student(strategy, seed, report: Report):
+    """Plays out the studies of a new student day by day, until they graduate or have finished MAX_SEMESTERS."""
+    state = UserState.detached(UserData())
+    graduated = False
+    with random_source(seed):
+        for _ in range(MAX_SEMESTERS):
+            semester = state.semester()
+            for _ in range(DAYS_IN_FORTNIGHT):
+                for action in strategy(state):
+                    action.simulate(state)
+                report.add_events(semester, state.messages)
+                state.messages = []
+            if semester == LAST_SEMESTER:
+                graduated = True
+                break
+    report.add_student(state, graduated)
+
+
+def simulate_students(strategy_name: str, seeds: range) -> Report:
+    report = Report()
+    for seed in seeds:
+        simulate_student(STRATEGIES[strategy_name], f'{strategy_name}:{seed}', report)
+    return report
+
+
+def run(strategy_name: str, students: int, processes: int = None, chunk_size: int = 100) -> Report:
+    """Spreads the students over a pool of processes, in chunks so each process sends back a single report."""
+    chunks = [range(start, min(start + chunk_size, students)) for start in range(0, students, chunk_size)]
+    report = Report()
+    # Processes that are spawned instead of forked have to set up Django before they can unpickle the tasks
+    with Pool(processes, initializer=django.setup) as pool:
+        for chunk_report in pool.starmap(simulate_students, [(strategy_name, chunk) for chunk in chunks]):
+            report.merge(chunk_report)
+    return report
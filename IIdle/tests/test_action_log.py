@@ -0,0 +1,70 @@
+from datetime import datetime, timezone, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from IIdle.action_log import differences, replay, rebuild, add_baseline
+from IIdle.consts import ORM_ENGINE, MEMORY_ENGINE
+from IIdle.models import UserData, Timetable, ActionEvent, ACTION_CODES, BASELINE
+from IIdle.timetable_processor import process_timetable
+
+# Two days, so the log goes through days ending with and without funds
+ACTIONS = ['Sleep', 'Work', 'Learn Math', 'Logic', 'Party', 'Relax'] * 8
+
+
+class ActionLogTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='abc')
+        UserData.objects.filter(user=self.user).update(cash=150)
+
+    def catch_up(self, actions):
+        start = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+        Timetable.objects.bulk_create(Timetable(user=self.user, action=action, time=start + timedelta(seconds=x))
+                                      for x, action in enumerate(actions))
+        process_timetable(self.user)
+
+    def assert_log_matches(self):
+        self.assertEqual(differences(self.user.pk), {})
+        user_data = UserData.objects.get(user=self.user)
+        replayed = replay(self.user.pk)
+        self.assertEqual((replayed['day'], replayed['hour']), (user_data.day, user_data.hour))
+
+    def test_every_hour_is_logged(self):
+        add_baseline(self.user.pk)
+        self.catch_up(ACTIONS[:6])
+        logged = ActionEvent.objects.filter(user=self.user).order_by('id').values_list('action', flat=True)
+        self.assertEqual(list(logged), [BASELINE] + [ACTION_CODES[action] for action in ACTIONS[:6]])
+
+    def test_log_matches_user_data(self):
+        for engine in (ORM_ENGINE, MEMORY_ENGINE):
+            with self.subTest(engine), override_settings(IIDLE_ENGINE=engine, IIDLE_FAST_FORWARD_HOURS=1000):
+                add_baseline(self.user.pk)
+                self.catch_up(ACTIONS)
+                self.assert_log_matches()
+
+    def test_fast_forward_is_logged(self):
+        add_baseline(self.user.pk)
+        with override_settings(IIDLE_FAST_FORWARD_HOURS=24):
+            self.catch_up(ACTIONS)
+        self.assertEqual(ActionEvent.objects.filter(user=self.user).count(), len(ACTIONS) + 1)
+        self.assert_log_matches()
+
+    def test_changes_outside_of_the_log(self):
+        self.assertEqual(set(differences(self.user.pk)), {'cash'})
+        add_baseline(self.user.pk)
+        self.catch_up(ACTIONS[:6])
+        UserData.objects.filter(user=self.user).update(math=99, hour=20)
+        self.assertEqual(set(differences(self.user.pk)), {'math', 'hour'})
+        rebuild(self.user.pk)
+        self.assert_log_matches()
+        self.assertEqual(UserData.objects.get(user=self.user).hour, 6)
+
+    def test_command(self):
+        output = StringIO()
+        call_command('action_log', 'baseline', stdout=output)
+        self.assertIn(f'User {self.user.pk}: cash is 150.0, the log has 500.0', output.getvalue())
+        output = StringIO()
+        call_command('action_log', 'verify', '--user', str(self.user.pk), stdout=output)
+        self.assertEqual(output.getvalue(), '0 user(s) did not match the action log\n')
@@ -5,6 +5,7 @@ from django.test import TestCase
 
 from IIdle.actions import (FinishSemester, ACTION_TO_CLASS, Sleep, Logic, CalculusI, EndDay, Work, LearnMath,
                            LearnProgramming, LearnAlgorithms, Party, Relax)
+from IIdle.messages import EXAM_PASSED, TOO_TIRED
 from IIdle.models import ClassesTaken, CompletedCourses, UserData, Timetable, Abilities, ACTIONS_CHOICES, Message
 
 
@@ -72,6 +73,19 @@ class SemesterEndWontRunExamTwice(TestCase):
         self.assertFalse(ClassesTaken.objects.exists())
 
 
+class SemesterEndIgnoresOtherUsersCourses(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='abc')
+        UserData.objects.filter(user=self.user).update(math=50, programming=50, algorithms=50)
+        CompletedCourses.objects.create(user=User.objects.create(username='xyz'), course='Logic')
+        ClassesTaken.objects.create(user=self.user, course='Logic', times_present=12)
+
+    def test_process_end_semester(self):
+        FinishSemester.process_action(self.user)
+        self.assertTrue(CompletedCourses.objects.filter(user=self.user, course='Logic').exists())
+        self.assertTrue(Message.objects.filter(user=self.user, event=EXAM_PASSED, subject='Logic').exists())
+
+
 class SleepingWorks(TestCase):
     def setUp(self):
         self.user = User.objects.create(username='abc')
@@ -160,7 +174,7 @@ class BeingTiredIsBad(TestCase):
     def setUp(self):
         self.user = User.objects.create(username='abc')
         self.user.data.energy = 5
-        self.user.save()
+        self.user.data.save()
 
     def test_tiring_actions(self):
         Work.process_action(self.user)
@@ -171,7 +185,7 @@ class BeingTiredIsBad(TestCase):
         CalculusI.process_action(self.user)
         self.user.refresh_from_db()
         self.assertEqual(self.user.data.cash, 500)
-        self.assertEqual(Message.objects.filter(text='You were too tired to do what you had planned!').count(), 6)
+        self.assertEqual(Message.objects.filter(event=TOO_TIRED).count(), 6)
 
 
 class ClassesCanGiveAbilities(TestCase):
@@ -185,3 +199,27 @@ class ClassesCanGiveAbilities(TestCase):
         self.assertTrue(Abilities.objects.get(user=self.user, ability='Logic'))
         self.assertFalse(Abilities.objects.filter(user=self.user, ability='Basic Calculus').exists())
         self.assertTrue(Abilities.objects.filter(user=self.user, ability='Intermediate Calculus').exists())
+
+
+class ExamPassProbability(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='abc')
+
+    def test_matches_the_rolls(self):
+        UserData.objects.filter(user=self.user).update(math=25)
+        stats = UserData.objects.get(user=self.user)
+        probability = Logic.pass_probability(stats, set())
+        self.assertGreater(probability, 0)
+        self.assertLess(probability, 1)
+        # Passing takes the luck that leaves the given probability above it
+        luck_needed = 1.25 - probability * 0.5
+        with patch('IIdle.actions.uniform', return_value=luck_needed + 0.001):
+            self.assertTrue(Logic.passes_exam(stats, set()))
+        with patch('IIdle.actions.uniform', return_value=luck_needed - 0.001):
+            self.assertFalse(Logic.passes_exam(stats, set()))
+
+    def test_bounds(self):
+        UserData.objects.filter(user=self.user).update(math=0)
+        self.assertEqual(Logic.pass_probability(UserData.objects.get(user=self.user), set()), 0)
+        UserData.objects.filter(user=self.user).update(math=100)
+        self.assertEqual(Logic.pass_probability(UserData.objects.get(user=self.user), set()), 1)
@@ -0,0 +1,385 @@
+import asyncio
+import json
+from base64 import urlsafe_b64encode
+from datetime import datetime, timezone, timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, AsyncClient, override_settings
+from django.urls import resolve
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from IIdle.abilities import ABILITIES
+from IIdle.actions import Sleep
+from IIdle.api.pagination import encode_cursor
+from IIdle.cache import invalidate_user_data, user_data_cache_stats, user_data_key, get_user_data, token_key
+from IIdle.checks import shared_cache_for_worker
+from IIdle.consts import ORM_ENGINE
+from IIdle.models import UserData, Timetable, CompletedCourses, ClassesTaken, Abilities, Message, CLASSES_CHOICES
+
+
+def seed(user: User, size: int):
+    now = datetime.now(tz=timezone.utc)
+    courses = list(CLASSES_CHOICES)[:size]
+    Timetable.objects.bulk_create(
+        Timetable(user=user, action='Sleep', time=now + timedelta(seconds=30 * (x + 1))) for x in range(min(size, 12))
+    )
+    CompletedCourses.objects.bulk_create(CompletedCourses(user=user, course=course) for course in courses)
+    ClassesTaken.objects.bulk_create(ClassesTaken(user=user, course=course, times_present=3) for course in courses)
+    Abilities.objects.bulk_create(Abilities(user=user, ability=ability) for ability, _ in ABILITIES[:size])
+    Message.objects.bulk_create(Message(user=user, text=f'Message {x}') for x in range(size))
+    UserData.objects.filter(user=user).update(next_due=now + timedelta(seconds=30))
+    invalidate_user_data(user.pk)
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='abc')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+
+
+class GameStateTest(APITestCase):
+    def test_state(self):
+        seed(self.user, 2)
+        response = self.client.get(f'/state/{self.user.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['userdata']['user']['username'], 'abc')
+        self.assertFalse({'next_due', 'version'} & set(response.data['userdata']))
+        self.assertEqual(len(response.data['timetable']), 2)
+        self.assertEqual(response.data['timetable'][0]['hour'], 0)
+        self.assertCountEqual([course['ects'] for course in response.data['courses']], [8, 10])
+        self.assertEqual(len(response.data['classes']), 2)
+        self.assertEqual(len(response.data['abilities']), 2)
+        self.assertEqual([message['text'] for message in response.data['messages']['results']],
+                         ['Message 0', 'Message 1'])
+        self.assertEqual(response.data['messages']['cursor'], encode_cursor(Message.objects.latest('id')))
+
+    def test_query_count_does_not_depend_on_data_size(self):
+        self.client.get(f'/userdata/{self.user.pk}/')
+        # User data, seeding drops it from the cache, four prefetched relations and a page of messages
+        for size in (0, 4):
+            seed(self.user, size)
+            with self.subTest(size=size), self.assertNumQueries(6):
+                self.client.get(f'/state/{self.user.pk}/')
+
+    def test_processes_timetable(self):
+        due = datetime.now(tz=timezone.utc) - timedelta(seconds=1)
+        Timetable.objects.create(user=self.user, action='Sleep', time=due)
+        UserData.objects.filter(user=self.user).update(next_due=due)
+        response = self.client.get(f'/state/{self.user.pk}/')
+        self.assertEqual(response.data['userdata']['hour'], 1)
+        self.assertEqual(response.data['timetable'], [])
+        self.assertEqual(len(response.data['messages']['results']), 1)
+
+    @override_settings(IIDLE_MESSAGES_PAGE_SIZE=3)
+    def test_only_latest_messages(self):
+        seed(self.user, 5)
+        response = self.client.get(f'/state/{self.user.pk}/')
+        self.assertEqual([message['text'] for message in response.data['messages']['results']],
+                         ['Message 2', 'Message 3', 'Message 4'])
+
+    def test_only_owner(self):
+        other = User.objects.create(username='xyz')
+        self.assertEqual(self.client.get(f'/state/{other.pk}/').status_code, 403)
+
+
+class ForecastTest(APITestCase):
+    def test_forecast(self):
+        UserData.objects.filter(user=self.user).update(math=100)
+        ClassesTaken.objects.create(user=self.user, course='Logic', times_present=10)
+        ClassesTaken.objects.create(user=self.user, course='Calculus I', times_present=4)
+        invalidate_user_data(self.user.pk)
+        response = self.client.get(f'/forecast/{self.user.pk}/')
+        self.assertEqual(response.status_code, 200)
+        courses = {course['course']: course for course in response.data['courses']}
+        self.assertEqual(courses['Logic']['pass_probability'], 1)
+        self.assertEqual(courses['Calculus I']['exam_pass_probability'], 1)
+        # Not attended often enough to take the exam yet
+        self.assertEqual(courses['Calculus I']['pass_probability'], 0)
+        self.assertEqual(courses['Calculus I']['attendance_needed'], 6)
+        self.assertEqual(response.data['required_ects'], 20)
+        self.assertEqual(response.data['expected_ects'], 8)
+        self.assertEqual(response.data['semester_pass_probability'], 0)
+
+    def test_completed_courses_count_towards_the_semester(self):
+        UserData.objects.filter(user=self.user).update(math=100, programming=100, algorithms=100)
+        CompletedCourses.objects.create(user=self.user, course='Logic')
+        for course in ('Calculus I', 'Introduction To Computer Science'):
+            ClassesTaken.objects.create(user=self.user, course=course, times_present=10)
+        invalidate_user_data(self.user.pk)
+        response = self.client.get(f'/forecast/{self.user.pk}/')
+        self.assertNotIn('Logic', [course['course'] for course in response.data['courses']])
+        self.assertEqual(response.data['completed_ects'], 8)
+        self.assertEqual(response.data['semester_pass_probability'], 1)
+
+    def test_only_owner(self):
+        other = User.objects.create(username='xyz')
+        self.assertEqual(self.client.get(f'/forecast/{other.pk}/').status_code, 403)
+
+
+class ConditionalGetTest(APITestCase):
+    def get(self, route, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(f'/{route}/{self.user.pk}/', **headers)
+
+    def test_not_modified(self):
+        seed(self.user, 3)
+        for route in ('userdata', 'timetable', 'courses', 'classes', 'abilities', 'messages', 'state',
+                      'get_valid_actions'):
+            with self.subTest(route):
+                etag = self.get(route)['ETag']
+                # The token and the version both come from the cache
+                with self.assertNumQueries(0):
+                    response = self.get(route, etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(self.get(route, f'W/{etag}').status_code, 304)
+                self.assertEqual(self.get(route, '"stale"').status_code, 200)
+
+    def test_clearing_messages_changes_etag(self):
+        seed(self.user, 3)
+        etag = self.get('messages')['ETag']
+        self.client.post(f'/clearmessages/{self.user.pk}/')
+        response = self.get('messages', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_setting_timetable_changes_etag(self):
+        etag = self.get('timetable')['ETag']
+        self.client.post(f'/set_timetable/{self.user.pk}/', [{'hour': 0, 'action': 'Sleep'}], format='json')
+        response = self.get('timetable', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+
+    def test_processing_changes_etag(self):
+        etag = self.get('userdata')['ETag']
+        due = datetime.now(tz=timezone.utc) - timedelta(seconds=1)
+        Timetable.objects.create(user=self.user, action='Sleep', time=due)
+        UserData.objects.filter(user=self.user).update(next_due=due)
+        invalidate_user_data(self.user.pk)
+        response = self.get('userdata', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['hour'], 1)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(IIDLE_MESSAGES_PAGE_SIZE=4)
+class MessagesPaginationTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        seed(self.user, 10)
+
+    def get(self, **params):
+        return self.client.get(f'/messages/{self.user.pk}/', params)
+
+    def texts(self, response):
+        return [message['text'] for message in response.data['results']]
+
+    def test_latest_page(self):
+        response = self.get()
+        self.assertEqual(self.texts(response), ['Message 6', 'Message 7', 'Message 8', 'Message 9'])
+        self.assertFalse(response.data['has_more'])
+        self.assertEqual(self.texts(self.get(limit=2)), ['Message 8', 'Message 9'])
+
+    def test_since(self):
+        cursor = self.get().data['cursor']
+        self.assertEqual(self.get(since=cursor).data,
+                         {'results': [], 'cursor': cursor, 'has_more': False, 'before': None})
+        Message.objects.bulk_create(Message(user=self.user, text=f'New {x}') for x in range(6))
+        response = self.get(since=cursor)
+        self.assertEqual(self.texts(response), ['New 0', 'New 1', 'New 2', 'New 3'])
+        self.assertTrue(response.data['has_more'])
+        response = self.get(since=response.data['cursor'])
+        self.assertEqual(self.texts(response), ['New 4', 'New 5'])
+        self.assertFalse(response.data['has_more'])
+
+    def test_before(self):
+        response = self.get()
+        texts = self.texts(response)
+        while response.data['before'] is not None:
+            response = self.get(before=response.data['before'])
+            self.assertTrue(response.data['has_more'])
+            texts = self.texts(response) + texts
+        self.assertEqual(texts, [f'Message {x}' for x in range(10)])
+        self.assertEqual(self.texts(response), ['Message 0', 'Message 1'])
+        self.assertEqual(self.texts(self.get(since=response.data['cursor'])), [f'Message {x}' for x in range(2, 6)])
+
+    def test_message_committed_later_with_earlier_time(self):
+        cursor = self.get().data['cursor']
+        # Its time was taken before the messages the client already has were committed
+        Message.objects.create(user=self.user, text='Late')
+        Message.objects.filter(text='Late').update(time=datetime(2020, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(self.texts(self.get(since=cursor)), ['Late'])
+
+    def test_cursor_of_earlier_format(self):
+        message = Message.objects.get(user=self.user, text='Message 7')
+        cursor = urlsafe_b64encode(f'{message.time.isoformat()}|{message.pk}'.encode()).decode()
+        self.assertEqual(self.texts(self.get(since=cursor)), ['Message 8', 'Message 9'])
+
+    def test_page_size_does_not_depend_on_history(self):
+        Message.objects.bulk_create(Message(user=self.user, text='Old') for _ in range(500))
+        self.assertEqual(len(self.get().data['results']), 4)
+
+    def test_invalid_parameters(self):
+        cursor = self.get().data['cursor']
+        for params in ({'since': 'nonsense'}, {'before': 'nonsense'}, {'since': cursor, 'before': cursor},
+                       {'limit': 'ten'}, {'limit': 0}, {'limit': 201}):
+            with self.subTest(params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+
+class UserDataCacheTest(APITestCase):
+    def get(self):
+        return self.client.get(f'/userdata/{self.user.pk}/')
+
+    def test_steady_state_poll(self):
+        self.get()
+        hits = user_data_cache_stats['hits']
+        with self.assertNumQueries(0):
+            response = self.get()
+        self.assertEqual(response.data['user']['username'], 'abc')
+        # Authentication, catching up and the ETag share a lookup, the view makes the other one
+        self.assertEqual(user_data_cache_stats['hits'], hits + 3)
+
+    def test_processing_invalidates(self):
+        self.client.post(f'/set_timetable/{self.user.pk}/', [{'hour': 0, 'action': 'Sleep'}], format='json')
+        next_due = Timetable.objects.get(user=self.user).time
+        self.get()
+        self.assertEqual(get_user_data(self.user.pk).next_due, next_due)
+        Timetable.objects.update(time=datetime.now(tz=timezone.utc) - timedelta(seconds=1))
+        UserData.objects.filter(user=self.user).update(next_due=datetime.now(tz=timezone.utc) - timedelta(seconds=1))
+        invalidate_user_data(self.user.pk)
+        self.get()
+        response = self.get()
+        self.assertEqual(response.data['hour'], 1)
+        self.assertIsNone(get_user_data(self.user.pk).next_due)
+
+    def test_actions_invalidate(self):
+        self.get()
+        Sleep.process(self.user)
+        self.assertEqual(self.get().data['hour'], 1)
+        with override_settings(IIDLE_ENGINE=ORM_ENGINE):
+            Sleep.process(self.user)
+        self.assertEqual(self.get().data['hour'], 2)
+
+    def test_only_user_data_and_user_status_are_cached(self):
+        self.get()
+        cached = cache.get(user_data_key(self.user.pk))
+        self.assertNotIn(self.user.password, cached)
+        user_data = get_user_data(self.user.pk)
+        self.assertEqual((user_data.user.pk, user_data.user.username), (self.user.pk, 'abc'))
+        self.assertEqual(user_data.user.get_deferred_fields(), {field.attname for field in User._meta.concrete_fields}
+                         - {'id', 'username', 'is_active'})
+
+    def test_process_local_cache_needs_inline_processing(self):
+        self.assertEqual(shared_cache_for_worker(None), [])
+        with override_settings(IIDLE_INLINE_PROCESSING=False):
+            self.assertEqual([error.id for error in shared_cache_for_worker(None)], ['IIdle.E001'])
+
+
+class SetTimetableTest(APITestCase):
+    def test_validated_against_stored_data(self):
+        self.client.get(f'/userdata/{self.user.pk}/')
+        # Not through the game, so the cached snapshot still has hour 0
+        UserData.objects.filter(user=self.user).update(hour=12)
+        response = self.client.post(f'/set_timetable/{self.user.pk}/', [{'hour': 12, 'action': 'Sleep'}], format='json')
+        self.assertEqual(response.data, {'success': True, 'message': 'Timetable successfully saved'})
+
+
+class TokenCacheTest(APITestCase):
+    def get(self):
+        return self.client.get(f'/get_valid_actions/{self.user.pk}/')
+
+    def test_deleted_token_is_rejected(self):
+        self.assertEqual(self.get().status_code, 200)
+        Token.objects.filter(user=self.user).delete()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_logout(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.client.post('/authentication/logout/')
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_only_user_id_is_cached(self):
+        self.get()
+        self.assertEqual(cache.get(token_key(Token.objects.get(user=self.user).key)), self.user.pk)
+
+    def test_deactivation_is_checked_on_cache_hits(self):
+        self.assertEqual(self.get().status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        invalidate_user_data(self.user.pk)
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_owner_check_does_not_query(self):
+        self.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(f'/get_valid_actions/{self.user.pk + 1}/').status_code, 403)
+
+
+# The async views run in other threads, which only see committed data
+@override_settings(ROOT_URLCONF='backend.asgi_urls')
+class AsyncViewsTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='abc')
+        self.token = Token.objects.create(user=self.user).key
+        self.client = AsyncClient(raise_request_exception=False)
+
+    def get(self, route, headers=()):
+        headers = [(b'host', b'testserver'), (b'authorization', f'Token {self.token}'.encode()), *headers]
+        return asyncio.run(self.client.get(f'/{route}/{self.user.pk}/', headers=headers))
+
+    def test_read_endpoints_are_async(self):
+        for route in ('userdata', 'timetable', 'courses', 'classes', 'abilities', 'messages', 'state',
+                      'get_valid_actions'):
+            with self.subTest(route):
+                self.assertTrue(asyncio.iscoroutinefunction(resolve(f'/{route}/1/').func))
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/set_timetable/1/').func))
+
+    def test_same_responses(self):
+        seed(self.user, 3)
+        sync_client = APIClient()
+        sync_client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        for route in ('userdata', 'timetable', 'courses', 'classes', 'abilities', 'messages', 'state',
+                      'get_valid_actions'):
+            with self.subTest(route):
+                response = self.get(route)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), sync_client.get(f'/{route}/{self.user.pk}/').json())
+
+    def test_not_modified(self):
+        etag = self.get('state')['ETag']
+        response = self.get('state', [(b'if-none-match', etag.encode())])
+        self.assertEqual(response.status_code, 304)
+
+    def test_processes_timetable(self):
+        due = datetime.now(tz=timezone.utc) - timedelta(seconds=1)
+        Timetable.objects.create(user=self.user, action='Sleep', time=due)
+        UserData.objects.filter(user=self.user).update(next_due=due)
+        invalidate_user_data(self.user.pk)
+        self.assertEqual(json.loads(self.get('userdata').content)['hour'], 1)
+
+    def test_token_is_required(self):
+        self.token = 'invalid'
+        self.assertEqual(self.get('userdata').status_code, 401)
+        self.assertEqual(self.get('get_valid_actions').status_code, 401)
+
+    def test_concurrent_polls(self):
+        async def poll_all():
+            headers = [(b'host', b'testserver'), (b'authorization', f'Token {self.token}'.encode())]
+            return await asyncio.gather(*(self.client.get(f'/{route}/{self.user.pk}/', headers=headers)
+                                          for route in ('userdata', 'state', 'messages') * 5))
+
+        seed(self.user, 2)
+        responses = asyncio.run(poll_all())
+        self.assertEqual({response.status_code for response in responses}, {200})
@@ -0,0 +1,10 @@
+from django.test import TestCase
+
+from benchmarks.actions import run, compare
+
+
+class ActionsBenchmarkTest(TestCase):
+    def test_same_code_writes_the_same(self):
+        # Timings are left out, only queries and rows are compared without a tolerance
+        _, regressions = compare(run(2), run(2), tolerance=float('inf'))
+        self.assertEqual(regressions, [])
@@ -0,0 +1,153 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from IIdle.actions import Sleep, Logic, EndDay, FinishSemester, ACTION_TO_CLASS
+from IIdle.consts import ORM_ENGINE, MEMORY_ENGINE
+from IIdle.messages import EXAM_PASSED
+from IIdle.models import UserData, ClassesTaken, CompletedCourses, Abilities, Message, CLASSES_CHOICES
+from IIdle.tests import test_actions
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class SemesterEndWorksPassedInDb(test_actions.SemesterEndWorksPassed):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class SemesterEndWorksFailedInDb(test_actions.SemesterEndWorksFailed):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class SemesterEndWorksGotKickedOutInDb(test_actions.SemesterEndWorksGotKickedOut):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class SemesterEndWontRunExamTwiceInDb(test_actions.SemesterEndWontRunExamTwice):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class SemesterEndIgnoresOtherUsersCoursesInDb(test_actions.SemesterEndIgnoresOtherUsersCourses):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class SleepingWorksInDb(test_actions.SleepingWorks):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class WorkingWorksInDb(test_actions.WorkingWorks):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class LearningWorksInDb(test_actions.LearningWorks):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class RelaxingWorksInDb(test_actions.RelaxingWorks):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class PartyingWorksInDb(test_actions.PartyingWorks):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class DayEndWorksInDb(test_actions.DayEndWorks):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class BeingTiredIsBadInDb(test_actions.BeingTiredIsBad):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class ClassesCanGiveAbilitiesInDb(test_actions.ClassesCanGiveAbilities):
+    pass
+
+
+@override_settings(IIDLE_ENGINE=MEMORY_ENGINE)
+class MemoryEngineWritesOnce(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='abc')
+
+    @patch('IIdle.actions.uniform', return_value=0.5)
+    def test_single_write_back(self, _):
+        # SELECT user data, SAVEPOINT, UPDATE user data, INSERT message, RELEASE SAVEPOINT
+        with self.assertNumQueries(5):
+            Sleep.process(self.user)
+        user_data = UserData.objects.get(user=self.user)
+        self.assertEqual(user_data.energy, 50.5)
+        self.assertEqual(user_data.hour, 1)
+        self.assertEqual(self.user.data.hour, 1)
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 1)
+
+    @patch('IIdle.actions.uniform', return_value=0.5)
+    @patch('IIdle.actions.random', return_value=1)
+    def test_day_boundary(self, *_):
+        UserData.objects.filter(user=self.user).update(hour=23)
+        Logic.process(self.user)
+        user_data = UserData.objects.get(user=self.user)
+        self.assertEqual((user_data.day, user_data.hour), (1, 0))
+        self.assertEqual(user_data.cash, 400)
+        self.assertEqual(ClassesTaken.objects.get(user=self.user, course='Logic').times_present, 1)
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 2)
+
+    def test_sub_cent_changes_accumulate(self):
+        UserData.objects.filter(user=self.user).update(cash=0)
+        with patch('IIdle.actions.uniform', return_value=0.003):
+            for _ in range(10):
+                Sleep.process_action(self.user)
+        self.assertEqual(UserData.objects.get(user=self.user).energy, Decimal('50.03'))
+        EndDay.process_action(self.user)
+        self.assertEqual(UserData.objects.get(user=self.user).energy, Decimal('40.03'))
+
+
+class ExamsAreSetBased(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='abc')
+        UserData.objects.filter(user=self.user).update(math=50, programming=50, algorithms=50)
+
+    def attend(self, courses):
+        ClassesTaken.objects.bulk_create(
+            ClassesTaken(user=self.user, course=course, times_present=10) for course in courses
+        )
+        Abilities.objects.bulk_create(
+            (Abilities(user=self.user, ability=ability)
+             for course in courses for ability, _ in ACTION_TO_CLASS[course].abilities),
+            ignore_conflicts=True
+        )
+
+    def assert_queries_do_not_depend_on_exams(self, expected):
+        for courses in (list(CLASSES_CHOICES)[:4], list(CLASSES_CHOICES)[4:20]):
+            with self.subTest(exams=len(courses)):
+                self.attend(courses)
+                with self.assertNumQueries(expected):
+                    FinishSemester.process_action(self.user)
+                self.assertFalse(ClassesTaken.objects.filter(user=self.user).exists())
+        self.assertEqual(Message.objects.filter(user=self.user, event=EXAM_PASSED).count(), 20)
+
+    @override_settings(IIDLE_ENGINE=ORM_ENGINE)
+    @patch('IIdle.actions.uniform', return_value=1.25)
+    def test_in_db(self, _):
+        # User data, completed courses, abilities, attendance, passed courses, attendance cleanup, messages, version
+        self.assert_queries_do_not_depend_on_exams(8)
+        self.assertEqual(CompletedCourses.objects.filter(user=self.user).count(), 20)
+
+    @override_settings(IIDLE_ENGINE=MEMORY_ENGINE)
+    @patch('IIdle.actions.uniform', return_value=1.25)
+    def test_in_memory(self, _):
+        # User data, attendance, completed courses, abilities, SAVEPOINT, user data, attendance cleanup,
+        # passed courses, messages, RELEASE SAVEPOINT
+        self.assert_queries_do_not_depend_on_exams(10)
+        self.assertEqual(CompletedCourses.objects.filter(user=self.user).count(), 20)
@@ -0,0 +1,90 @@
+from importlib import import_module
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from IIdle.actions import Sleep, Logic, EndDay, FinishSemester, Party
+from IIdle.api.serializers import MessageSerializer
+from IIdle.consts import ORM_ENGINE, MEMORY_ENGINE
+from IIdle.messages import TEXT, DAY_DIGEST, render_message
+from IIdle.models import UserData, ClassesTaken, Message
+
+structured_messages = import_module('IIdle.migrations.0006_structured_messages')
+
+LEGACY_TEXTS = [
+    'You were too tired to do what you had planned!',
+    'You have Slept. Stats changed - Energy: 2.53 Mood: -0.08.',
+    'You have Worked. Stats changed - Cash: 41.27 Energy: -3.12 Work_Experience: 0.31.',
+    'You have attended Intro To Programming - Python class. Stats changed - Programming: 0.44.',
+    'You have Relaxed. None of your stats changed!',
+    'A day has ended. You have spent: 100.00',
+    "A day has ended but you didn't have enough funds to support yourself. "
+    'Your energy changed by: -10.00 and your mood changed by: -4.20.',
+    'A semester has ended. You have passed!',
+    'A semester has ended. You have failed!',
+    'You have taken a(n) Logic exam. You have passed!',
+    'You have taken a(n) Calculus I exam. You have flunked :(',
+    'You have earned a new ability: C++ Programming.',
+]
+
+
+def texts(user: User) -> list:
+    return [message['text'] for message in MessageSerializer(Message.objects.filter(user=user), many=True).data]
+
+
+class MessagesRenderAsBefore(TestCase):
+    @patch('IIdle.actions.uniform', return_value=0.5)
+    @patch('IIdle.actions.random', return_value=0)
+    def test_rendering(self, *_):
+        for engine in (ORM_ENGINE, MEMORY_ENGINE):
+            with self.subTest(engine), override_settings(IIDLE_ENGINE=engine):
+                self.user = User.objects.create(username=engine)
+                UserData.objects.filter(user=self.user).update(energy=50, mood=50, cash=50, math=60)
+                Sleep.process_action(self.user)
+                Party.process_action(self.user)
+                Logic.process_action(self.user)
+                EndDay.process_action(self.user)
+                ClassesTaken.objects.filter(user=self.user).update(times_present=10)
+                FinishSemester.process_action(self.user)
+                UserData.objects.filter(user=self.user).update(energy=0)
+                self.user.refresh_from_db()
+                Sleep.process_action(self.user)
+                Party.process_action(self.user)
+                self.assertEqual(texts(self.user), [
+                    'You have Slept. Stats changed - Energy: 0.50 Mood: 0.50.',
+                    'You have Partied. Stats changed - Energy: 0.50 Mood: 0.50.',
+                    'You have attended Logic class. Stats changed - Energy: 0.50 Mood: 0.50 Math: 0.25.',
+                    'You have earned a new ability: Logic.',
+                    "A day has ended but you didn't have enough funds to support yourself. "
+                    'Your energy changed by: -10.00 and your mood changed by: -10.00.',
+                    'You have taken a(n) Logic exam. You have passed!',
+                    'A semester has ended. You have failed!',
+                    'You have Slept. Stats changed - Energy: 0.50 Mood: 0.50.',
+                    'You were too tired to do what you had planned!',
+                ])
+
+
+class LegacyMessagesAreConverted(TestCase):
+    def test_round_trip(self):
+        for text in LEGACY_TEXTS:
+            with self.subTest(text):
+                event, subject, payload = structured_messages.parse(text)
+                self.assertNotEqual(event, TEXT)
+                self.assertEqual(render_message(event, subject, payload), text)
+                # Reverting the migration renders them with its own copy of the templates
+                self.assertEqual(structured_messages.render_message(event, subject, payload), text)
+
+    def test_unknown_text_is_kept(self):
+        self.assertEqual(structured_messages.parse('Welcome!'), (TEXT, '', []))
+        self.assertEqual(render_message(TEXT, '', [], 'Welcome!'), 'Welcome!')
+
+
+class DigestRendering(TestCase):
+    def test_digest(self):
+        self.assertEqual(render_message(DAY_DIGEST, '', [3, 24, 22, 0, 4500, 1, -320]),
+                         'Day 3 went by while you were away. You have done 22 of 24 planned actions. '
+                         'Stats changed - Cash: 45.00 Energy: -3.20.')
+        self.assertEqual(render_message(DAY_DIGEST, '', [0, 2, 0]),
+                         'Day 0 went by while you were away. You have done 0 of 2 planned actions. '
+                         'None of your stats changed!')
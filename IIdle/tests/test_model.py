@@ -1,6 +1,13 @@
+import os
+import sqlite3
+from tempfile import mkdtemp
+from threading import Thread
+
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
 
+from backend.sqlite3.base import DatabaseWrapper
 from IIdle.models import UserData
 
 
@@ -15,3 +22,48 @@ class UserDataAndSemesterEndAdded(TestCase):
         self.assertTrue(first.cash == second.cash == 500)
         self.assertTrue(first.energy == second.energy == 50)
         self.assertTrue(first.mood == second.mood == 50)
+
+
+class SQLitePragmasApplied(TestCase):
+    def pragmas_of_new_connection(self) -> dict:
+        results = {}
+
+        # Every thread opens its own connection
+        def read_pragmas():
+            with connection.cursor() as cursor:
+                for pragma in ('cache_size', 'synchronous', 'busy_timeout'):
+                    cursor.execute(f'PRAGMA {pragma}')
+                    results[pragma] = cursor.fetchone()[0]
+            connection.close()
+
+        thread = Thread(target=read_pragmas)
+        thread.start()
+        thread.join()
+        return results
+
+    @override_settings(IIDLE_SQLITE_PRAGMAS={'cache_size': -1234, 'synchronous': 'NORMAL', 'busy_timeout': 4321})
+    def test_pragmas_applied(self):
+        self.assertEqual(self.pragmas_of_new_connection(),
+                         {'cache_size': -1234, 'synchronous': 1, 'busy_timeout': 4321})
+
+    @override_settings(IIDLE_SQLITE_PRAGMAS={})
+    def test_no_pragmas(self):
+        self.assertNotEqual(self.pragmas_of_new_connection()['cache_size'], -1234)
+
+
+class ImmediateTransactions(TestCase):
+    def test_write_lock_taken_at_begin(self):
+        path = os.path.join(mkdtemp(), 'db.sqlite3')
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': path, 'OPTIONS': {}})
+        other = sqlite3.connect(path, timeout=0)
+        try:
+            # The way atomic() starts a transaction
+            wrapper.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+            with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                other.execute('BEGIN IMMEDIATE')
+            wrapper.rollback()
+            wrapper.set_autocommit(True)
+            other.execute('BEGIN IMMEDIATE')
+        finally:
+            other.close()
+            wrapper.close()
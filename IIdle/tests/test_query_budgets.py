@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.urls import urlpatterns
+from IIdle.tests.test_api import seed
+
+# Third party URL configurations, not ours to budget
+EXCLUDED_ROUTES = ('admin/', 'authentication/', 'authentication/registration/')
+
+DATA_SIZES = (0, 5, 30)
+
+QUERY_BUDGETS = {
+    'userdata/<int:pk>/': ('get', 2),
+    'timetable/<int:pk>/': ('get', 3),
+    'courses/<int:pk>/': ('get', 3),
+    'classes/<int:pk>/': ('get', 3),
+    'abilities/<int:pk>/': ('get', 3),
+    'messages/<int:pk>/': ('get', 3),
+    'state/<int:pk>/': ('get', 7),
+    'get_valid_actions/<int:pk>/': ('get', 2),
+    'forecast/<int:pk>/': ('get', 5),
+    'set_timetable/<int:pk>/': ('post', 8),
+    'clearmessages/<int:pk>/': ('post', 3),
+    'get_token/': ('post', 3),
+}
+
+
+def request_data(route: str, user: User, size: int):
+    if route == 'set_timetable/<int:pk>/':
+        return [{'hour': hour, 'action': 'Sleep'} for hour in range(min(size, 12))]
+    if route == 'get_token/':
+        return {'username': user.username, 'password': 'password'}
+    return None
+
+
+class EveryRouteHasABudget(TestCase):
+    def test_routes(self):
+        routes = {str(pattern.pattern) for pattern in urlpatterns if not isinstance(pattern, URLResolver)}
+        self.assertEqual(routes, set(QUERY_BUDGETS))
+        self.assertEqual({str(pattern.pattern) for pattern in urlpatterns} - routes, set(EXCLUDED_ROUTES))
+
+
+class QueryBudgets(TestCase):
+    def test_budgets(self):
+        for size in DATA_SIZES:
+            user = User.objects.create(username=f'user{size}')
+            user.set_password('password')
+            user.save()
+            seed(user, size)
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+            for route, (method, budget) in QUERY_BUDGETS.items():
+                with self.subTest(route=route, size=size):
+                    url = '/' + route.replace('<int:pk>', str(user.pk))
+                    # Budgets are for a cold cache, warm requests only get cheaper
+                    cache.clear()
+                    with CaptureQueriesContext(connection) as queries:
+                        response = getattr(client, method)(url, request_data(route, user, size), format='json')
+                    self.assertEqual(response.status_code, 200)
+                    self.assertLessEqual(len(queries), budget, '\n'.join(query['sql'] for query in queries))
@@ -0,0 +1,67 @@
+import re
+from datetime import datetime, timezone, timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from IIdle.models import UserData, Timetable, CompletedCourses, ClassesTaken, Abilities, Message
+
+# SCAN walks the whole table, or the whole index with USING INDEX, SEARCH only touches matching rows
+FULL_SCAN = re.compile(r'\bSCAN (?!CONSTANT ROW)')
+TEMP_ORDER_BY = re.compile(r'USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY')
+
+
+def hot_queries(user: User) -> dict:
+    now = datetime.now(tz=timezone.utc)
+    return {
+        'timetable for user': Timetable.objects.filter(user=user).values_list('id', 'action', 'time'),
+        'users with due timetables': UserData.objects.filter(next_due__lte=now).values_list('user_id', flat=True),
+        'next due timetable': (UserData.objects.filter(next_due__isnull=False)
+                               .order_by('next_due').values_list('next_due', flat=True)[:1]),
+        'timetable view': Timetable.objects.filter(user_id=user.pk),
+        'latest messages': Message.objects.filter(user_id=user.pk).order_by('-id')[:50],
+        'messages since': Message.objects.filter(user_id=user.pk, id__gt=1).order_by('id')[:51],
+        'messages before': Message.objects.filter(user_id=user.pk, id__lt=1000).order_by('-id')[:51],
+        'user data': UserData.objects.filter(user_id=user.pk),
+        'next due of user': UserData.objects.filter(user_id=user.pk).values_list('next_due', flat=True),
+        'classes taken': ClassesTaken.objects.filter(user=user).order_by('id'),
+        'classes with good attendance': ClassesTaken.objects.filter(user=user, times_present__gte=10),
+        'class attendance': ClassesTaken.objects.filter(user=user, course='Logic'),
+        'completed courses': CompletedCourses.objects.filter(user=user),
+        'completed course': CompletedCourses.objects.filter(user=user, course='Logic'),
+        'abilities': Abilities.objects.filter(user=user),
+        'ability': Abilities.objects.filter(user=user, ability='Logic'),
+    }
+
+
+# Queries that have to come back sorted, the sort should come from an index rather than a temporary B-tree
+ORDERED_QUERIES = ('timetable for user', 'timetable view', 'latest messages', 'messages since', 'messages before')
+
+
+class HotQueriesUseIndexes(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = datetime.now(tz=timezone.utc)
+        for index in range(20):
+            user = User.objects.create(username=f'user{index}')
+            Timetable.objects.bulk_create(
+                Timetable(user=user, action='Sleep', time=now + timedelta(seconds=30 * hour)) for hour in range(12)
+            )
+            Message.objects.bulk_create(Message(user=user, text='You have Slept.') for _ in range(20))
+            ClassesTaken.objects.bulk_create(ClassesTaken(user=user, course=course) for course in ('Logic', 'JFIZO'))
+            CompletedCourses.objects.create(user=user, course='Logic')
+            Abilities.objects.create(user=user, ability='Logic')
+        cls.user = user
+
+    def test_no_full_scans(self):
+        for name, queryset in hot_queries(self.user).items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertIsNone(FULL_SCAN.search(plan), f'{name} falls back to a full scan:\n{plan}')
+
+    def test_ordering_comes_from_indexes(self):
+        queries = hot_queries(self.user)
+        for name in ORDERED_QUERIES:
+            with self.subTest(name):
+                plan = queries[name].explain()
+                self.assertIsNone(TEMP_ORDER_BY.search(plan), f'{name} sorts in a temporary B-tree:\n{plan}')
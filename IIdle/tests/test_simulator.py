@@ -0,0 +1,35 @@
+from django.test import SimpleTestCase
+
+from IIdle.actions import Sleep, Logic
+from IIdle.consts import HOURS_IN_DAY
+from IIdle.engine import UserState
+from IIdle.models import UserData
+from IIdle.simulator import STRATEGIES, simulate_students, run
+
+
+class SimulatorTest(SimpleTestCase):
+    # SimpleTestCase fails on any query, the simulator mustn't need the database
+
+    def test_students_get_through_their_studies(self):
+        report = simulate_students('day_loop', range(3)).as_dict()
+        self.assertEqual(report['students'], 3)
+        self.assertEqual(list(report['semesters']), [1, 2, 3, 4, 5])
+        self.assertGreaterEqual(report['courses']['Logic']['attempts'], 3)
+        self.assertGreater(report['mean_stats']['math'], 0)
+
+    def test_same_seeds_same_report(self):
+        self.assertEqual(simulate_students('studious', range(2)).as_dict(),
+                         simulate_students('studious', range(2)).as_dict())
+
+    def test_pool_matches_a_single_process(self):
+        self.assertEqual(run('slacker', 4, processes=2, chunk_size=1).as_dict(),
+                         simulate_students('slacker', range(4)).as_dict())
+
+    def test_strategies_attend_classes(self):
+        state = UserState.detached(UserData())
+        for name, strategy in STRATEGIES.items():
+            with self.subTest(name):
+                day = strategy(state)
+                self.assertEqual(len(day), HOURS_IN_DAY)
+                self.assertIs(day[Logic.time[0]], Logic)
+                self.assertIs(day[0], Sleep)
@@ -0,0 +1,176 @@
+import asyncio
+import json
+from datetime import datetime, timezone, timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from IIdle.api import stream
+from IIdle.cache import get_user_data, invalidate_user_data
+from IIdle.models import UserData, Timetable, bump_state_version
+from IIdle.signals import state_changed
+from backend.asgi import application
+
+TIMEOUT = 5
+
+
+def parse_event(body: bytes) -> (str, dict):
+    name, data = body.decode().strip().split('\n')
+    return name[len('event: '):], json.loads(data[len('data: '):])
+
+
+class StreamClient:
+    """Talks to the ASGI application like a server would, on the running loop."""
+
+    def __init__(self, path: str, headers: list = (), query_string: bytes = b''):
+        self.messages = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string,
+                 'headers': [(b'host', b'testserver'), *headers]}
+        self.task = asyncio.get_running_loop().create_task(application(scope, self.receive, self.messages.put))
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def next(self) -> dict:
+        return await asyncio.wait_for(self.messages.get(), TIMEOUT)
+
+    async def next_event(self) -> (str, dict):
+        while True:
+            body = (await self.next())['body']
+            if not body.startswith(b':'):
+                return parse_event(body)
+
+    async def close(self):
+        self.disconnected.set()
+        await asyncio.wait_for(self.task, TIMEOUT)
+
+
+class StreamTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='abc')
+        self.token = Token.objects.create(user=self.user).key
+        self.path = f'/stream/{self.user.pk}/'
+
+    async def connect(self) -> (StreamClient, dict):
+        client = StreamClient(self.path, [(b'authorization', f'Token {self.token}'.encode())])
+        start = await client.next()
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        name, state = await client.next_event()
+        self.assertEqual(name, 'state')
+        return client, state
+
+    def test_pushes_entries_when_they_come_due(self):
+        due = datetime.now(tz=timezone.utc) + timedelta(seconds=0.3)
+        Timetable.objects.create(user=self.user, action='Sleep', time=due)
+        UserData.objects.filter(user=self.user).update(next_due=due)
+
+        async def run():
+            client, state = await self.connect()
+            self.assertEqual(state['userdata']['hour'], 0)
+            name, update = await client.next_event()
+            await client.close()
+            return name, update
+
+        name, update = asyncio.run(run())
+        self.assertEqual(name, 'update')
+        self.assertEqual(update['userdata']['hour'], 1)
+        self.assertNotIn('cash', update['userdata'])
+        self.assertEqual(len(update['messages']), 1)
+        self.assertFalse(stream.hub.streams)
+
+    def test_idle_clients_are_not_polled(self):
+        async def run():
+            with patch('IIdle.api.stream.poll', wraps=stream.poll) as poll:
+                clients = [(await self.connect())[0] for _ in range(3)]
+                await asyncio.sleep(0.3)
+                self.assertEqual(poll.call_count, 1)
+                self.assertEqual(stream.hub.due, [])
+                self.assertEqual(len(stream.hub.streams[self.user.pk].clients), 3)
+            for client in clients:
+                await client.close()
+
+        asyncio.run(run())
+
+    def test_changes_made_in_this_process_are_pushed_right_away(self):
+        def set_timetable():
+            bump_state_version(self.user.pk)
+            invalidate_user_data(self.user.pk)
+            state_changed.send(sender=None, user_id=self.user.pk)
+
+        async def run():
+            client, state = await self.connect()
+            await asyncio.get_running_loop().run_in_executor(None, set_timetable)
+            _, update = await client.next_event()
+            await client.close()
+            return state, update
+
+        state, update = asyncio.run(run())
+        # Only the version changed, which clients don't see
+        self.assertEqual(update['userdata'], {})
+        self.assertNotIn('version', state['userdata'])
+
+    @override_settings(IIDLE_STREAM_RESCAN_SECONDS=0.2)
+    def test_changes_of_other_processes_are_picked_up(self):
+        def write():
+            # Like a process that doesn't share the cache backend, the user data cached here is left as it is
+            UserData.objects.filter(user=self.user).update(version=10, cash=600)
+
+        async def run():
+            client, _ = await self.connect()
+            await asyncio.get_running_loop().run_in_executor(None, write)
+            _, update = await client.next_event()
+            await client.close()
+            return update
+
+        update = asyncio.run(run())
+        self.assertEqual(update['userdata'], {'cash': '600.00'})
+
+    def test_user_without_data(self):
+        UserData.objects.filter(user=self.user).delete()
+
+        async def run():
+            client = StreamClient(self.path, [(b'authorization', f'Token {self.token}'.encode())])
+            start = await client.next()
+            body = await client.next()
+            await client.close()
+            return start, body
+
+        start, body = asyncio.run(run())
+        self.assertEqual(start['status'], 404)
+        self.assertEqual(json.loads(body['body']), {'detail': 'Not found.'})
+        self.assertFalse(stream.hub.streams)
+
+    def test_polls_leave_the_shared_cache_alone(self):
+        get_user_data(self.user.pk)
+        UserData.objects.filter(user=self.user).update(version=10, cash=600)
+        changes = stream.poll(self.user.pk, None, None, initial=True)
+        self.assertEqual(changes['version'], 10)
+        self.assertEqual(changes['user_data']['cash'], '600.00')
+        # Other readers keep the snapshot until it expires
+        self.assertEqual(get_user_data(self.user.pk).version, 0)
+
+    def test_authentication(self):
+        other = User.objects.create(username='xyz')
+        token = f'token={self.token}'.encode()
+
+        async def status(path, headers=(), query_string=b''):
+            client = StreamClient(path, headers, query_string)
+            start = await client.next()
+            await client.close()
+            return start['status']
+
+        for path, headers, query_string, expected in (
+            (self.path, [], b'', 401),
+            (self.path, [(b'authorization', b'Token wrong')], b'', 401),
+            (f'/stream/{other.pk}/', [], token, 403),
+            (self.path, [], token, 200),
+        ):
+            with self.subTest(path=path, headers=headers, query_string=query_string):
+                self.assertEqual(asyncio.run(status(path, headers, query_string)), expected)
@@ -1,11 +1,24 @@
 from datetime import datetime, timezone, timedelta
+from io import StringIO
+from threading import Barrier, Thread
+from time import sleep
+from unittest.mock import patch
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
 
-from IIdle.consts import HOURS_IN_DAY
-from IIdle.models import UserData, Timetable, Abilities, ACTIONS_CHOICES
-from IIdle.timetable_processor import process_timetable, validate_and_process_timetable_change, list_valid_actions
+from IIdle.actions import ACTION_TO_CLASS
+from IIdle.consts import HOURS_IN_DAY, ORM_ENGINE
+from IIdle.messages import ACTION_DONE, TOO_TIRED, DAY_DIGEST
+from IIdle.models import UserData, Timetable, Abilities, ClassesTaken, ACTIONS_CHOICES, Message
+from IIdle.rng import seeded_random, uniform, random
+from IIdle.api.views import process_timetable_wrapper
+from IIdle.cache import processing_lock, processed_at_key
+from IIdle.timetable_processor import (process_timetable, validate_and_process_timetable_change, list_valid_actions,
+                                       process_due_timetables, seconds_until_next_due, validate_timetable)
 
 
 class ProcessAllActions(TestCase):
@@ -20,6 +33,313 @@ class ProcessAllActions(TestCase):
         process_timetable(self.user)
 
 
+class CatchUpIsBatched(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='abc')
+        start = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+        for x in range(12):
+            Timetable.objects.create(user=self.user, time=start + timedelta(seconds=x), action='Sleep')
+        Timetable.objects.create(user=self.user, time=datetime.now(tz=timezone.utc) + timedelta(hours=1), action='Work')
+
+    def test_catch_up_queries(self):
+        # SAVEPOINT, SELECT user data, SELECT entries, DELETE, SAVEPOINT, UPDATE, INSERT messages, INSERT action log,
+        # RELEASE, RELEASE
+        with self.assertNumQueries(10):
+            process_timetable(self.user)
+        self.assertEqual(UserData.objects.get(user=self.user).hour, 12)
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 12)
+        self.assertEqual(list(Timetable.objects.filter(user=self.user).values_list('action', flat=True)), ['Work'])
+        self.assertEqual(UserData.objects.get(user=self.user).next_due, Timetable.objects.get(user=self.user).time)
+
+    def test_entries_claimed_by_someone_else_are_not_applied(self):
+        first_entry = Timetable.objects.filter(user=self.user).order_by('time').first()
+        entries_read = []
+
+        # Another request applies or replaces one of the entries right after the catch-up has read them. It can't be
+        # a second connection, the test database locks the table for as long as the catch-up's transaction is open.
+        def remove_entry_once_read(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not entries_read and sql.startswith('SELECT') and Timetable._meta.db_table in sql:
+                entries_read.append(sql)
+                first_entry.delete()
+            return result
+
+        with connection.execute_wrapper(remove_entry_once_read):
+            process_timetable(self.user)
+        self.assertTrue(entries_read)
+        self.assertEqual(UserData.objects.get(user=self.user).hour, 0)
+        self.assertFalse(Message.objects.filter(user=self.user).exists())
+
+    @override_settings(IIDLE_ENGINE=ORM_ENGINE)
+    def test_catch_up_in_db(self):
+        process_timetable(self.user)
+        self.assertEqual(UserData.objects.get(user=self.user).hour, 12)
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 12)
+        self.assertEqual(Timetable.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(UserData.objects.get(user=self.user).next_due, Timetable.objects.get(user=self.user).time)
+
+
+# Threads have connections of their own, which only see committed data
+class ConcurrentProcessing(TransactionTestCase):
+    threads = 8
+    users = 4
+    entries = 12
+    attempts = 1000
+
+    def setUp(self):
+        cache.clear()
+        due = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+        self.user_ids = []
+        for x in range(self.users):
+            user = User.objects.create(username=f'user-{x}')
+            Timetable.objects.bulk_create(Timetable(user=user, action='Sleep', time=due + timedelta(seconds=entry))
+                                          for entry in range(self.entries))
+            UserData.objects.filter(user=user).update(next_due=due)
+            self.user_ids.append(user.pk)
+
+    def process(self, index: int, barrier: Barrier, errors: list):
+        # Every thread catches up on every user, starting with a different one
+        user_ids = self.user_ids[index % self.users:] + self.user_ids[:index % self.users]
+        barrier.wait()
+        try:
+            for user_id in user_ids:
+                for _ in range(self.attempts):
+                    try:
+                        process_timetable(User.objects.get(pk=user_id))
+                        break
+                    except OperationalError:
+                        # The test database locks tables instead of waiting, the catch-up was rolled back
+                        sleep(0.005)
+                else:
+                    raise AssertionError(f'The catch-up of user {user_id} was locked out {self.attempts} times')
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_every_entry_applied_once(self):
+        barrier, errors = Barrier(self.threads), []
+        threads = [Thread(target=self.process, args=(index, barrier, errors)) for index in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        for user_id in self.user_ids:
+            user_data = UserData.objects.get(user_id=user_id)
+            self.assertEqual(user_data.hour, self.entries)
+            self.assertEqual(Message.objects.filter(user_id=user_id).count(), self.entries)
+            self.assertFalse(Timetable.objects.filter(user_id=user_id).exists())
+            self.assertIsNone(user_data.next_due)
+
+
+@override_settings(IIDLE_ENGINE=ORM_ENGINE)
+class ConcurrentProcessingInDb(ConcurrentProcessing):
+    pass
+
+
+class FastForward(TestCase):
+    schedule = ['Sleep'] * 6 + ['Work', 'Work', 'Logic', 'Calculus I', 'Learn Math', 'Relax', 'Party'] + ['Sleep'] * 11
+
+    def setUp(self):
+        self.user = User.objects.create(username='abc')
+        UserData.objects.filter(user=self.user).update(hour=20)
+        due = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+        Timetable.objects.bulk_create(
+            Timetable(user=self.user, action=self.schedule[x % len(self.schedule)], time=due + timedelta(seconds=x))
+            for x in range(60)
+        )
+
+    def outcome(self) -> tuple:
+        user_data = UserData.objects.filter(user=self.user).values().get()
+        del user_data['version']
+        return (user_data, list(ClassesTaken.objects.filter(user=self.user).values_list('course', 'times_present')),
+                list(Abilities.objects.filter(user=self.user).values_list('ability', flat=True)))
+
+    def test_same_outcome_as_hour_by_hour(self):
+        with transaction.atomic(), override_settings(IIDLE_FAST_FORWARD_HOURS=1000):
+            process_timetable(self.user)
+            hour_by_hour = self.outcome()
+            messages_hour_by_hour = Message.objects.filter(user=self.user).count()
+            transaction.set_rollback(True)
+        process_timetable(self.user)
+        self.assertEqual(self.outcome(), hour_by_hour)
+        self.assertLess(Message.objects.filter(user=self.user).count(), messages_hour_by_hour)
+
+    def test_digest_per_day(self):
+        process_timetable(self.user)
+        digests = [message.payload for message in Message.objects.filter(user=self.user, event=DAY_DIGEST)]
+        # From 20:00 of the first day to 7:00 of the fourth
+        self.assertEqual([(day, hours) for day, hours, *_ in digests], [(0, 4), (1, 24), (2, 24), (3, 8)])
+        self.assertFalse(Message.objects.filter(user=self.user, event__in=[ACTION_DONE, TOO_TIRED]).exists())
+
+    @override_settings(IIDLE_ENGINE=ORM_ENGINE)
+    def test_fast_forward_in_orm_engine(self):
+        process_timetable(self.user)
+        self.assertEqual(UserData.objects.get(user=self.user).hour, 8)
+        self.assertEqual(Message.objects.filter(user=self.user, event=DAY_DIGEST).count(), 4)
+
+    def test_short_backlog_is_not_digested(self):
+        Timetable.objects.filter(pk__in=Timetable.objects.values_list('pk', flat=True)[:40]).delete()
+        process_timetable(self.user)
+        self.assertFalse(Message.objects.filter(user=self.user, event=DAY_DIGEST).exists())
+
+    def test_rolls_are_seeded_per_user_and_version(self):
+        def rolls(user_id, version):
+            with seeded_random(user_id, version):
+                return [uniform(0, 1) for _ in range(3)] + [random()]
+
+        self.assertEqual(rolls(1, 2), rolls(1, 2))
+        self.assertNotEqual(rolls(1, 2), rolls(1, 3))
+        self.assertNotEqual(rolls(1, 2), rolls(2, 2))
+
+
+class NextDueFastPath(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='abc')
+        validate_and_process_timetable_change(self.user, [
+            {'hour': 0, 'action': 'Sleep'},
+            {'hour': 1, 'action': 'Work'},
+        ])
+
+    def test_next_due_is_first_entry(self):
+        self.assertEqual(UserData.objects.get(user=self.user).next_due, Timetable.objects.first().time)
+
+    def test_nothing_due_costs_one_query(self):
+        with self.assertNumQueries(1):
+            process_timetable_wrapper(self.user.pk)
+        self.assertEqual(Timetable.objects.filter(user=self.user).count(), 2)
+
+    def test_due_entries_are_processed(self):
+        Timetable.objects.filter(action='Sleep').update(time=datetime.now(tz=timezone.utc) - timedelta(seconds=1))
+        UserData.objects.filter(user=self.user).update(next_due=datetime.now(tz=timezone.utc) - timedelta(seconds=1))
+        process_timetable_wrapper(self.user.pk)
+        user_data = UserData.objects.get(user=self.user)
+        self.assertEqual(user_data.hour, 1)
+        self.assertEqual(user_data.next_due, Timetable.objects.get(user=self.user, action='Work').time)
+
+    def test_stale_next_due_is_fixed_without_a_new_version(self):
+        user_data = UserData.objects.get(user=self.user)
+        UserData.objects.filter(user=self.user).update(next_due=datetime.now(tz=timezone.utc) - timedelta(seconds=1))
+        process_timetable(self.user)
+        fixed = UserData.objects.get(user=self.user)
+        self.assertEqual((fixed.next_due, fixed.version), (user_data.next_due, user_data.version))
+        self.assertEqual(Timetable.objects.filter(user=self.user).count(), 2)
+
+    def test_nothing_to_fix_writes_nothing(self):
+        with self.assertNumQueries(4):
+            # SAVEPOINT, SELECT user data, SELECT entries, RELEASE
+            process_timetable(self.user)
+
+    def test_empty_timetable_clears_next_due(self):
+        validate_and_process_timetable_change(self.user, [])
+        self.assertIsNone(UserData.objects.get(user=self.user).next_due)
+
+
+class BackgroundProcessing(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username='abc'), User.objects.create(username='xyz')]
+        now = datetime.now(tz=timezone.utc)
+        for user in self.users:
+            Timetable.objects.create(user=user, time=now - timedelta(minutes=1), action='Sleep')
+            Timetable.objects.create(user=user, time=now + timedelta(hours=1), action='Work')
+        UserData.objects.update(next_due=now - timedelta(minutes=1))
+
+    def test_process_in_batches(self):
+        self.assertEqual(process_due_timetables(batch_size=1), 1)
+        self.assertEqual(process_due_timetables(batch_size=1), 1)
+        self.assertEqual(process_due_timetables(batch_size=1), 0)
+        self.assertEqual(Timetable.objects.filter(action='Sleep').count(), 0)
+        self.assertEqual(Timetable.objects.filter(action='Work').count(), 2)
+
+    def test_command(self):
+        call_command('process_timetables', '--once', '--batch-size=1', stdout=StringIO())
+        self.assertFalse(Timetable.objects.filter(action='Sleep').exists())
+        self.assertTrue(all(user_data.hour == 1 for user_data in UserData.objects.all()))
+
+    def test_sleeps_until_next_due(self):
+        process_due_timetables(batch_size=2)
+        self.assertTrue(3590 < seconds_until_next_due(max_seconds=4000) <= 3600)
+        self.assertEqual(seconds_until_next_due(max_seconds=5), 5)
+
+    def test_oldest_due_first(self):
+        UserData.objects.filter(user=self.users[1]).update(next_due=datetime.now(tz=timezone.utc) - timedelta(hours=1))
+        process_due_timetables(batch_size=1)
+        self.assertEqual(list(Timetable.objects.filter(action='Sleep').values_list('user', flat=True)),
+                         [self.users[0].pk])
+
+    def test_failed_user_is_retried_later(self):
+        broken = self.users[0]
+        real_process_timetable = process_timetable
+
+        def process_or_fail(user):
+            if user.pk == broken.pk:
+                raise ValueError('Broken timetable')
+            real_process_timetable(user)
+
+        with patch('IIdle.timetable_processor.process_timetable', side_effect=process_or_fail), \
+                self.assertLogs('IIdle.timetable_processor', 'ERROR'):
+            self.assertEqual(process_due_timetables(batch_size=1), 0)
+            self.assertEqual(process_due_timetables(batch_size=1), 1)
+            self.assertEqual(process_due_timetables(batch_size=1), 0)
+            call_command('process_timetables', '--once', '--batch-size=1', stdout=StringIO())
+        self.assertEqual(list(Timetable.objects.filter(action='Sleep').values_list('user', flat=True)), [broken.pk])
+        self.assertGreater(UserData.objects.get(user=broken).next_due, datetime.now(tz=timezone.utc))
+        self.assertTrue(0 < seconds_until_next_due(max_seconds=4000) <= 60)
+
+    @override_settings(IIDLE_INLINE_PROCESSING=False)
+    def test_views_skip_processing(self):
+        with self.assertNumQueries(0):
+            process_timetable_wrapper(self.users[0].pk)
+        self.assertEqual(Timetable.objects.filter(action='Sleep').count(), 2)
+
+
+@override_settings(IIDLE_PROCESSING_WAIT_SECONDS=0)
+class ProcessingGuard(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='abc')
+        self.add_due_entry()
+
+    def add_due_entry(self):
+        due = datetime.now(tz=timezone.utc) - timedelta(seconds=1)
+        Timetable.objects.create(user=self.user, time=due, action='Sleep')
+        UserData.objects.filter(user=self.user).update(next_due=due)
+
+    def test_lock_is_exclusive(self):
+        with processing_lock(self.user.pk) as acquired:
+            self.assertTrue(acquired)
+            with processing_lock(self.user.pk) as acquired_again:
+                self.assertFalse(acquired_again)
+        with processing_lock(self.user.pk) as acquired:
+            self.assertTrue(acquired)
+
+    def test_concurrent_request_skips_processing(self):
+        with processing_lock(self.user.pk):
+            process_timetable_wrapper(self.user.pk)
+        self.assertEqual(Timetable.objects.filter(user=self.user).count(), 1)
+        process_timetable_wrapper(self.user.pk)
+        self.assertEqual(Timetable.objects.filter(user=self.user).count(), 0)
+
+    def test_recently_processed_user_is_skipped(self):
+        process_timetable_wrapper(self.user.pk)
+        self.add_due_entry()
+        with self.assertNumQueries(0):
+            process_timetable_wrapper(self.user.pk)
+        self.assertEqual(Timetable.objects.filter(user=self.user).count(), 1)
+        cache.delete(processed_at_key(self.user.pk))
+        process_timetable_wrapper(self.user.pk)
+        self.assertEqual(Timetable.objects.filter(user=self.user).count(), 0)
+        self.assertEqual(UserData.objects.get(user=self.user).hour, 2)
+
+    @override_settings(IIDLE_PROCESSING_GUARD=False)
+    def test_guard_can_be_disabled(self):
+        with processing_lock(self.user.pk):
+            process_timetable_wrapper(self.user.pk)
+        self.assertEqual(Timetable.objects.filter(user=self.user).count(), 0)
+
+
 class UserDataAndSemesterEndAdded(TestCase):
     def setUp(self):
         self.user = User.objects.create(username='abc')
@@ -120,3 +440,20 @@ class TestValidActions(TestCase):
         res = list_valid_actions(self.user)
         self.assertEqual(len(res), 12)
         self.assertTrue(all(len(x['actions']) >= 6 for x in res))
+
+    def test_depends_on_hour_and_semester(self):
+        UserData.objects.filter(user=self.user).update(hour=20, day=14)
+        self.user.refresh_from_db()
+        res = list_valid_actions(self.user)
+        self.assertEqual([x['hour'] for x in res], [20, 21, 22, 23, 0, 1, 2, 3, 4, 5, 6, 7])
+        for hour_actions in res:
+            for action in hour_actions['actions']:
+                action_class = ACTION_TO_CLASS[action['name']]
+                self.assertTrue(action_class.time is None or hour_actions['hour'] in action_class.time)
+                self.assertTrue(action['semester'] is None or action['semester'] % 2 == 0)
+
+    def test_listed_actions_pass_validation(self):
+        for hour_actions in list_valid_actions(self.user):
+            for action in hour_actions['actions']:
+                data = [{'hour': hour_actions['hour'], 'action': action['name']}]
+                self.assertEqual(validate_timetable(self.user, data), (None, [(action['name'], hour_actions['hour'])]))
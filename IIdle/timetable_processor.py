@@ -1,63 +1,185 @@
+import logging
 from datetime import datetime, timezone, timedelta
 from random import randrange
+from typing import Optional
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
 
-from IIdle.actions import ACTION_TO_CLASS, Class, EndDay, FinishSemester
+from IIdle.actions import ACTION_TO_CLASS, Class, EndDay, FinishSemester, uses_memory_engine
 from IIdle.consts import HOURS_IN_DAY
-from IIdle.models import Timetable
+from IIdle.cache import invalidate_user_data
+from IIdle.engine import UserState
+from IIdle.messages import day_digest
+from IIdle.models import Timetable, UserData, ActionEvent, ACTION_CODES, stat_values
+from IIdle.rng import seeded_random
 
 ACTIONS_OFFSET = timedelta(seconds=30)
 
+logger = logging.getLogger(__name__)
+
 
 def process_timetable(user: User) -> None:
-    timetable_to_process = Timetable.objects.filter(user=user, time__lte=datetime.now(tz=timezone.utc))
-    for entry in timetable_to_process:
-        processor = ACTION_TO_CLASS[entry.action]
-        processor.process(user)
-        user.refresh_from_db()
-        entry.delete()
+    now = datetime.now(tz=timezone.utc)
+    with transaction.atomic():
+        # Concurrent catch-ups of the same user wait here for each other (SQLite locks the whole database anyway), the
+        # one that comes second doesn't find the entries anymore
+        user_data = UserData.objects.select_for_update().get(user=user)
+        user.data = user_data
+        timetable = list(Timetable.objects.filter(user=user).values_list('id', 'action', 'time'))
+        timetable_to_process = [(entry_id, action) for entry_id, action, time in timetable if time <= now]
+        next_due = next((time for _, _, time in timetable if time > now), None)
+        if not timetable_to_process:
+            # Nothing was applied (e.g. someone else caught up first), the state and its version stay as they are
+            if next_due != user_data.next_due:
+                UserData.objects.filter(user=user).update(next_due=next_due)
+                invalidate_user_data(user.pk)
+            return
+        # Claiming the entries before applying them, if some are gone already (e.g. the timetable was replaced in
+        # the meantime) nothing is applied
+        claimed, _ = Timetable.objects.filter(id__in=[entry_id for entry_id, _ in timetable_to_process]).delete()
+        if claimed != len(timetable_to_process):
+            transaction.set_rollback(True)
+            return
+        actions = [ACTION_TO_CLASS[action] for _, action in timetable_to_process]
+        fast_forward = len(actions) >= settings.IIDLE_FAST_FORWARD_HOURS
+        with seeded_random(user.pk, user_data.version):
+            if fast_forward or uses_memory_engine():
+                state = UserState(user, user_data)
+                (fast_forward_actions if fast_forward else simulate_actions)(state, actions)
+                state.next_due = next_due
+                state.save()
+            else:
+                events = []
+                for action in actions:
+                    before = stat_values(user.data)
+                    action.process(user)
+                    events.append(ActionEvent.from_change(user.pk, ACTION_CODES[action.name], before, user.data))
+                ActionEvent.objects.bulk_create(events)
+                UserData.objects.filter(user=user).update(next_due=next_due, version=F('version') + 1)
+                invalidate_user_data(user.pk)
 
 
-def validate_and_process_timetable_change(user: User, data: list) -> (bool, str):
-    current_hour = user.data.hour
-    valid_hours = [hour % HOURS_IN_DAY for hour in range(current_hour, current_hour + 12)]
+def simulate_actions(state: UserState, actions: list):
+    for action in actions:
+        state.simulate_logged(action)
+
+
+def fast_forward_actions(state: UserState, actions: list):
+    """Plays out a long backlog like simulate_actions, with a digest of every day instead of a message per hour."""
+    messages = []
+    day, day_start = state.day, state.stats()
+    for index, action in enumerate(actions):
+        state.simulate_logged(action)
+        if state.day != day or index == len(actions) - 1:
+            stats = state.stats()
+            messages += day_digest(day, state.messages, stats, day_start)
+            state.messages = []
+            day, day_start = state.day, stats
+    state.messages = messages
+
+
+def process_due_timetables(batch_size: int) -> int:
+    """Catches up on the users that have been due the longest, returns how many of them succeeded."""
+    now = datetime.now(tz=timezone.utc)
+    user_ids = list(UserData.objects.filter(next_due__lte=now).order_by('next_due')
+                    .values_list('user_id', flat=True)[:batch_size])
+    processed = 0
+    for user in User.objects.filter(pk__in=user_ids).select_related('data'):
+        try:
+            process_timetable(user)
+            processed += 1
+        except Exception:
+            logger.exception('Processing the timetable of user %s failed', user.pk)
+            # Retried later, so a broken user doesn't keep the worker busy or hold up the users due after them
+            retry_at = datetime.now(tz=timezone.utc) + timedelta(seconds=settings.IIDLE_PROCESSING_RETRY_SECONDS)
+            UserData.objects.filter(user=user).update(next_due=retry_at)
+            invalidate_user_data(user.pk)
+    return processed
+
+
+def seconds_until_next_due(max_seconds: float) -> float:
+    next_due = (UserData.objects.filter(next_due__isnull=False)
+                .order_by('next_due').values_list('next_due', flat=True).first())
+    if next_due is None:
+        return max_seconds
+    return min(max((next_due - datetime.now(tz=timezone.utc)).total_seconds(), 0), max_seconds)
+
+
+def plannable_hours(current_hour: int) -> list:
+    return [hour % HOURS_IN_DAY for hour in range(current_hour, current_hour + 12)]
+
+
+def is_available(action, hour: int, semester_parity: int) -> bool:
+    return ((action.time is None or hour in action.time)
+            and (not issubclass(action, Class) or action.semester % 2 == semester_parity))
+
+
+# What can be planned only depends on the hour and on whether it's a winter or a summer semester
+VALID_ACTIONS = {
+    (hour, parity): [action for action in ACTION_TO_CLASS.values() if is_available(action, hour, parity)]
+    for hour in range(HOURS_IN_DAY) for parity in (0, 1)
+}
+VALID_ACTION_NAMES = {key: frozenset(action.name for action in actions) for key, actions in VALID_ACTIONS.items()}
+# Shared between requests, must not be modified
+VALID_ACTIONS_RESPONSES = {
+    (current_hour, parity): [
+        {'hour': hour,
+         'actions': [{'name': action.name, 'semester': getattr(action, 'semester', None)}
+                     for action in VALID_ACTIONS[hour, parity]]}
+        for hour in plannable_hours(current_hour)
+    ]
+    for current_hour in range(HOURS_IN_DAY) for parity in (0, 1)
+}
+
+
+def invalid_action_message(action_name: str, action_hour: int) -> str:
+    action_class = ACTION_TO_CLASS[action_name]
+    if action_class is EndDay or action_class is FinishSemester:
+        return f'Invalid timetable. Chosen action: {action_name} cannot be performed at will'
+    if action_class.time is not None and action_hour not in action_class.time:
+        return f'Invalid timetable. Chosen action: {action_name} cannot be performed at {action_hour}'
+    return "Invalid timetable. You can't take summer classes in the winter and vice versa"
+
+
+def validate_timetable(user: User, data: list) -> (Optional[str], list):
+    hour_order = {hour: position for position, hour in enumerate(plannable_hours(user.data.hour))}
+    semester_parity = user.data.semester() % 2
     actions_and_times = []
     for action in data:
         action_hour = int(action['hour'])
         action_name = action['action']
-        if action_hour not in valid_hours:
-            return False, f'Invalid timetable. Chosen time: {action_hour} is too far into the future'
-        action_class = ACTION_TO_CLASS[action_name]
-        if action_class is EndDay or action_class is FinishSemester:
-            return False, f'Invalid timetable. Chosen action: {action_name} cannot be performed at will'
-        if action_class.time is not None and action_hour not in action_class.time:
-            return False, f'Invalid timetable. Chosen action: {action_name} cannot be performed at {action_hour}'
-        if issubclass(action_class, Class) and action_class.semester % 2 != user.data.semester() % 2:
-            return False, "Invalid timetable. You can't take summer classes in the winter and vice versa"
-        actions_and_times.append({'action': action_name, 'time': action_hour})
-    times = [action_with_time['time'] for action_with_time in actions_and_times]
-    if len(set(times)) != len(times):
-        return False, 'Invalid timetable. Each hour can only appear once'
-    actions_and_times.sort(key=lambda x: valid_hours.index(x['time']))
-    Timetable.objects.filter(user=user).delete()
+        if action_hour not in hour_order:
+            return f'Invalid timetable. Chosen time: {action_hour} is too far into the future', []
+        if action_name not in VALID_ACTION_NAMES[action_hour, semester_parity]:
+            return invalid_action_message(action_name, action_hour), []
+        actions_and_times.append((action_name, action_hour))
+    if len({action_hour for _, action_hour in actions_and_times}) != len(actions_and_times):
+        return 'Invalid timetable. Each hour can only appear once', []
+    actions_and_times.sort(key=lambda action_and_time: hour_order[action_and_time[1]])
+    return None, actions_and_times
+
+
+def validate_and_process_timetable_change(user: User, data: list) -> (bool, str):
+    error, actions_and_times = validate_timetable(user, data)
+    if error is not None:
+        return False, error
     next_action_time = datetime.now(tz=timezone.utc)
-    for action in actions_and_times:
+    entries = []
+    for action_name, _ in actions_and_times:
         next_action_time += ACTIONS_OFFSET + timedelta(seconds=randrange(-5, 4))
-        Timetable.objects.create(user=user, action=action['action'], time=next_action_time)
+        entries.append(Timetable(user=user, action=action_name, time=next_action_time))
+    next_due = entries[0].time if entries else None
+    with transaction.atomic():
+        Timetable.objects.filter(user=user).delete()
+        Timetable.objects.bulk_create(entries)
+        UserData.objects.filter(user=user).update(next_due=next_due, version=F('version') + 1)
+        invalidate_user_data(user.pk)
+    user.data.next_due = next_due
     return True, 'Timetable successfully saved'
 
 
 def list_valid_actions(user: User) -> list:
-    current_hour = user.data.hour
-    valid_hours = [hour % HOURS_IN_DAY for hour in range(current_hour, current_hour + 12)]
-    return [
-        {'hour': hour,
-         'actions': [
-             {'name': action.name, 'semester': getattr(action, 'semester', None)}
-             for action in ACTION_TO_CLASS.values()
-             if ((action.time is None or hour in action.time)
-                 and (not issubclass(action, Class) or action.semester % 2 == user.data.semester() % 2))
-         ]}
-        for hour in valid_hours
-    ]
+    return VALID_ACTIONS_RESPONSES[user.data.hour, user.data.semester() % 2]
@@ -9,8 +9,30 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+
+class AsyncReadsHandler(ASGIHandler):
+    async def __call__(self, scope, receive, send):
+        # Streams stay open, Django's handler would only send the response once it's complete
+        if scope['type'] == 'http' and STREAM_PATH.match(scope['path']):
+            await stream_state(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            # Read endpoints are served by async views here
+            request.urlconf = 'backend.asgi_urls'
+        return request, error_response
+
+
+django.setup(set_prefix=False)
+
+from IIdle.api.stream import STREAM_PATH, stream_state  # noqa: E402 needs the apps set up
+
+application = AsyncReadsHandler()
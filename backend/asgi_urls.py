@@ -0,0 +1,18 @@
+"""URL configuration of the ASGI entry point
+
+Same as backend.urls, except that read endpoints are served by async views.
+"""
+from django.urls import path
+
+from backend import urls
+from IIdle.api.views import (UserDataDetails, TimetableForUser, CompletedCoursesForUser, ClassesTakenForUser,
+                             AbilitiesForUser, GetValidActions, MessagesForUser, GameState, Forecast, async_view)
+
+READ_VIEWS = {UserDataDetails, TimetableForUser, CompletedCoursesForUser, ClassesTakenForUser, AbilitiesForUser,
+              GetValidActions, MessagesForUser, GameState, Forecast}
+
+urlpatterns = [
+    path(str(pattern.pattern), async_view(pattern.callback.view_class))
+    if getattr(pattern.callback, 'view_class', None) in READ_VIEWS else pattern
+    for pattern in urls.urlpatterns
+]
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
 
@@ -85,10 +88,30 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('IIDLE_DB_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# Pragmas run on every new SQLite connection (see IIdle/signals.py)
+IIDLE_SQLITE_PRAGMAS = {}
+
+# IIDLE_DB_PROFILE=production lets concurrent requests read while one of them writes (WAL), makes writers wait for
+# each other instead of failing with "database is locked" (busy timeout and transactions starting with
+# BEGIN IMMEDIATE, see backend/sqlite3) and keeps connections open between requests
+IIDLE_DB_PROFILE = os.environ.get('IIDLE_DB_PROFILE', 'default')
+if IIDLE_DB_PROFILE == 'production':
+    DATABASES['default']['ENGINE'] = 'backend.sqlite3'
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('IIDLE_DB_CONN_MAX_AGE', 600))
+    IIDLE_SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        # With WAL a power loss can only undo the latest commits, it can't corrupt the database
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get('IIDLE_SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'mmap_size': int(os.environ.get('IIDLE_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        # Negative sizes are in KiB
+        'cache_size': -int(os.environ.get('IIDLE_SQLITE_CACHE_KIB', 64 * 1024)),
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -130,13 +153,66 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'IIdle.api.authentication.CachedTokenAuthentication',
     ),
 }
 
 CORS_ORIGIN_ALLOW_ALL = True
+# Polling clients send back the ETag of their last response to get a 304 when nothing has changed
+CORS_ALLOW_HEADERS = [*default_headers, 'if-none-match']
+CORS_EXPOSE_HEADERS = ['ETag']
 
 ACCOUNT_EMAIL_VERIFICATION = 'none'
 ACCOUNT_AUTHENTICATION_METHOD = 'username'
 
 SITE_ID = 1
+
+# 'memory' loads the user's state once per processed hour and writes it back in a single transaction,
+# 'orm' applies every rule directly in the database
+IIDLE_ENGINE = 'memory'
+
+# Set to False when `python manage.py process_timetables` is running, views then skip catching up on timetables
+IIDLE_INLINE_PROCESSING = True
+
+# Only one request at a time catches up on a user's timetable, concurrent ones wait for it up to
+# IIDLE_PROCESSING_WAIT_SECONDS and then skip it. Requests within IIDLE_PROCESSING_MEMO_SECONDS of a finished
+# catch-up skip it as well. Use a cache shared between processes (e.g. memcached) with more than one worker process.
+IIDLE_PROCESSING_GUARD = True
+IIDLE_PROCESSING_LOCK_SECONDS = 30
+IIDLE_PROCESSING_WAIT_SECONDS = 0.5
+IIDLE_PROCESSING_MEMO_SECONDS = 1
+
+# `process_timetables` tries a user whose catch-up failed again after this long
+IIDLE_PROCESSING_RETRY_SECONDS = 60
+
+# Backlogs of at least this many hours are played out in memory whatever the engine, with a digest message per day
+# instead of a message per hour
+IIDLE_FAST_FORWARD_HOURS = 24
+
+# Messages are fetched in pages, clients can ask for up to IIDLE_MESSAGES_MAX_PAGE_SIZE at once
+IIDLE_MESSAGES_PAGE_SIZE = 50
+IIDLE_MESSAGES_MAX_PAGE_SIZE = 200
+
+# User data is cached for the read endpoints and dropped from the cache whenever the game writes it. Processes that
+# write it (e.g. `process_timetables`, other server processes) have to share the cache backend with the server, or
+# reads can be stale for up to IIDLE_USER_DATA_CACHE_SECONDS. With IIDLE_INLINE_PROCESSING off a process-local cache
+# is an error.
+IIDLE_USER_DATA_CACHE_SECONDS = 10
+
+# Which user a token belongs to is cached for this long, deleting a token (e.g. logging out) drops it right away. The
+# user, and whether they are active, comes from the user data cache.
+IIDLE_TOKEN_CACHE_SECONDS = 300
+
+# Threads of the ASGI entry point that serve read endpoints, i.e. how many of them hit the database at once
+IIDLE_ASYNC_READ_THREADS = 8
+
+# Clients of /stream/<pk>/ get a comment when nothing happened for this long, so proxies keep the connection open.
+# Changes made by other processes reach them within IIDLE_STREAM_RESCAN_SECONDS.
+IIDLE_STREAM_KEEPALIVE_SECONDS = 15
+IIDLE_STREAM_RESCAN_SECONDS = 30
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
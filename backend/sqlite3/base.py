@@ -0,0 +1,13 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """SQLite, with transactions that take the write lock right away.
+
+    A transaction that reads first can't get the write lock later if another connection has written in between, it
+    fails with "database is locked" without waiting for the busy timeout. Taken up front, concurrent writers queue up
+    for it instead.
+    """
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -18,7 +18,7 @@ from django.urls import path, include
 
 from IIdle.api.views import (UserDataDetails, TimetableForUser, CompletedCoursesForUser, ClassesTakenForUser,
                              AbilitiesForUser, SetTimetable, GetValidActions, CustomAuthToken, MessagesForUser,
-                             ClearMessages)
+                             ClearMessages, GameState, Forecast)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -29,8 +29,10 @@ urlpatterns = [
     path('abilities/<int:pk>/', AbilitiesForUser.as_view()),
     path('messages/<int:pk>/', MessagesForUser.as_view()),
     path('clearmessages/<int:pk>/', ClearMessages.as_view()),
+    path('state/<int:pk>/', GameState.as_view()),
     path('set_timetable/<int:pk>/', SetTimetable.as_view()),
     path('get_valid_actions/<int:pk>/', GetValidActions.as_view()),
+    path('forecast/<int:pk>/', Forecast.as_view()),
     path('get_token/', CustomAuthToken.as_view()),
     path('authentication/', include('dj_rest_auth.urls')),
     path('authentication/registration/', include('dj_rest_auth.registration.urls')),
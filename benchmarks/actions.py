@@ -0,0 +1,137 @@
+import json
+import sys
+from argparse import ArgumentParser
+from statistics import median
+from time import perf_counter
+
+from benchmarks.utils import setup_django, test_database, print_table, git_revision
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+STATS = {'cash': 1000, 'energy': 80, 'mood': 80, 'math': 50, 'programming': 50, 'algorithms': 50,
+         'work_experience': 50}
+
+
+class WriteCounter:
+    """Counts queries and the rows written by them."""
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        if sql.lstrip().upper().startswith(WRITES) and context['cursor'].rowcount > 0:
+            self.rows += context['cursor'].rowcount
+        return result
+
+
+def scenarios() -> list:
+    """(name, action, day, hour) of every action in the middle of a day, and of the day and semester boundaries."""
+    from IIdle.actions import ACTION_TO_CLASS, Sleep
+
+    return [
+        *((name, class_, 1, 12) for name, class_ in ACTION_TO_CLASS.items()),
+        ('Sleep at the end of a day', Sleep, 1, 23),
+        ('Sleep at the end of a semester', Sleep, 13, 23),
+    ]
+
+
+def reset(user_pk: int, day: int, hour: int):
+    from IIdle.actions import Logic, CalculusI, IntroToCS, Algebra
+    from IIdle.cache import invalidate_user_data
+    from IIdle.models import UserData, ClassesTaken, CompletedCourses, Abilities, Message
+
+    UserData.objects.filter(user_id=user_pk).update(day=day, hour=hour, failed_a_semester=False, **STATS)
+    for model in (ClassesTaken, CompletedCourses, Abilities, Message):
+        model.objects.filter(user_id=user_pk).delete()
+    # Attended often enough to take the exams when the semester ends
+    ClassesTaken.objects.bulk_create(ClassesTaken(user_id=user_pk, course=class_.name, times_present=10)
+                                     for class_ in (Logic, CalculusI, IntroToCS, Algebra))
+    invalidate_user_data(user_pk)
+
+
+def run(repeats: int) -> dict:
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import override_settings
+    from IIdle.consts import ORM_ENGINE, MEMORY_ENGINE
+    from IIdle.rng import random_source
+
+    user_pk = User.objects.get_or_create(username='benchmark')[0].pk
+    results = {}
+    for engine in (ORM_ENGINE, MEMORY_ENGINE):
+        with override_settings(IIDLE_ENGINE=engine):
+            for name, action, day, hour in scenarios():
+                seconds, counts = [], set()
+                for _ in range(repeats):
+                    reset(user_pk, day, hour)
+                    user = User.objects.select_related('data').get(pk=user_pk)
+                    counter = WriteCounter()
+                    # Same rolls on every repeat and run, so queries and rows only change with the code
+                    with random_source(name), connection.execute_wrapper(counter):
+                        start = perf_counter()
+                        action.process(user)
+                        seconds.append(perf_counter() - start)
+                    counts.add((counter.queries, counter.rows))
+                # They are compared to the baseline without a tolerance, so they have to be exact
+                if len(counts) > 1:
+                    raise RuntimeError(f'{engine}: {name} gave different (queries, rows) across repeats: '
+                                       f'{sorted(counts)}')
+                (queries, rows), = counts
+                results[f'{engine}: {name}'] = {'ms': median(seconds) * 1000, 'queries': queries, 'rows': rows}
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> (list, list):
+    """Table rows of the results next to the baseline and the names of actions that got slower or write more."""
+    rows, regressions = [], []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            rows.append([name, f'{result["ms"]:.3f}', '-', '', f'{result["queries"]:g}', '-', f'{result["rows"]:g}',
+                         '-', 'new'])
+            continue
+        change = result['ms'] / before['ms'] - 1 if before['ms'] else 0
+        regressed = (change > tolerance or result['queries'] > before['queries'] or result['rows'] > before['rows'])
+        if regressed:
+            regressions.append(name)
+        rows.append([name, f'{result["ms"]:.3f}', f'{before["ms"]:.3f}', f'{change:+.0%}', f'{result["queries"]:g}',
+                     f'{before["queries"]:g}', f'{result["rows"]:g}', f'{before["rows"]:g}',
+                     'SLOWER' if regressed else ''])
+    return rows, regressions
+
+
+def main():
+    parser = ArgumentParser(description='Time, queries and rows written by every action, compared to a baseline')
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--save', metavar='FILE', help='save the results as a baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compare the results to a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown allowed before an action is flagged, more queries or rows always are')
+    args = parser.parse_args()
+    setup_django()
+    with test_database():
+        results = run(args.repeats)
+
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump({'revision': git_revision(), 'results': results}, output, indent=2)
+    if not args.baseline:
+        print_table(['action', 'ms', 'queries', 'rows'],
+                    [[name, f'{result["ms"]:.3f}', f'{result["queries"]:g}', f'{result["rows"]:g}']
+                     for name, result in results.items()])
+        return
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    rows, regressions = compare(results, baseline['results'], args.tolerance)
+    revision = baseline.get('revision') or {}
+    print(f'Baseline: {revision.get("branch")} at {revision.get("commit")}')
+    print_table(['action', 'ms', 'baseline', 'change', 'queries', 'baseline', 'rows', 'baseline', ''], rows)
+    if regressions:
+        print(f'{len(regressions)} action(s) got slower than the baseline')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+from argparse import ArgumentParser
+from datetime import datetime, timezone, timedelta
+
+from benchmarks.utils import setup_django, test_database, measure, print_table
+
+SCHEDULE = ['Sleep', 'Sleep', 'Sleep', 'Sleep', 'Sleep', 'Sleep', 'Work', 'Work', 'Logic', 'Calculus I',
+            'Learn Math', 'Relax']
+
+
+def seed_user(username: str, hours: int):
+    from django.contrib.auth.models import User
+    from IIdle.models import Timetable, UserData
+
+    user = User.objects.create(username=username)
+    UserData.objects.filter(user=user).update(hour=20)
+    start = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+    Timetable.objects.bulk_create(
+        Timetable(user=user, action=SCHEDULE[hour % len(SCHEDULE)], time=start + timedelta(seconds=hour))
+        for hour in range(hours)
+    )
+    return User.objects.get(pk=user.pk)
+
+
+def run(hours: int, repeats: int):
+    from django.test.utils import override_settings
+    from IIdle.consts import ORM_ENGINE, MEMORY_ENGINE
+    from IIdle.timetable_processor import process_timetable
+
+    rows = []
+    for engine in (ORM_ENGINE, MEMORY_ENGINE):
+        queries, seconds = 0, 0
+        with override_settings(IIDLE_ENGINE=engine):
+            for repeat in range(repeats):
+                user = seed_user(f'{engine}-{repeat}', hours)
+                with measure() as result:
+                    process_timetable(user)
+                queries += result['queries']
+                seconds += result['seconds']
+        rows.append([engine, hours, queries // repeats, f'{seconds / repeats * 1000:.1f}'])
+    print_table(['engine', 'entries', 'queries', 'ms'], rows)
+
+
+def main():
+    parser = ArgumentParser(description='Query count and time of catching up on a due timetable')
+    parser.add_argument('--hours', type=int, default=12)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+    setup_django()
+    with test_database():
+        run(args.hours, args.repeats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import logging
+from argparse import ArgumentParser
+from datetime import datetime, timezone, timedelta
+from threading import Barrier, Thread
+from time import perf_counter
+
+from benchmarks.utils import setup_django, test_database, print_table, QueryCounter
+
+ENDPOINTS = ['userdata', 'timetable', 'courses', 'classes', 'abilities', 'messages']
+
+
+def seed_users(count: int, prefix: str) -> list:
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+    from IIdle.models import Timetable, UserData
+
+    users = []
+    due = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+    for index in range(count):
+        user = User.objects.create(username=f'{prefix}-{index}')
+        Timetable.objects.bulk_create(
+            Timetable(user=user, action='Sleep', time=due + timedelta(seconds=hour)) for hour in range(12)
+        )
+        UserData.objects.filter(user=user).update(next_due=due)
+        users.append((user.pk, Token.objects.create(user=user).key))
+    return users
+
+
+def poll(pk: int, token: str, endpoint: str, barrier: Barrier, counter: QueryCounter, errors: list):
+    from django.db import connection
+    from django.test import Client
+
+    # The test client re-raises server errors through a global signal, which mixes them up between threads
+    client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=f'Token {token}')
+    barrier.wait()
+    try:
+        with connection.execute_wrapper(counter):
+            response = client.get(f'/{endpoint}/{pk}/')
+        if response.status_code != 200:
+            errors.append(response.status_code)
+    finally:
+        connection.close()
+
+
+def run_round(users: list) -> dict:
+    from IIdle.models import Message
+
+    counter, errors = QueryCounter(), []
+    barrier = Barrier(len(users) * len(ENDPOINTS))
+    threads = [Thread(target=poll, args=(pk, token, endpoint, barrier, counter, errors))
+               for pk, token in users for endpoint in ENDPOINTS]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'seconds': perf_counter() - start,
+        'queries': counter.count,
+        'errors': len(errors),
+        'messages': Message.objects.filter(user_id__in=[pk for pk, _ in users]).count(),
+    }
+
+
+def run(users: int):
+    from django.core.cache import cache
+    from django.test.utils import override_settings
+
+    rows = []
+    for guarded in (False, True):
+        cache.clear()
+        with override_settings(IIDLE_PROCESSING_GUARD=guarded):
+            result = run_round(seed_users(users, f'guarded-{guarded}'))
+        rows.append(['on' if guarded else 'off', users, len(ENDPOINTS), result['queries'], result['errors'],
+                     result['messages'], f'{result["seconds"] * 1000:.0f}'])
+    print_table(['guard', 'users', 'requests/user', 'queries', 'errors', 'messages', 'ms'], rows)
+
+
+def main():
+    parser = ArgumentParser(description='Clients fetching all their endpoints at once while a catch-up is pending')
+    parser.add_argument('--users', type=int, default=5)
+    args = parser.parse_args()
+    setup_django()
+    # Failed requests are counted in the report, their tracebacks would only drown it
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    with test_database(on_disk=True):
+        run(args.users)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+import json
+import logging
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict, Counter
+from datetime import datetime, timezone, timedelta
+from http.client import HTTPConnection
+from threading import Barrier, Lock, Thread, local
+from time import perf_counter, sleep
+
+from benchmarks.utils import setup_django, test_database, print_table, git_revision, percentile
+
+PASSWORD = 'password'
+
+
+def parse_body(content_type: str, content: bytes):
+    # Server errors come back as HTML pages, they are only counted
+    return json.loads(content) if content and content_type.startswith('application/json') else None
+
+
+def api_routes() -> (list, list):
+    """Routes of our API views from backend.urls, split into the ones clients poll and the ones they post to."""
+    from django.urls import URLResolver
+    from backend.urls import urlpatterns
+
+    get_routes, post_routes = [], []
+    for pattern in urlpatterns:
+        if isinstance(pattern, URLResolver) or not hasattr(pattern.callback, 'view_class'):
+            continue
+        route = str(pattern.pattern)
+        (get_routes if hasattr(pattern.callback.view_class, 'get') else post_routes).append(route)
+    return get_routes, post_routes
+
+
+def seed_users(count: int) -> list:
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from IIdle.models import Timetable, UserData
+
+    password = make_password(PASSWORD)
+    due = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+    users = []
+    for index in range(count):
+        user = User.objects.create(username=f'load-{index}', password=password)
+        # A backlog to catch up on during the first polls
+        Timetable.objects.bulk_create(
+            Timetable(user=user, action='Sleep', time=due + timedelta(seconds=hour)) for hour in range(12)
+        )
+        UserData.objects.filter(user=user).update(next_due=due)
+        users.append(user.username)
+    return users
+
+
+class QueryTally:
+    """Counts the queries of every request on the server side, grouped by route."""
+
+    def __init__(self):
+        self.queries = defaultdict(list)
+        self._local = local()
+        self._lock = Lock()
+
+    def install(self):
+        from django.core.signals import request_started, request_finished
+        from django.db.backends.signals import connection_created
+
+        connection_created.connect(self.connection_created, weak=False)
+        request_started.connect(self.request_started, weak=False)
+        request_finished.connect(self.request_finished, weak=False)
+
+    def connection_created(self, sender, connection, **kwargs):
+        # Fired again whenever a thread reconnects, with the same wrapper object
+        if self.count not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self.count)
+
+    def count(self, execute, sql, params, many, context):
+        if getattr(self._local, 'route', None) is not None:
+            self._local.count += 1
+        return execute(sql, params, many, context)
+
+    def request_started(self, sender, environ, **kwargs):
+        from django.urls import resolve, Resolver404
+
+        try:
+            self._local.route = resolve(environ['PATH_INFO']).route
+        except Resolver404:
+            self._local.route = environ['PATH_INFO']
+        self._local.count = 0
+
+    def request_finished(self, sender, **kwargs):
+        route = getattr(self._local, 'route', None)
+        if route is None:
+            return
+        with self._lock:
+            self.queries[route].append(self._local.count)
+        self._local.route = None
+
+
+class TestClientTransport:
+    def __init__(self):
+        from django.test import Client
+
+        # The test client re-raises server errors through a global signal, which mixes them up between threads
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method: str, path: str, body=None, headers: dict = None) -> (int, dict, object):
+        extra = {f'HTTP_{key.upper().replace("-", "_")}': value for key, value in (headers or {}).items()}
+        if method == 'GET':
+            response = self.client.get(path, **extra)
+        else:
+            response = self.client.post(path, json.dumps(body), content_type='application/json', **extra)
+        headers = {key.lower(): value for key, value in response.items()}
+        return response.status_code, headers, parse_body(headers.get('content-type', ''), response.content)
+
+    def close(self):
+        from django.db import connection
+
+        connection.close()
+
+
+class HttpTransport:
+    def __init__(self, host: str, port: int):
+        self.connection = HTTPConnection(host, port)
+
+    def request(self, method: str, path: str, body=None, headers: dict = None) -> (int, dict, object):
+        headers = {'Content-Type': 'application/json', **(headers or {})}
+        self.connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = self.connection.getresponse()
+        content = response.read()
+        headers = {key.lower(): value for key, value in response.getheaders()}
+        return response.status, headers, parse_body(headers.get('content-type', ''), content)
+
+    def close(self):
+        self.connection.close()
+
+
+def live_server():
+    from django.core.servers.basehttp import ThreadedWSGIServer
+    from django.test.testcases import LiveServerThread, QuietWSGIRequestHandler
+
+    class RequestHandler(QuietWSGIRequestHandler):
+        # Headers and body are written separately, with Nagle every keep-alive request waits for a delayed ACK
+        disable_nagle_algorithm = True
+
+    class ServerThread(LiveServerThread):
+        def _create_server(self):
+            return ThreadedWSGIServer((self.host, self.port), RequestHandler, allow_reuse_address=False)
+
+    return ServerThread('localhost', lambda application: application)
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self._lock = Lock()
+
+    def record(self, route: str, seconds: float, status: int):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+
+
+def client_loop(transport, username: str, loops: int, use_etags: bool, think_seconds: float, barrier: Barrier,
+                results: Results, get_routes: list):
+    def call(route: str, method: str, body=None, headers: dict = None, pk: int = None):
+        path = '/' + route.replace('<int:pk>', str(pk))
+        start = perf_counter()
+        status, response_headers, data = transport.request(method, path, body, {**auth, **(headers or {})})
+        results.record(route, perf_counter() - start, status)
+        return status, response_headers, data
+
+    auth, etags = {}, {}
+    barrier.wait()
+    try:
+        status, _, data = call('get_token/', 'POST', {'username': username, 'password': PASSWORD})
+        if status != 200:
+            return
+        pk, auth = data['pk'], {'Authorization': f'Token {data["token"]}'}
+        for _ in range(loops):
+            status, _, valid_actions = call('get_valid_actions/<int:pk>/', 'GET', pk=pk)
+            if status == 200:
+                timetable = [{'hour': hour['hour'], 'action': 'Sleep'} for hour in valid_actions]
+                call('set_timetable/<int:pk>/', 'POST', timetable, pk=pk)
+            for route in get_routes:
+                headers = {'If-None-Match': etags[route]} if use_etags and route in etags else {}
+                _, response_headers, _ = call(route, 'GET', headers=headers, pk=pk)
+                if 'etag' in response_headers:
+                    etags[route] = response_headers['etag']
+            call('clearmessages/<int:pk>/', 'POST', pk=pk)
+            sleep(think_seconds)
+    finally:
+        transport.close()
+
+
+def run(users: int, loops: int, transport_name: str, use_etags: bool, think_seconds: float) -> dict:
+    from django.test.utils import override_settings
+
+    usernames = seed_users(users)
+    get_routes, _ = api_routes()
+    tally = QueryTally()
+    tally.install()
+    server = None
+    if transport_name == 'server':
+        server = live_server()
+        server.daemon = True
+        server.start()
+        server.is_ready.wait()
+        if server.error:
+            raise server.error
+
+    def make_transport():
+        return HttpTransport('localhost', server.port) if server else TestClientTransport()
+
+    results = Results()
+    barrier = Barrier(users)
+    threads = [Thread(target=client_loop, args=(make_transport(), username, loops, use_etags, think_seconds,
+                                                barrier, results, get_routes))
+               for username in usernames]
+    with override_settings(ALLOWED_HOSTS=['*']):
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = perf_counter() - start
+    if server:
+        server.terminate()
+
+    endpoints = {}
+    for route, latencies in sorted(results.latencies.items()):
+        queries = tally.queries.get(route, [])
+        statuses = results.statuses[route]
+        endpoints[route] = {
+            'requests': len(latencies),
+            'errors': sum(count for status, count in statuses.items() if status >= 400),
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+            'requests_per_second': len(latencies) / seconds,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'queries_per_request': sum(queries) / len(queries) if queries else None,
+        }
+    requests = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {
+        'revision': git_revision(),
+        'config': {'users': users, 'loops': loops, 'transport': transport_name, 'etags': use_etags,
+                   'think_seconds': think_seconds},
+        'total': {
+            'requests': requests,
+            'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+            'seconds': seconds,
+            'requests_per_second': requests / seconds,
+        },
+        'endpoints': endpoints,
+    }
+
+
+def print_report(report: dict):
+    rows = [[route, endpoint['requests'], endpoint['errors'], f'{endpoint["requests_per_second"]:.1f}',
+             f'{endpoint["p50_ms"]:.1f}', f'{endpoint["p95_ms"]:.1f}', f'{endpoint["p99_ms"]:.1f}',
+             '-' if endpoint['queries_per_request'] is None else f'{endpoint["queries_per_request"]:.1f}']
+            for route, endpoint in report['endpoints'].items()]
+    total = report['total']
+    rows.append(['total', total['requests'], total['errors'], f'{total["requests_per_second"]:.1f}', '', '', '', ''])
+    print_table(['endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'], rows)
+
+
+def main():
+    parser = ArgumentParser(description='Clients setting their timetable and polling every endpoint, '
+                                        'reported per endpoint as JSON')
+    parser.add_argument('--users', type=int, default=10, help='concurrent clients, one thread each')
+    parser.add_argument('--loops', type=int, default=20, help='timetable changes and polls of every client')
+    parser.add_argument('--transport', choices=['client', 'server'], default='client',
+                        help="Django's test client or HTTP against a server started in the background")
+    parser.add_argument('--no-etags', dest='etags', action='store_false', help="don't send If-None-Match")
+    parser.add_argument('--think-ms', type=float, default=0, help='pause of every client between loops')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+    setup_django()
+    # Failed requests are counted in the report, their tracebacks would only drown it
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    logging.getLogger('django.server').setLevel(logging.CRITICAL)
+    with test_database(on_disk=True):
+        report = run(args.users, args.loops, args.transport, args.etags, args.think_ms / 1000)
+    # The table goes to stderr, so stdout can be piped to a file or jq
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        print_report(report)
+    finally:
+        sys.stdout = stdout
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+from threading import Barrier, Thread
+from time import perf_counter
+
+from benchmarks.concurrent_polls import seed_users
+from benchmarks.load_test import HttpTransport, Results, live_server
+from benchmarks.utils import setup_django, test_database, print_table, percentile
+
+WRITES = ('set_timetable', 'clearmessages')
+
+
+def client(transport: HttpTransport, pk: int, token: str, loops: int, barrier: Barrier, results: Results):
+    auth = {'Authorization': f'Token {token}'}
+
+    def call(route: str, method: str, body=None):
+        start = perf_counter()
+        status, _, data = transport.request(method, f'/{route}/{pk}/', body, auth)
+        results.record(route, perf_counter() - start, status)
+        return status, data
+
+    barrier.wait()
+    try:
+        for _ in range(loops):
+            # Reading the user data catches up on the timetable, which writes as well
+            call('userdata', 'GET')
+            status, valid_actions = call('get_valid_actions', 'GET')
+            if status == 200:
+                call('set_timetable', 'POST', [{'hour': hour['hour'], 'action': 'Sleep'} for hour in valid_actions])
+            call('clearmessages', 'POST')
+    finally:
+        transport.close()
+
+
+def worker(clients: int, loops: int) -> dict:
+    """Runs in a process of its own, so the settings are read with the profile from the environment."""
+    from django.conf import settings
+    from django.test.utils import override_settings
+
+    setup_django()
+    # Failed requests are counted in the report, their tracebacks would only drown it
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    logging.getLogger('django.server').setLevel(logging.CRITICAL)
+    with test_database(on_disk=True):
+        users = seed_users(clients, 'sqlite')
+        server = live_server()
+        server.daemon = True
+        server.start()
+        server.is_ready.wait()
+        results = Results()
+        barrier = Barrier(clients)
+        threads = [
+            Thread(target=client, args=(HttpTransport('localhost', server.port), pk, token, loops, barrier, results))
+            for pk, token in users
+        ]
+        with override_settings(ALLOWED_HOSTS=['*']):
+            start = perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = perf_counter() - start
+        server.terminate()
+
+    latencies = [latency for route_latencies in results.latencies.values() for latency in route_latencies]
+    return {
+        'profile': settings.IIDLE_DB_PROFILE,
+        'requests': len(latencies),
+        'errors': sum(count for statuses in results.statuses.values()
+                      for status, count in statuses.items() if status >= 400),
+        'writes_per_second': sum(results.statuses[route][200] for route in WRITES) / seconds,
+        'requests_per_second': len(latencies) / seconds,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Concurrent clients writing through a server on the default and the '
+                                        'production SQLite profile')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--loops', type=int, default=10)
+    parser.add_argument('--worker', action='store_true', help='run a single profile, set by IIDLE_DB_PROFILE')
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(worker(args.clients, args.loops)))
+        return
+
+    rows = []
+    for profile in ('default', 'production'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.sqlite_profile', '--worker', '--clients', str(args.clients),
+             '--loops', str(args.loops)],
+            env={**os.environ, 'IIDLE_DB_PROFILE': profile}, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        rows.append([result['profile'], args.clients, result['requests'], result['errors'],
+                     f'{result["writes_per_second"]:.0f}', f'{result["requests_per_second"]:.0f}',
+                     f'{result["p50_ms"]:.1f}', f'{result["p99_ms"]:.1f}'])
+    print_table(['profile', 'clients', 'requests', 'errors', 'writes/s', 'req/s', 'p50 ms', 'p99 ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
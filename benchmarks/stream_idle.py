@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from argparse import ArgumentParser
+from time import perf_counter, process_time
+
+from benchmarks.utils import setup_django, test_database, print_table, QueryCounter
+
+CONNECT_TIMEOUT = 60
+
+
+def seed_users(count: int) -> list:
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+
+    # Nothing planned, the clients stay idle once they are connected
+    users = [User.objects.create(username=f'stream-{index}') for index in range(count)]
+    return [(user.pk, Token.objects.create(user=user).key) for user in users]
+
+
+async def stream_client(pk: int, token: str, connected: asyncio.Event, done: asyncio.Event):
+    from backend.asgi import application
+
+    async def receive():
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.body' and message['body'].startswith(b'event: state'):
+            connected.set()
+
+    scope = {'type': 'http', 'method': 'GET', 'path': f'/stream/{pk}/', 'query_string': b'',
+             'headers': [(b'host', b'localhost'), (b'authorization', f'Token {token}'.encode())]}
+    await application(scope, receive, send)
+
+
+async def polling_client(pk: int, token: str, interval: float, done: asyncio.Event):
+    from django.test import AsyncClient
+
+    client = AsyncClient(raise_request_exception=False)
+    headers = [(b'host', b'testserver'), (b'authorization', f'Token {token}'.encode())]
+    etag = None
+    while not done.is_set():
+        conditional = [(b'if-none-match', etag.encode())] if etag else []
+        response = await client.get(f'/userdata/{pk}/', headers=headers + conditional)
+        etag = response.get('ETag', etag)
+        try:
+            await asyncio.wait_for(done.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def idle(clients, seconds: float, counter: QueryCounter) -> (float, int):
+    """CPU seconds and queries of the clients over an idle window, after all of them have connected."""
+    done = asyncio.Event()
+    connected = [asyncio.Event() for _ in clients]
+    tasks = [asyncio.get_running_loop().create_task(client(event, done)) for client, event in zip(clients, connected)]
+    await asyncio.wait_for(asyncio.gather(*(event.wait() for event in connected)), CONNECT_TIMEOUT)
+    cpu, queries = process_time(), counter.count
+    await asyncio.sleep(seconds)
+    cpu, queries = process_time() - cpu, counter.count - queries
+    done.set()
+    await asyncio.gather(*tasks)
+    return cpu, queries
+
+
+def run(clients: int, seconds: float, interval: float):
+    from django.db.backends.signals import connection_created
+    from django.test.utils import override_settings
+
+    counter = QueryCounter()
+
+    def count_queries(sender, connection, **kwargs):
+        if counter not in connection.execute_wrappers:
+            connection.execute_wrappers.append(counter)
+
+    connection_created.connect(count_queries, weak=False)
+    users = seed_users(clients)
+
+    def polling(pk, token):
+        async def client(connected, done):
+            # Polling clients count as connected right away
+            connected.set()
+            await polling_client(pk, token, interval, done)
+
+        return client
+
+    def streaming(pk, token):
+        return lambda connected, done: stream_client(pk, token, connected, done)
+
+    rows = []
+    with override_settings(ROOT_URLCONF='backend.asgi_urls'):
+        for name, make_client in ((f'poll every {interval:g}s', polling), ('stream', streaming)):
+            start = perf_counter()
+            cpu, queries = asyncio.run(idle([make_client(pk, token) for pk, token in users], seconds, counter))
+            rows.append([name, clients, f'{seconds:g}', f'{cpu:.2f}', f'{cpu / seconds:.1%}', queries,
+                         f'{perf_counter() - start:.1f}'])
+    print_table(['mode', 'clients', 'idle s', 'cpu s', 'cpu', 'queries', 'total s'], rows)
+
+
+def main():
+    parser = ArgumentParser(description='CPU time and queries of idle clients, polling compared to streaming')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=10, help='length of the idle window')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between the polls of polling clients')
+    args = parser.parse_args()
+    setup_django()
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    with test_database(on_disk=True):
+        run(args.clients, args.seconds, args.interval)
+
+
+if __name__ == '__main__':
+    main()
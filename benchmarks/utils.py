@@ -0,0 +1,74 @@
+import os
+import subprocess
+from contextlib import contextmanager
+from tempfile import mkdtemp
+from threading import Lock
+from time import perf_counter
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    django.setup()
+
+
+@contextmanager
+def test_database(on_disk: bool = False):
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    if on_disk:
+        # Threads get their own connections, which only see each other's writes in a database file
+        connection.settings_dict['TEST']['NAME'] = os.path.join(mkdtemp(), 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+@contextmanager
+def measure():
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    result = {}
+    with CaptureQueriesContext(connection) as queries:
+        start = perf_counter()
+        yield result
+        result['seconds'] = perf_counter() - start
+    result['queries'] = len(queries)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values: list, fraction: float) -> float:
+    # Nearest rank, good enough for latency reports
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def print_table(header: list, rows: list):
+    widths = [max(len(str(value)) for value in column) for column in zip(header, *rows)]
+    for row in [header, *rows]:
+        print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)))
+
+
+def git_revision() -> dict:
+    def run(*args):
+        result = subprocess.run(['git', *args], capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    return {'branch': run('rev-parse', '--abbrev-ref', 'HEAD'), 'commit': run('rev-parse', '--short', 'HEAD')}
@@ -0,0 +1,79 @@
+from argparse import ArgumentParser
+from timeit import timeit
+
+from benchmarks.utils import setup_django, print_table
+
+TIMETABLE = [{'hour': hour, 'action': action} for hour, action in enumerate(
+    ['Sleep', 'Sleep', 'Sleep', 'Sleep', 'Sleep', 'Sleep', 'Work', 'Work', 'Logic', 'Calculus I', 'Learn Math', 'Relax']
+)]
+
+
+def rebuilt_valid_actions(user) -> list:
+    # How the valid actions were listed before they were precomputed
+    from IIdle.actions import ACTION_TO_CLASS, Class
+    from IIdle.consts import HOURS_IN_DAY
+
+    current_hour = user.data.hour
+    valid_hours = [hour % HOURS_IN_DAY for hour in range(current_hour, current_hour + 12)]
+    return [
+        {'hour': hour,
+         'actions': [
+             {'name': action.name, 'semester': getattr(action, 'semester', None)}
+             for action in ACTION_TO_CLASS.values()
+             if ((action.time is None or hour in action.time)
+                 and (not issubclass(action, Class) or action.semester % 2 == user.data.semester() % 2))
+         ]}
+        for hour in valid_hours
+    ]
+
+
+def rebuilt_validation(user, data: list) -> list:
+    # How a timetable was validated before the valid actions were precomputed
+    from IIdle.actions import ACTION_TO_CLASS, Class, EndDay, FinishSemester
+    from IIdle.consts import HOURS_IN_DAY
+
+    current_hour = user.data.hour
+    valid_hours = [hour % HOURS_IN_DAY for hour in range(current_hour, current_hour + 12)]
+    actions_and_times = []
+    for action in data:
+        action_hour = int(action['hour'])
+        action_class = ACTION_TO_CLASS[action['action']]
+        if (action_hour not in valid_hours
+                or action_class is EndDay or action_class is FinishSemester
+                or action_class.time is not None and action_hour not in action_class.time
+                or issubclass(action_class, Class) and action_class.semester % 2 != user.data.semester() % 2):
+            return []
+        actions_and_times.append({'action': action['action'], 'time': action_hour})
+    actions_and_times.sort(key=lambda x: valid_hours.index(x['time']))
+    return actions_and_times
+
+
+def run(number: int):
+    from django.contrib.auth.models import User
+    from IIdle.models import UserData
+    from IIdle.timetable_processor import list_valid_actions, validate_timetable
+
+    user = User(username='benchmark')
+    user.data = UserData(user=user)
+    cases = [
+        ('list valid actions', rebuilt_valid_actions, list_valid_actions, (user,)),
+        ('validate 12 entries', rebuilt_validation, validate_timetable, (user, TIMETABLE)),
+    ]
+    rows = []
+    for name, before, after, args in cases:
+        before_us = timeit(lambda: before(*args), number=number) / number * 1e6
+        after_us = timeit(lambda: after(*args), number=number) / number * 1e6
+        rows.append([name, f'{before_us:.1f}', f'{after_us:.1f}', f'{before_us / after_us:.1f}x'])
+    print_table(['operation', 'rebuilt us', 'precomputed us', 'speedup'], rows)
+
+
+def main():
+    parser = ArgumentParser(description='Listing and validating actions with and without the precomputed table')
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+    setup_django()
+    run(args.number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import threading
+from argparse import ArgumentParser
+from threading import Barrier, Thread
+from time import perf_counter
+
+from benchmarks.concurrent_polls import seed_users
+from benchmarks.utils import setup_django, test_database, print_table, percentile
+
+ROUTES = ['userdata', 'timetable', 'courses', 'classes', 'abilities', 'messages', 'state', 'get_valid_actions']
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.peak_threads = threading.active_count()
+
+    def record(self, seconds: float, status: int):
+        self.latencies.append(seconds)
+        self.errors += status != 200
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+
+
+def wsgi_client(pk: int, token: str, polls: int, barrier: Barrier, results: Results):
+    from django.db import connection
+    from django.test import Client
+
+    # The test client re-raises server errors through a global signal, which mixes them up between threads
+    client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=f'Token {token}')
+    barrier.wait()
+    try:
+        for _ in range(polls):
+            for route in ROUTES:
+                start = perf_counter()
+                response = client.get(f'/{route}/{pk}/')
+                results.record(perf_counter() - start, response.status_code)
+    finally:
+        connection.close()
+
+
+def run_wsgi(users: list, polls: int) -> Results:
+    # A thread per connected client, like a threaded WSGI server
+    results = Results()
+    barrier = Barrier(len(users))
+    threads = [Thread(target=wsgi_client, args=(pk, token, polls, barrier, results)) for pk, token in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+async def asgi_client(pk: int, token: str, polls: int, results: Results):
+    from django.test import AsyncClient
+
+    client = AsyncClient(raise_request_exception=False)
+    headers = [(b'host', b'testserver'), (b'authorization', f'Token {token}'.encode())]
+    for _ in range(polls):
+        for route in ROUTES:
+            start = perf_counter()
+            response = await client.get(f'/{route}/{pk}/', headers=headers)
+            results.record(perf_counter() - start, response.status_code)
+
+
+def run_asgi(users: list, polls: int) -> Results:
+    from django.test.utils import override_settings
+
+    # All clients on one event loop, the views run in the read pool
+    async def run_clients():
+        await asyncio.gather(*(asgi_client(pk, token, polls, results) for pk, token in users))
+
+    results = Results()
+    with override_settings(ROOT_URLCONF='backend.asgi_urls'):
+        asyncio.run(run_clients())
+    return results
+
+
+def run(clients: int, polls: int):
+    from django.core.cache import cache
+
+    rows = []
+    for name, run_clients in (('wsgi', run_wsgi), ('asgi', run_asgi)):
+        cache.clear()
+        # Fresh users with a backlog to catch up on, so both have the same work to do
+        users = seed_users(clients, name)
+        start = perf_counter()
+        results = run_clients(users, polls)
+        seconds = perf_counter() - start
+        latencies = results.latencies
+        rows.append([name, clients, len(latencies), results.errors, f'{len(latencies) / seconds:.0f}',
+                     *(f'{percentile(latencies, fraction) * 1000:.1f}' for fraction in (0.5, 0.95, 0.99)),
+                     results.peak_threads])
+    print_table(['server', 'clients', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'threads'], rows)
+
+
+def main():
+    parser = ArgumentParser(description='Concurrent clients polling the read endpoints through WSGI and ASGI')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--polls', type=int, default=5, help='rounds over all read endpoints of every client')
+    args = parser.parse_args()
+    setup_django()
+    # Failed requests are counted in the report, their tracebacks would only drown it
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    with test_database(on_disk=True):
+        run(args.clients, args.polls)
+
+
+if __name__ == '__main__':
+    main()